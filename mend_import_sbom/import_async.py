@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+from mend_import_sbom._version import __tool_name__
+
+try:
+    import aiohttp
+except ImportError:  # Optional dependency: pip install mend-import-sbom[async]
+    aiohttp = None
+
+logger = logging.getLogger(__tool_name__)
+
+DFLT_CONCURRENCY = 50
+
+
+class AsyncMendClient:  # aiohttp client running its own event loop in a background thread
+    def __init__(self, concurrency: int = DFLT_CONCURRENCY, rate_limit: float = 0, retries: int = 3,
+                 backoff: float = 1, retry_statuses=(429, 500, 502, 503, 504), upload_retry_statuses=(429, 503),
+                 connect_timeout: float = 10, read_timeout: float = 120, proxy: str = ""):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for async engine. Install it with: pip install mend-import-sbom[async]")
+        self.concurrency = max(concurrency, 1)
+        self.rate_limit = rate_limit  # Requests per second for every host, 0 means no limit
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_statuses = retry_statuses
+        self.upload_retry_statuses = upload_retry_statuses  # Statuses of requests which were not processed
+        self.timeout = (connect_timeout, read_timeout)
+        self.proxy = proxy if proxy else None
+        self._next_slot = {}  # host -> loop time when next request is allowed
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async_client", daemon=True)
+        self._thread.start()
+        self.run(self._open())
+
+    async def _open(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]))
+
+    async def _wait_rate_limit(self, host: str):
+        if self.rate_limit > 0:
+            now = self.loop.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1 / self.rate_limit
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+    async def request(self, url: str, data: str, headers: dict, method: str = "POST", idempotent: bool = True) -> str:
+        """Not idempotent request, like update request, is retried just if it was not sent or not processed"""
+        host = urlsplit(url).netloc
+        retry_statuses = self.retry_statuses if idempotent else self.upload_retry_statuses
+        retry_errors = (aiohttp.ClientError, asyncio.TimeoutError) if idempotent else aiohttp.ClientConnectorError
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                await self._wait_rate_limit(host)
+                delay = self.backoff * 2 ** attempt
+                try:
+                    async with self.session.request(method, url, data=data, headers=headers, proxy=self.proxy) as resp:
+                        text = await resp.text()
+                        if resp.status in retry_statuses and attempt < self.retries:
+                            retry_after = resp.headers.get("Retry-After", "")
+                            delay = float(retry_after) if retry_after.isdigit() else delay
+                            logger.debug('HTTP %s from %s, retrying in %s seconds', resp.status, host, delay)
+                        else:
+                            if resp.status >= 400:
+                                logger.error('Mend API request failed: HTTP %s %s', resp.status, resp.reason)
+                            return text
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    if attempt >= self.retries or not isinstance(err, retry_errors):
+                        logger.error('Mend API request failed: %r', err)
+                        return ""
+                    logger.debug('Request to %s failed: %r, retrying in %s seconds', host, err, delay)
+                await asyncio.sleep(delay)
+        return ""
+
+    def submit(self, coro):  # Schedule coroutine on the client loop, returns concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    def close(self):
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
@@ -0,0 +1,453 @@
+import argparse
+import csv
+import gc
+import gzip
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from argparse import Namespace
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from mend_import_sbom import import_sbom
+from mend_import_sbom._version import __tool_name__
+from mend_import_sbom.import_cache import MemoryCache
+from mend_import_sbom.import_const import CSV_COLUMNS
+from mend_import_sbom.import_graph import SbomGraph
+from mend_import_sbom.import_stream import load_spdx_stream
+
+logger = logging.getLogger(__tool_name__)
+
+SCENARIOS = ("parse", "graph", "resolve", "upload")
+PKG_TYPES = ("maven", "npm", "pypi", "go", "nuget")
+
+
+def parse_ecosystems(ecosystems: str) -> dict:  # "go:8,npm:2" -> {"go": 8, "npm": 2}
+    res = {}
+    for item_ in filter(None, (e_.strip() for e_ in ecosystems.split(","))):
+        name, _, weight = item_.partition(":")
+        res[name] = int(weight) if weight else 1
+    return res
+
+
+def get_lib_type(i: int, ecosystems: dict = None, seed: int = 0) -> str:  # The same type of package i everywhere
+    if not ecosystems:
+        return PKG_TYPES[i % len(PKG_TYPES)]
+    pick = zlib.crc32(f"{seed}-{i}".encode()) % sum(ecosystems.values())
+    for type_, weight in ecosystems.items():
+        if pick < weight:
+            return type_
+        pick -= weight
+
+
+def generate_packages(packages: int, no_sha1: float = 0.5, seed: int = 0, no_purl: float = 0.0,
+                      ecosystems: dict = None) -> list:
+    """Packages without purl have no file name either, so their type can be found just by searching"""
+    rnd = random.Random(seed)
+    res = []
+    for i in range(packages):
+        pkg_type = get_lib_type(i, ecosystems, seed)
+        pkg_ = {"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": f"1.{i % 10}.0",
+                "licenseConcluded": "MIT"}
+        if rnd.random() >= no_purl:
+            pkg_["packageFileName"] = f"lib{i}-1.{i % 10}.0.{pkg_type}"
+            pkg_["externalRefs"] = [{"referenceCategory": "PACKAGE_MANAGER",
+                                     "referenceLocator": f"pkg:{pkg_type}/lib{i}@1.{i % 10}.0"}]
+        if rnd.random() >= no_sha1:
+            pkg_["checksums"] = [{"algorithm": "SHA1", "checksumValue": f"{zlib.crc32(pkg_['name'].encode()):040x}"}]
+        res.append(pkg_)
+    return res
+
+
+def generate_relationships(packages: int, depth: int = 3, fanout: int = 3) -> list:
+    """Trees of the given depth and fan-out, filled in breadth-first order. A new tree starts when one is full"""
+    rels = []
+    level = {}  # Package index -> level in its tree
+    children = {}  # Package index -> number of its children
+    parents = deque()  # Packages which could still get children, in breadth-first order
+    for i in range(packages):
+        while parents and (level[parents[0]] >= depth - 1 or children[parents[0]] >= fanout):
+            parents.popleft()
+        if parents:
+            rels.append((parents[0], i))
+            children[parents[0]] += 1
+            level[i] = level[parents[0]] + 1
+        else:
+            level[i] = 0
+        children[i] = 0
+        parents.append(i)
+    return [{"spdxElementId": f"SPDXRef-PACKAGE-lib{p}", "relatedSpdxElement": f"SPDXRef-PACKAGE-lib{c}",
+             "relationshipType": "DEPENDS_ON"} for p, c in rels]
+
+
+def generate_spdx(path: str, packages: int = 1000, depth: int = 3, fanout: int = 3, no_sha1: float = 0.5,
+                  files: int = 0, seed: int = 0, no_purl: float = 0.0, ecosystems: dict = None) -> str:
+    sbom = {
+        "spdxVersion": "SPDX-2.3",
+        "SPDXID": "SPDXRef-DOCUMENT",
+        "name": "Benchmark SBOM",
+        "creationInfo": {"creators": ["Tool: import-sbom-bench"], "created": "2024-01-01T00:00:00Z"},
+        "packages": generate_packages(packages, no_sha1, seed, no_purl, ecosystems),
+        "files": [{"SPDXID": f"SPDXRef-FILE-{i}", "fileName": f"./src/file{i}.c",
+                   "checksums": [{"algorithm": "SHA1", "checksumValue": f"{i:040x}"}]} for i in range(files)],
+        "relationships": generate_relationships(packages, depth, fanout)
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(sbom, f)
+    return path
+
+
+def generate_csv(path: str, packages: int = 1000, no_sha1: float = 0.5, seed: int = 0) -> str:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("downloadLocation", *CSV_COLUMNS))
+        for pkg_ in generate_packages(packages, no_sha1, seed):
+            row = {**pkg_, "sha1": pkg_["checksums"][0]["checksumValue"] if "checksums" in pkg_ else ""}
+            writer.writerow(("", *(row.get(col, "") for col in CSV_COLUMNS)))
+    return path
+
+
+class MockMendHandler(BaseHTTPRequestHandler):  # /api/v1.4 and /agent with configurable latency and errors
+    server_version = "MockMend/1.0"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        mock = self.server.mock
+        time.sleep(mock.latency)
+        if mock.is_error():
+            self.respond(503, "Service Unavailable")
+        elif self.path.startswith("/agent"):
+            self.respond(200, json.dumps(mock.get_upload_response(parse_qs(body.decode()))))
+        else:
+            self.respond(200, json.dumps(mock.get_api_response(json.loads(body))))
+
+    def respond(self, status: int, text: str):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args_):
+        pass
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Default backlog of 5 drops connections of concurrent clients
+
+
+class MockMendServer:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, known_share: float = 0.5, seed: int = 0,
+                 lib_types: dict = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.known_share = known_share
+        self.lib_types = lib_types if lib_types else {}  # Library name -> the only type it is found in
+        self.requests = {}  # requestType -> count
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = MockHTTPServer(("127.0.0.1", 0), MockMendHandler)
+        self._server.mock = self
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock_mend", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def is_error(self) -> bool:
+        with self._lock:
+            return self._rnd.random() < self.error_rate
+
+    def count(self, request_type: str):
+        with self._lock:
+            self.requests[request_type] = self.requests.get(request_type, 0) + 1
+
+    def is_known(self, lib_name: str, lib_type: str) -> bool:  # The same answer for the same library in every run
+        return self.lib_types.get(lib_name, lib_type) == lib_type and \
+            zlib.crc32(f"{lib_name}|{lib_type}".encode()) % 1000 < self.known_share * 1000
+
+    def get_api_response(self, req: dict) -> dict:
+        request_type = req.get("requestType", "")
+        self.count(request_type)
+        if request_type == "getBasicLibraryInfo":
+            if self.is_known(req["libraryName"], req["libraryType"]):
+                sha1 = f"{zlib.crc32(json.dumps(req, sort_keys=True).encode()):040x}"
+                self.count("found")
+                return {"librariesInformation": [{"sha1": sha1, "artifactId": req["libraryName"]}]}
+            return {"errorCode": 3010, "errorMessage": "Library not found"}
+        if request_type == "getOrganizationDetails":
+            return {"orgName": "Benchmark", "orgToken": req.get("orgToken", "")}
+        return {"errorCode": 2015, "errorMessage": "Not found"}
+
+    def get_upload_response(self, form: dict) -> dict:
+        self.count("UPDATE")
+        projects = json.loads(form.get("diff", ["[]"])[0])
+        names = [p.get("coordinates", {}).get("artifactId", p.get("projectToken", "")) for p in projects]
+        data = {"createdProjects": names, "updatedProjects": [], "projectNamesToIds": {n: i for i, n in enumerate(names)},
+                "requestToken": "benchmark"}
+        return {"status": 1, "message": "ok", "data": json.dumps(data)}
+
+
+def percentile(values: list, pct: float) -> float:  # Nearest rank
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+class GcTimer:  # Time spent in garbage collection while it is active
+    def __init__(self):
+        self.seconds = 0.0
+        self.collections = 0
+        self._started = 0.0
+
+    def on_gc(self, phase: str, info: dict):
+        if phase == "start":
+            self._started = time.perf_counter()
+        else:
+            self.seconds += time.perf_counter() - self._started
+            self.collections += 1
+
+    def __enter__(self):
+        gc.callbacks.append(self.on_gc)
+        return self
+
+    def __exit__(self, *exc):
+        gc.callbacks.remove(self.on_gc)
+
+
+class RequestTimer:  # Latencies of Mend API calls made by import_sbom while it is active
+    def __init__(self):
+        self.latencies = []
+        self._call_api = None
+
+    def __enter__(self):
+        self._call_api = import_sbom.call_api
+        orig = self._call_api
+
+        def timed_call_api(*args_, **kwargs):
+            started = time.perf_counter()
+            try:
+                return orig(*args_, **kwargs)
+            finally:
+                self.latencies.append(time.perf_counter() - started)
+
+        import_sbom.call_api = timed_call_api
+        client = import_sbom.async_client
+        if client:
+            orig_request = client.request
+
+            async def timed_request(*args_, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await orig_request(*args_, **kwargs)
+                finally:
+                    self.latencies.append(time.perf_counter() - started)
+
+            client.request = timed_request
+        return self
+
+    def __exit__(self, *exc):
+        import_sbom.call_api = self._call_api
+        if import_sbom.async_client:
+            del import_sbom.async_client.request
+
+
+def run_scenario(name: str, func, items: int, repeat: int = 3, setup=None) -> dict:
+    """Time func() repeat times, then run it once more under tracemalloc for peak memory and memory kept after it"""
+    durations = []
+    timer = RequestTimer()
+    gc_timer = GcTimer()
+    with timer, gc_timer:
+        for _ in range(repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    mean = sum(durations) / len(durations)
+    return {
+        "scenario": name,
+        "iterations": repeat,
+        "items": items,
+        "meanSec": round(mean, 4),
+        "p50Sec": round(percentile(durations, 50), 4),
+        "p99Sec": round(percentile(durations, 99), 4),
+        "throughput": round(items / mean, 1) if mean else 0.0,
+        "requests": len(timer.latencies),
+        "requestP50Ms": round(percentile(timer.latencies, 50) * 1000, 2),
+        "requestP99Ms": round(percentile(timer.latencies, 99) * 1000, 2),
+        "peakMemMb": round(peak / 1024 / 1024, 2),
+        "retainedMemMb": round(retained / 1024 / 1024, 2),
+        "gcSec": round(gc_timer.seconds / repeat, 4),
+        "gcCollections": round(gc_timer.collections / repeat, 1)
+    }
+
+
+def get_bench_args(sbom: str, out_dir: str, url: str, bench_args) -> Namespace:
+    return Namespace(ws_user_key="bench-user-key", ws_token="bench-api-key", ws_url=url, ws_project="Benchmark",
+                     scope_token="", ws_product="Benchmark", sbom=sbom, out_dir=out_dir, update_type="OVERRIDE",
+                     offline="false", multilang=bench_args.multilang, threads=bench_args.threads, stream="false",
+                     proxy="", retries=bench_args.retries, connect_timeout=10, read_timeout=120,
+                     concurrency=bench_args.concurrency, rate_limit=0, upload_chunk_size=bench_args.upload_chunk_size,
+                     upload_compression="none", output_format="json", lang_ranking=bench_args.lang_ranking)
+
+
+def run_benchmark(bench_args) -> list:
+    with tempfile.TemporaryDirectory(prefix="import-sbom-bench-") as work_dir:
+        return run_scenarios(bench_args, work_dir)
+
+
+def run_scenarios(bench_args, work_dir: str) -> list:
+    results = []
+    scenarios = [s_.strip() for s_ in bench_args.scenarios.split(",") if s_.strip()]
+    ecosystems = parse_ecosystems(bench_args.ecosystems)
+    spdx_path = generate_spdx(os.path.join(work_dir, "bench-sbom.json"), bench_args.packages, bench_args.depth,
+                              bench_args.fanout, bench_args.no_sha1, bench_args.files, bench_args.seed,
+                              bench_args.no_purl, ecosystems)
+    csv_path = generate_csv(os.path.join(work_dir, "bench-sbom.csv"), bench_args.packages, bench_args.no_sha1,
+                            bench_args.seed)
+    repeat = bench_args.repeat
+
+    if "parse" in scenarios:
+        def parse_json():
+            with open(spdx_path, encoding="utf-8") as f:
+                json.load(f)
+        results.append(run_scenario("parse-json", parse_json, bench_args.packages, repeat))
+        results.append(run_scenario("parse-stream", lambda: load_spdx_stream(spdx_path), bench_args.packages, repeat))
+        results.append(run_scenario("parse-csv", lambda: list(import_sbom.read_csv_packages(csv_path)),
+                                    bench_args.packages, repeat))
+    if "graph" in scenarios:
+        with open(spdx_path, encoding="utf-8") as f:
+            sbom = json.load(f)
+        results.append(run_scenario("graph", lambda: SbomGraph.from_sbom(sbom), bench_args.packages, repeat))
+
+    if "resolve" in scenarios or "upload" in scenarios:
+        lib_types = {f"lib{i}": get_lib_type(i, ecosystems, bench_args.seed) for i in range(bench_args.packages)}
+        with MockMendServer(latency=bench_args.latency / 1000, error_rate=bench_args.error_rate,
+                            known_share=bench_args.known_share, seed=bench_args.seed, lib_types=lib_types) as mock:
+            args_ = get_bench_args(spdx_path, work_dir, mock.url, bench_args)
+            saved = (getattr(import_sbom, "args", None), import_sbom.extract_url, import_sbom.http_session,
+                     import_sbom.upload_session, import_sbom.lib_cache, import_sbom.lib_results, import_sbom.lang_ranker)
+            import_sbom.args = args_
+            import_sbom.extract_url = lambda url: url  # Mock server is plain HTTP
+            import_sbom.http_session = None
+            import_sbom.upload_session = None
+            import_sbom.lib_cache = None
+            try:
+                if bench_args.engine == "async":
+                    import_sbom.open_async_client(args_)
+                output_json = {}
+
+                def resolve():
+                    output_json.update(import_sbom.create_body(args_))
+
+                def clean_results():  # Every iteration resolves and learns everything again
+                    import_sbom.lib_results = MemoryCache()
+                    import_sbom.lang_ranker = None
+
+                if "resolve" in scenarios:
+                    searches = mock.requests.get("getBasicLibraryInfo", 0)
+                    found = mock.requests.get("found", 0)
+                    results.append(run_scenario("resolve", resolve, bench_args.packages, repeat, setup=clean_results))
+                    searches = mock.requests.get("getBasicLibraryInfo", 0) - searches
+                    found = mock.requests.get("found", 0) - found
+                    results[-1]["callsPerResolved"] = round(searches / found, 2) if found else 0.0
+                else:
+                    resolve()
+                if "upload" in scenarios:
+                    deps = sum(len(p["dependencies"]) for p in output_json["projects"])
+                    results.append(run_scenario("upload", lambda: import_sbom.upload_to_mend(output_json, args_),
+                                                deps, repeat))
+                logger.debug('Mock server requests: %s', mock.requests)
+            finally:
+                import_sbom.close_async_client()
+                (import_sbom.args, import_sbom.extract_url, import_sbom.http_session, import_sbom.upload_session,
+                 import_sbom.lib_cache, import_sbom.lib_results, import_sbom.lang_ranker) = saved
+    return results
+
+
+def print_results(results: list):
+    cols = ("scenario", "iterations", "items", "meanSec", "p50Sec", "p99Sec", "throughput", "requests",
+            "requestP50Ms", "requestP99Ms", "peakMemMb", "retainedMemMb", "gcSec", "gcCollections", "callsPerResolved")
+    widths = [max(len(c), *(len(str(r.get(c, "-"))) for r in results)) for c in cols]
+    print("  ".join(c.rjust(w) for c, w in zip(cols, widths)))
+    for res in results:
+        print("  ".join(str(res.get(c, "-")).rjust(w) for c, w in zip(cols, widths)))
+
+
+def parse_bench_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of SBOM import against a local mock of Mend server")
+    parser.add_argument('--packages', help="Number of packages in generated SBOM", type=int, default=1000)
+    parser.add_argument('--depth', help="Depth of dependency trees", type=int, default=3)
+    parser.add_argument('--fanout', help="Children of every dependency", type=int, default=3)
+    parser.add_argument('--noSha1', help="Share of packages without SHA1", dest='no_sha1', type=float, default=0.5)
+    parser.add_argument('--noPurl', help="Share of packages without purl and file name", dest='no_purl', type=float,
+                        default=0)
+    parser.add_argument('--ecosystems', help="Weights of package types, e.g. go:8,npm:2 (default: the same for "
+                                             f"{','.join(PKG_TYPES)})", default='')
+    parser.add_argument('--files', help="Number of files in generated SPDX SBOM", type=int, default=0)
+    parser.add_argument('--knownShare', help="Share of library searches found by mock server", dest='known_share',
+                        type=float, default=0.5)
+    parser.add_argument('--latency', help="Latency of mock server in milliseconds", type=float, default=5)
+    parser.add_argument('--errorRate', help="Share of mock server responses with HTTP 503", dest='error_rate',
+                        type=float, default=0)
+    parser.add_argument('--scenarios', help=f"Comma separated scenarios ({','.join(SCENARIOS)})",
+                        default=",".join(SCENARIOS))
+    parser.add_argument('--repeat', help="Iterations of every scenario", type=int, default=3)
+    parser.add_argument('--threads', help="Threads for library searches", type=int, default=1)
+    parser.add_argument('--engine', help="Mend API client engine (sync|async)", choices=['sync', 'async'],
+                        default='sync')
+    parser.add_argument('--concurrency', help="Maximum number of requests in flight for async engine", type=int,
+                        default=50)
+    parser.add_argument('--langRanking', help="Search library types in the order learned from results",
+                        dest='lang_ranking', default='false')
+    parser.add_argument('--multilang', help="Search library in all possible programming languages", default='true')
+    parser.add_argument('--retries', help="Number of retries for failed requests", type=int, default=3)
+    parser.add_argument('--uploadChunkSize', help="Maximum size of uploaded dependencies per request in KB",
+                        dest='upload_chunk_size', type=float, default=0)
+    parser.add_argument('--seed', help="Seed of generated data and mock errors", type=int, default=0)
+    parser.add_argument('--out', help="Write results to JSON file", default='')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    bench_args = parse_bench_args(argv)
+    logger.setLevel(logging.WARNING)  # Library search messages would be measured too
+    results = run_benchmark(bench_args)
+    print_results(results)
+    if bench_args.out:
+        with open(bench_args.out, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(bench_args), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from mend_import_sbom._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+CACHE_FILE = "lib-cache.db"
+DFLT_CACHE_DIR = ".mend-cache"
+DFLT_CACHE_TTL = 168  # Hours
+DFLT_MEMORY_CACHE_SIZE = 100000  # Library search results kept in memory by a process, e.g. in service mode
+
+
+class MemoryCache:  # Library search results of the process, the least recently used are dropped
+    def __init__(self, max_size: int = DFLT_MEMORY_CACHE_SIZE, ttl: float = DFLT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl * 3600
+        self._items = OrderedDict()  # key -> (time, result), the least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[0] > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: tuple, value: tuple):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LookupCache:  # Persistent storage of getBasicLibraryInfo results
+    def __init__(self, cache_dir: str, ttl: float = DFLT_CACHE_TTL):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self.ttl = ttl * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)  # Access is serialized by the lock
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lib_lookup ("
+                               "url TEXT, name TEXT, version TEXT, lib_type TEXT, "
+                               "sha1 TEXT, artifact_id TEXT, error_code INTEGER, error_msg TEXT, ts REAL, "
+                               "PRIMARY KEY (url, name, version, lib_type))")
+        self.evict()
+
+    def get(self, key: tuple):
+        """Return cached (sha1, artifactId, errorCode, errorMessage) for (url, name, version, libType) or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT sha1, artifact_id, error_code, error_msg, ts FROM lib_lookup "
+                                     "WHERE url=? AND name=? AND version=? AND lib_type=?", key).fetchone()
+        if row and time.time() - row[4] <= self.ttl:
+            self.hits += 1
+            return row[0], row[1], row[2], row[3]
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple, value: tuple):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO lib_lookup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (*key, *value, time.time()))
+
+    def evict(self):
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM lib_lookup WHERE ts < ?", (time.time() - self.ttl,)).rowcount
+        if removed:
+            logger.debug('Removed %s expired entries from library cache: %s', removed, self.path)
+
+    def close(self):
+        logger.debug('Library cache %s: %s hits, %s misses', self.path, self.hits, self.misses)
+        with self._lock:
+            self._conn.close()
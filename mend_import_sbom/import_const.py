@@ -1,5 +1,6 @@
 from enum import Enum
 import os
+import re
 
 
 class aliases(Enum):  # List of aliases for params
@@ -11,6 +12,12 @@ class aliases(Enum):  # List of aliases for params
     output = ("--out","--dir")
     sbom = ("--sbom","--input")
     version = ("--version","-v")
+    cachedir = ("--cacheDir","--cache-dir")
+    nocache = ("--noCache","--no-cache")
+    outputformat = ("--outputFormat","--output-format")
+    uploadfile = ("--uploadFile","--upload-file")
+    libindex = ("--libIndex","--lib-index")
+    libindeximport = ("--libIndexImport","--lib-index-import")
 
     @classmethod
     def get_aliases_str(cls, key):
@@ -45,6 +52,11 @@ class Templates(Enum):  # Specific patterns of lib name and version
     github = (":", "^")
 
 
+# Columns of templates/import_template.csv which are converted to SPDX package properties
+CSV_COLUMNS = ("name", "licenseConcluded", "licenseInfoFromFiles", "licenseDeclared", "copyrightText", "versionInfo",
+               "packageFileName", "supplier", "originator", "sha1", "homepage")
+
+
 class SHA1CalcType(Enum):  # list with supported packages
     maven = ("y", "JAVA", "jar", "maven",1)  # jar
     pypi = ("n", "PYTHON", "whl", "pypi",2)  # whl
@@ -87,33 +99,33 @@ class SHA1CalcType(Enum):  # list with supported packages
 
     @classmethod
     def get_el_by_name(cls, name: str):
-        res = None
-        for el_ in cls:
-            if el_.name == name:
-                res = el_
-                break
-        return res
+        return SHA1_TYPES_BY_NAME.get(name)
 
     @classmethod
     def get_package_data(cls, lng: str):
-        res = ""
-        for el_ in cls:
-            if el_.language == lng:
-                res = el_.lower_case
-                break
-        return res
+        el_ = SHA1_TYPES_BY_LANGUAGE.get(lng)
+        return el_.lower_case if el_ else ""
 
     @classmethod
     def get_package_type(cls, f_t: str):
-        try:
-            return cls.__dict__[f_t]
-        except:
-            return []
+        return SHA1_TYPES_BY_PURL.get(f_t, [])
 
     @classmethod
     def get_package_type_list_by_ext(cls, ext: str):
-        res = []
-        for el_ in cls:
-            if el_.ext == ext:
-                res.append(el_)
-        return res
+        return list(SHA1_TYPES_BY_EXT.get(ext, ()))
+
+
+# Indexes of SHA1CalcType built once. The first type wins if several types have the same language
+SHA1_TYPES_BY_NAME = dict(SHA1CalcType.__members__)
+SHA1_TYPES_BY_PURL = SHA1_TYPES_BY_NAME  # Type of purl is the name of the type
+SHA1_TYPES_BY_LANGUAGE = {el_.language: el_ for el_ in reversed(list(SHA1CalcType))}
+SHA1_TYPES_BY_LIB = {(el_.libtype, el_.ext): el_ for el_ in SHA1CalcType}  # Library type and extension
+SHA1_TYPES_BY_EXT = {ext_: tuple(el_ for el_ in SHA1CalcType if el_.ext == ext_) for ext_ in
+                     dict.fromkeys(el_.ext for el_ in SHA1CalcType)}
+PURL_TYPE_RE = re.compile(r"pkg:(.*?)/", flags=re.DOTALL)
+LOWER_CASE_LIB_TYPES = frozenset(el_.libtype for el_ in SHA1CalcType if el_.lower_case == "y")  # Names of any case
+VERSION_DECORATIONS = "^~="  # Range operators put before version by package managers, e.g. ^1.2.3, ~1.2, ==1.0
+SHA1_POLICIES = ("remote", "local-then-remote", "local")
+# Library types whose Mend key is SHA1 of name_version_LANGUAGE. Others, like maven, npm and pypi, are keyed by SHA1
+# of the artifact itself, which can be found just by Mend search
+LOCAL_SHA1_LIB_TYPES = frozenset(("ocaml", "go", "php", "cocoapods", "cran", "rust", "hex"))
@@ -0,0 +1,154 @@
+import logging
+
+from mend_import_sbom._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+SPDX_PKG_PREFIX = "SPDXRef-PACKAGE-"
+SPDX_DOC_ID = "SPDXRef-DOCUMENT"
+
+
+class SbomGraph:  # Indexes of SPDX elements and relationships, built once per SBOM
+    def __init__(self, packages=(), relationships=(), files=(), describes=()):
+        self.packages = {}  # SPDXID -> package
+        self.files = {}  # SPDXID -> file
+        self.depends_on = {}  # SPDXID -> list of SPDXIDs in relationships order
+        self.dynamic_link_parent = {}  # SPDXID -> first SPDXID which links it dynamically
+        self.contains = {}  # SPDXID -> list of SPDXIDs in relationships order
+        self.describes = []  # SPDXIDs of top level components described by the document
+        self.required = set()  # Every SPDXID which some element depends on
+        self.visited = set()  # Names of the elements which were already added to the dependency tree
+        for pkg_ in packages:
+            self.add_package(pkg_)
+        for file_ in files:
+            self.add_file(file_)
+        for spdx_id in describes:
+            self.add_described(spdx_id)
+        for rel_ in relationships:
+            self.add_relationship(rel_)
+
+    @classmethod
+    def from_sbom(cls, sbom):
+        if not isinstance(sbom, dict):  # Packages list converted from CSV, no relationships
+            return cls(packages=sbom)
+        return cls(packages=sbom.get("packages", []), relationships=sbom.get("relationships", []),
+                   files=sbom.get("files", []), describes=sbom.get("documentDescribes", []))
+
+    def add_package(self, package: dict):
+        spdx_id = package.get("SPDXID") if isinstance(package, dict) else None
+        if spdx_id is not None:
+            self.packages.setdefault(spdx_id, package)  # The first one wins, as it was in linear search
+
+    def add_file(self, file_: dict):
+        spdx_id = file_.get("SPDXID") if isinstance(file_, dict) else None
+        if spdx_id is not None:
+            self.files.setdefault(spdx_id, file_)
+
+    def add_described(self, spdx_id: str):
+        if isinstance(spdx_id, str) and spdx_id not in self.describes:
+            self.describes.append(spdx_id)
+
+    def add_relationship(self, rel: dict):
+        try:
+            rel_type = rel["relationshipType"]
+            parent = rel["spdxElementId"]
+            child = rel["relatedSpdxElement"]
+        except (KeyError, TypeError):
+            return
+        if rel_type == "DEPENDS_ON":
+            self.depends_on.setdefault(parent, []).append(child)
+            self.required.add(child)
+        elif rel_type == "DYNAMIC_LINK":
+            self.dynamic_link_parent.setdefault(child, parent)
+        elif rel_type == "CONTAINS":
+            self.contains.setdefault(parent, []).append(child)
+        elif rel_type == "DESCRIBES" and parent.startswith(SPDX_DOC_ID):
+            self.add_described(child)
+        elif rel_type == "DESCRIBED_BY" and child.startswith(SPDX_DOC_ID):
+            self.add_described(parent)
+
+    def get_children(self, name: str) -> list:  # Children of the element added as artifactId
+        return self.depends_on.get(SPDX_PKG_PREFIX + name, [])
+
+    def is_required(self, name: str) -> bool:
+        return SPDX_PKG_PREFIX + name in self.required
+
+    def get_members(self, roots) -> set:  # SPDXIDs of the roots and of everything they depend on or contain
+        members = set()
+        stack = list(roots)
+        while stack:
+            spdx_id = stack.pop()
+            if spdx_id not in members:
+                members.add(spdx_id)
+                stack.extend(self.depends_on.get(spdx_id, ()))
+                stack.extend(self.contains.get(spdx_id, ()))
+        return members
+
+    def build_trees(self, resolved: dict, max_depth: int = 0, max_nodes: int = 0) -> list:
+        """Dependency trees of resolved packages {SPDXID: dependency}, the same for the same SBOM whatever the order
+        of packages is. Children are sorted, a shared subtree is expanded once and is a leaf elsewhere, relationships
+        back to an ancestor are cut. max_depth and max_nodes (0 is no limit) stop expanding, packages left out by them
+        are added as top level leaves"""
+        def sort_key(spdx_id):
+            dep_ = resolved[spdx_id]
+            return dep_.get("artifactId", ""), dep_.get("version", ""), dep_.get("sha1", ""), spdx_id
+
+        def get_children(spdx_id):
+            return sorted({child for child in self.depends_on.get(spdx_id, ()) if child in resolved}, key=sort_key)
+
+        def get_node(spdx_id):
+            emitted.add(spdx_id)
+            node = resolved[spdx_id].copy()
+            node.pop("children", None)
+            return node
+
+        required = {child for spdx_id in resolved for child in self.depends_on.get(spdx_id, ())
+                    if child in resolved and child != spdx_id}
+        roots = sorted((spdx_id for spdx_id in resolved if spdx_id not in required), key=sort_key)
+        trees = []
+        emitted = set()
+        expanded = set()
+        nodes = cycles = 0
+        while True:
+            if not roots:  # Packages just in cycles have no root, the first of them is taken
+                roots = sorted(set(resolved) - emitted, key=sort_key)[:1]
+                if not roots:
+                    break
+            root = roots.pop(0)
+            if root in expanded:
+                continue
+            tree = get_node(root)
+            trees.append(tree)
+            nodes += 1
+            expanded.add(root)
+            path = {root}
+            stack = [(tree, root, iter(get_children(root)))]
+            while stack:
+                parent, parent_id, children = stack[-1]
+                spdx_id = next(children, None)
+                if spdx_id is None:
+                    stack.pop()
+                    path.discard(parent_id)
+                    continue
+                if spdx_id in path:
+                    cycles += 1
+                    continue
+                if max_nodes and nodes >= max_nodes:
+                    break
+                node = get_node(spdx_id)
+                parent.setdefault("children", []).append(node)
+                nodes += 1
+                if spdx_id not in expanded and (not max_depth or len(stack) < max_depth):
+                    expanded.add(spdx_id)
+                    path.add(spdx_id)
+                    stack.append((node, spdx_id, iter(get_children(spdx_id))))
+            if max_nodes and nodes >= max_nodes:
+                break
+        left = sorted(set(resolved) - emitted, key=sort_key)
+        trees.extend(get_node(spdx_id) for spdx_id in left)
+        if cycles:
+            logger.debug('Dependency trees: %s relationships back to an ancestor were cut', cycles)
+        if left:
+            logger.warning('Dependency trees reached %s nodes, %s packages are added without children', max_nodes,
+                           len(left))
+        return trees
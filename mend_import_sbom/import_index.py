@@ -0,0 +1,94 @@
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from mend_import_sbom._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+INDEX_FILE = "lib-index.db"
+INDEX_COLUMNS = ("libType", "name", "version", "sha1", "artifactId")  # Columns of CSV and NDJSON dumps
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+
+def read_dump_rows(path: str):  # (libType, name, version, sha1, artifactId) from CSV or NDJSON dump
+    with open(path, encoding="utf-8", newline="") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "{":
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    yield tuple(str(rec.get(col, "")) for col in INDEX_COLUMNS)
+        else:
+            for row in csv.DictReader(f):
+                yield tuple(str(row.get(col) or "") for col in INDEX_COLUMNS)
+
+
+def read_sqlite_rows(path: str):  # Other library index or libraries found in library search cache of earlier runs
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if "lib_index" in tables:
+            yield from conn.execute("SELECT lib_type, name, version, sha1, artifact_id FROM lib_index")
+        elif "lib_lookup" in tables:
+            yield from conn.execute("SELECT lib_type, name, version, sha1, artifact_id FROM lib_lookup WHERE sha1 != ''")
+        else:
+            raise ValueError(f"Neither library index nor library search cache: {path}")
+    finally:
+        conn.close()
+
+
+class LibraryIndex:  # Libraries found before: (libType, name, version) -> (sha1, artifactId), kept without expiration
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)  # Access is serialized by the lock
+        self._conn.execute("PRAGMA mmap_size=268435456")  # Lookups read the memory mapped file
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lib_index ("
+                               "lib_type TEXT, name TEXT, version TEXT, sha1 TEXT, artifact_id TEXT, "
+                               "PRIMARY KEY (lib_type, name, version)) WITHOUT ROWID")
+
+    def get(self, lib_type: str, name: str, version: str):
+        """Return (sha1, artifactId) of the library or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT sha1, artifact_id FROM lib_index WHERE lib_type=? AND name=? AND version=?",
+                                     (lib_type, name, version)).fetchone()
+        if row:
+            self.hits += 1
+            return row
+        self.misses += 1
+        return None
+
+    def put(self, lib_type: str, name: str, version: str, sha1: str, artifact_id: str):
+        self.put_many([(lib_type, name, version, sha1, artifact_id)])
+
+    def put_many(self, rows) -> int:
+        rows = [row for row in rows if all(row[:4])]  # Type, name, version and SHA1 are required
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO lib_index VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def import_dump(self, path: str) -> int:
+        """Import CSV or NDJSON dump with INDEX_COLUMNS, other library index or library search cache"""
+        with open(path, "rb") as f:
+            is_sqlite = f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+        imported = self.put_many(read_sqlite_rows(path) if is_sqlite else read_dump_rows(path))
+        logger.info('Library index: %s libraries imported from %s', imported, path)
+        return imported
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM lib_index").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,16 @@
+from mend_import_sbom.import_const import LOWER_CASE_LIB_TYPES, VERSION_DECORATIONS
+
+
+def normalize_version(version: str) -> str:  # "^1.2.3", "~1.2", "==1.0" -> version searched
+    norm = version.strip().lstrip(VERSION_DECORATIONS).strip()
+    return norm if norm else version
+
+
+def normalize_lookup(lib_name: str, lib_ver: str, lib_type: str) -> tuple:
+    """Library search of the library whatever way its name and version were written, by rules of its type"""
+    lib_name = lib_name.strip()
+    return lib_name.lower() if lib_type in LOWER_CASE_LIB_TYPES else lib_name, normalize_version(lib_ver), lib_type
+
+
+def get_lookup(lib_name: str, lib_ver: str, lib_type: str) -> tuple:  # Library search as is
+    return lib_name, lib_ver, lib_type
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from mend_import_sbom._version import __tool_name__
+from mend_import_sbom.import_record import encode_record
+
+logger = logging.getLogger(__tool_name__)
+
+MANIFEST_FILE = "update-request.manifest.json"
+MANIFEST_VERSION = 1
+
+
+def get_hash(obj) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=encode_record).encode("utf-8")).hexdigest()
+
+
+def get_package_hash(package: dict, *context) -> str:  # Context is whatever else affects package resolution
+    return get_hash([package, *context])
+
+
+def get_miss() -> dict:  # Resolution of a package which was not found
+    return {"missed": time.time()}
+
+
+def is_reusable(resolved, ttl: float) -> bool:
+    """Resolution of previous run is used if library was found or was not found in the last ttl seconds. Misses of
+    older manifests have no time, they are searched again"""
+    return resolved is not None and ("missed" not in resolved or time.time() - resolved["missed"] <= ttl)
+
+
+def get_dep_key(dep_: dict) -> str:
+    return f"{dep_.get('artifactId', '')}|{dep_.get('version', '')}|{dep_.get('sha1', '')}"
+
+
+def get_projects_state(projects: list) -> list:  # Project properties and hashes of top level dependencies
+    return [{
+        "project": get_hash({k: v for k, v in proj.items() if k != "dependencies"}),
+        "dependencies": {get_dep_key(dep_): get_hash(dep_) for dep_ in proj.get("dependencies", [])}
+    } for proj in projects]
+
+
+def load_manifest(out_dir: str) -> dict:
+    manifest = {"version": MANIFEST_VERSION, "packages": {}, "projects": [], "updateType": "", "uploaded": False}
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    try:
+        with open(path, encoding="utf-8") as f:
+            prev = json.load(f)
+        if prev.get("version") == MANIFEST_VERSION:
+            manifest.update(prev)
+            logger.debug('Manifest of previous run loaded: %s, %s packages', path, len(manifest["packages"]))
+    except FileNotFoundError:
+        logger.debug('Manifest of previous run not found: %s', path)
+    except Exception as err:
+        logger.warning('Manifest of previous run is ignored: %s', err)
+    manifest["previous"] = {"projects": manifest["projects"], "updateType": manifest["updateType"],
+                            "uploaded": manifest["uploaded"]}
+    return manifest
+
+
+def save_manifest(out_dir: str, manifest: dict, projects: list, update_type: str, uploaded: bool):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    state = {
+        "version": MANIFEST_VERSION,
+        "packages": manifest["packages"],
+        "projects": get_projects_state(projects),
+        "updateType": update_type,
+        "uploaded": uploaded
+    }
+    with open(path, 'w', encoding="utf-8") as f:
+        json.dump(state, f)
+    logger.debug('Manifest saved: %s', path)
+
+
+def is_unchanged(manifest: dict, projects: list) -> bool:
+    prev = manifest["previous"]
+    return prev["uploaded"] and prev["projects"] == get_projects_state(projects)
+
+
+def get_delta(manifest: dict, projects: list):
+    """Projects with just new top level dependencies or None if something was changed or removed since last upload"""
+    prev = manifest["previous"]
+    new_state = get_projects_state(projects)
+    if not prev["uploaded"] or len(prev["projects"]) != len(new_state):
+        return None
+    delta = []
+    for proj, prev_proj, new_proj in zip(projects, prev["projects"], new_state):
+        prev_deps = prev_proj["dependencies"]
+        if prev_proj["project"] != new_proj["project"] or \
+                any(new_proj["dependencies"].get(key_) != hash_ for key_, hash_ in prev_deps.items()):
+            return None
+        added = [dep_ for dep_ in proj.get("dependencies", []) if get_dep_key(dep_) not in prev_deps]
+        if added:
+            delta.append({**{k: v for k, v in proj.items() if k != "dependencies"}, "dependencies": added})
+    return delta
@@ -0,0 +1,175 @@
+import contextvars
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from mend_import_sbom._version import __tool_name__
+
+METRICS_FILE = "run-metrics.json"
+PROMETHEUS_FILE = "run-metrics.prom"
+METRICS_PREFIX = "mend_import_sbom"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds, as Prometheus client default
+REQUEST_TYPE_RE = re.compile(r'"requestType"\s*:\s*"(\w+)"')
+
+
+def get_request_type(data, agent: bool = False) -> str:
+    if agent:
+        return "UPDATE"
+    match_ = REQUEST_TYPE_RE.search(data) if isinstance(data, str) else None
+    return match_.group(1) if match_ else "unknown"
+
+
+class RunMetrics:  # Phase timings and Mend API call statistics of one run, shared by all threads
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Metrics of the import run in this context (batch item or service job), counted there too
+        self._scope = contextvars.ContextVar(f"run_metrics_scope_{id(self)}", default=None)
+        self.started = time.time()
+        self.phases = {}  # name -> {"calls", "wallSec", "cpuSec"}
+        self.api = {}  # requestType -> {"count", "errors", "bytesSent", "bytesReceived", "latencySec", "buckets"}
+        self.cache = {"memoryHits": 0, "indexHits": 0, "diskHits": 0, "misses": 0}
+        self.lang_types_tried = {}  # Number of language types searched for a package -> number of packages
+        self.lookups = {"requested": 0, "unique": 0}  # Library searches of packages and the distinct ones sent
+
+    @contextmanager
+    def scope(self):
+        """New metrics of everything recorded in this context until exit, e.g. by one SBOM of a batch. Threads and
+        coroutines started in the context must run in a copy of it to be counted"""
+        scope = RunMetrics()
+        token = self._scope.set(scope)
+        try:
+            yield scope
+        finally:
+            self._scope.reset(token)
+
+    @contextmanager
+    def phase(self, name: str):  # Phases can be nested, e.g. "tree" is a part of "resolve"
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self.add_phase(name, wall, cpu)
+
+    def add_phase(self, name: str, wall: float, cpu: float):
+        with self._lock:
+            phase_ = self.phases.setdefault(name, {"calls": 0, "wallSec": 0.0, "cpuSec": 0.0})
+            phase_["calls"] += 1
+            phase_["wallSec"] += wall
+            phase_["cpuSec"] += cpu
+        scope = self._scope.get()
+        if scope:
+            scope.add_phase(name, wall, cpu)
+
+    def add_api_call(self, request_type: str, latency: float, sent: int, received: int, ok: bool = True):
+        bucket = next((i for i, le_ in enumerate(LATENCY_BUCKETS) if latency <= le_), len(LATENCY_BUCKETS))
+        with self._lock:
+            api_ = self.api.get(request_type)
+            if api_ is None:
+                api_ = self.api[request_type] = {"count": 0, "errors": 0, "bytesSent": 0, "bytesReceived": 0,
+                                                 "latencySec": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+            api_["count"] += 1
+            api_["errors"] += 0 if ok else 1
+            api_["bytesSent"] += sent
+            api_["bytesReceived"] += received
+            api_["latencySec"] += latency
+            api_["buckets"][bucket] += 1
+        scope = self._scope.get()
+        if scope:
+            scope.add_api_call(request_type, latency, sent, received, ok)
+
+    def add_cache_lookup(self, result: str):  # memoryHits, indexHits, diskHits or misses
+        with self._lock:
+            self.cache[result] += 1
+        scope = self._scope.get()
+        if scope:
+            scope.add_cache_lookup(result)
+
+    def add_lang_types_tried(self, tried: int):
+        with self._lock:
+            self.lang_types_tried[tried] = self.lang_types_tried.get(tried, 0) + 1
+        scope = self._scope.get()
+        if scope:
+            scope.add_lang_types_tried(tried)
+
+    def add_lookups(self, requested: int, unique: int):
+        with self._lock:
+            self.lookups["requested"] += requested
+            self.lookups["unique"] += unique
+        scope = self._scope.get()
+        if scope:
+            scope.add_lookups(requested, unique)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            lookups = sum(self.cache.values())
+            return {
+                "tool": __tool_name__,
+                "started": self.started,
+                "durationSec": round(time.time() - self.started, 3),
+                "phases": {name: {"calls": p["calls"], "wallSec": round(p["wallSec"], 4), "cpuSec": round(p["cpuSec"], 4)}
+                           for name, p in self.phases.items()},
+                "api": {rt: {"count": a["count"], "errors": a["errors"], "bytesSent": a["bytesSent"],
+                             "bytesReceived": a["bytesReceived"], "latencySec": round(a["latencySec"], 4),
+                             "latencyHistogram": {**{str(le_): n for le_, n in zip(LATENCY_BUCKETS, a["buckets"])},
+                                                  "+Inf": a["buckets"][-1]}}
+                        for rt, a in self.api.items()},
+                "cache": {**self.cache,
+                          "hitRatio": round((lookups - self.cache["misses"]) / lookups, 4) if lookups else 0.0},
+                "langTypesTried": {str(k): v for k, v in sorted(self.lang_types_tried.items())},
+                "lookups": {**self.lookups, "saved": self.lookups["requested"] - self.lookups["unique"]}
+            }
+
+    def to_prometheus(self) -> str:
+        metrics = self.to_dict()
+        lines = []
+
+        def add(name: str, kind: str, help_: str, samples):
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{METRICS_PREFIX}_{name}{{{label_str}}} {value}" if label_str else
+                             f"{METRICS_PREFIX}_{name} {value}")
+
+        add("duration_seconds", "gauge", "Duration of the run", [({}, metrics["durationSec"])])
+        add("phase_wall_seconds", "gauge", "Wall time per phase",
+            [({"phase": n}, p["wallSec"]) for n, p in metrics["phases"].items()])
+        add("phase_cpu_seconds", "gauge", "CPU time per phase",
+            [({"phase": n}, p["cpuSec"]) for n, p in metrics["phases"].items()])
+        add("api_requests_total", "counter", "Mend API requests",
+            [({"request_type": rt}, a["count"]) for rt, a in metrics["api"].items()])
+        add("api_errors_total", "counter", "Failed Mend API requests",
+            [({"request_type": rt}, a["errors"]) for rt, a in metrics["api"].items()])
+        add("api_sent_bytes_total", "counter", "Bytes sent to Mend API",
+            [({"request_type": rt}, a["bytesSent"]) for rt, a in metrics["api"].items()])
+        add("api_received_bytes_total", "counter", "Bytes received from Mend API",
+            [({"request_type": rt}, a["bytesReceived"]) for rt, a in metrics["api"].items()])
+        lines.append(f"# HELP {METRICS_PREFIX}_api_latency_seconds Latency of Mend API requests")
+        lines.append(f"# TYPE {METRICS_PREFIX}_api_latency_seconds histogram")
+        for rt, a in metrics["api"].items():
+            total = 0
+            for le_, n in a["latencyHistogram"].items():
+                total += n
+                lines.append(f'{METRICS_PREFIX}_api_latency_seconds_bucket{{request_type="{rt}",le="{le_}"}} {total}')
+            lines.append(f'{METRICS_PREFIX}_api_latency_seconds_sum{{request_type="{rt}"}} {a["latencySec"]}')
+            lines.append(f'{METRICS_PREFIX}_api_latency_seconds_count{{request_type="{rt}"}} {a["count"]}')
+        add("cache_lookups_total", "counter", "Library search cache lookups",
+            [({"result": k}, v) for k, v in metrics["cache"].items() if k != "hitRatio"])
+        add("cache_hit_ratio", "gauge", "Library search cache hit ratio", [({}, metrics["cache"]["hitRatio"])])
+        add("lang_types_tried_packages", "gauge", "Packages by number of language types searched",
+            [({"types": k}, v) for k, v in metrics["langTypesTried"].items()])
+        add("lookups_total", "counter", "Library searches of packages and the distinct ones of them",
+            [({"kind": k}, v) for k, v in metrics["lookups"].items() if k != "saved"])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, prometheus_path: str = ""):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
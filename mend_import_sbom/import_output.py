@@ -0,0 +1,93 @@
+import gzip
+import itertools
+import json
+
+from mend_import_sbom.import_record import encode_record
+
+UPDATE_REQUEST_FILE = "update-request.txt"
+OUTPUT_FORMATS = ("json", "compact", "gzip", "ndjson")
+OUTPUT_FILES = {"json": UPDATE_REQUEST_FILE, "compact": UPDATE_REQUEST_FILE, "gzip": f"{UPDATE_REQUEST_FILE}.gz",
+                "ndjson": "update-request.ndjson"}
+STREAM_DEPTH = 4  # Request -> projects -> project -> dependencies, every dependency tree is encoded at once
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def get_output_file(output_format: str = "json") -> str:
+    return OUTPUT_FILES.get(output_format, UPDATE_REQUEST_FILE)
+
+
+def encode_value(obj, indent=None, level: int = 0) -> str:  # The same text as this value has inside json.dump output
+    if indent is None:
+        return json.dumps(obj, separators=(",", ":"), default=encode_record)
+    return json.dumps(obj, indent=indent, default=encode_record).replace("\n", "\n" + " " * (indent * level))
+
+
+def iter_encode(obj, indent=None, level: int = 0, depth: int = STREAM_DEPTH):
+    """Chunks of JSON text equal to json.dump output. Containers of the first levels are encoded item by item,
+    so the whole document is never kept as one string and every item still uses the fast C encoder"""
+    if depth <= 0 or not isinstance(obj, (dict, list)) or not obj:
+        yield encode_value(obj, indent, level)
+        return
+    is_dict = isinstance(obj, dict)
+    nl, nl_end, key_sep = ("", "", ":") if indent is None else \
+        ("\n" + " " * (indent * (level + 1)), "\n" + " " * (indent * level), ": ")
+    yield "{" if is_dict else "["
+    for i, item in enumerate(obj.items() if is_dict else obj):
+        yield ("," if i else "") + nl
+        if is_dict:
+            yield json.dumps(item[0]) + key_sep
+            item = item[1]
+        yield from iter_encode(item, indent, level + 1, depth - 1)
+    yield nl_end + ("}" if is_dict else "]")
+
+
+def iter_ndjson(output_json: dict):  # Request, then every project followed by its dependencies, one per line
+    yield {"request": {k: v for k, v in output_json.items() if k != "projects"}}
+    for proj in output_json.get("projects", []):
+        yield {"project": {k: v for k, v in proj.items() if k != "dependencies"}}
+        for dep_ in proj.get("dependencies", []):
+            yield {"dependency": dep_}
+
+
+def write_update_request(path: str, output_json: dict, output_format: str = "json"):
+    if output_format == "ndjson":
+        with open(path, "w", encoding="utf-8") as f:
+            for rec in iter_ndjson(output_json):
+                f.write(encode_value(rec) + "\n")
+        return
+    indent = 4 if output_format == "json" else None
+    with (gzip.open(path, "wt", encoding="utf-8") if output_format == "gzip" else open(path, "w")) as f:
+        for chunk in iter_encode(output_json, indent):
+            f.write(chunk)
+
+
+def read_ndjson(lines) -> dict:
+    output_json = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        if "request" in rec:
+            output_json = {**rec["request"], "projects": []}
+        elif "project" in rec:
+            output_json["projects"].append({**rec["project"], "dependencies": []})
+        elif "dependency" in rec:
+            output_json["projects"][-1]["dependencies"].append(rec["dependency"])
+    return output_json
+
+
+def read_update_request(path: str) -> dict:  # Update request file in any of the output formats
+    with open(path, "rb") as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+    with (gzip.open(path, "rt", encoding="utf-8") if is_gzip else open(path, encoding="utf-8")) as f:
+        first = f.readline()
+        try:
+            rec = json.loads(first)
+        except json.JSONDecodeError:  # Pretty printed JSON
+            rec = None
+        if isinstance(rec, dict) and list(rec) == ["request"]:
+            return read_ndjson(itertools.chain([first], f))
+        if rec is not None and not f.read(1).strip():  # Compact JSON is a single line
+            return rec
+        f.seek(0)
+        return json.load(f)
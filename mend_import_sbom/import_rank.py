@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+from mend_import_sbom._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+RANKING_FILE = "lang-ranking.json"
+MAX_PRIOR_HITS = 200  # Statistics of previous runs are scaled down to this, so a run can still change the order
+RATE_PRIOR_HITS = 0.1  # Hit rate is smoothed as (hits + 0.1) / (tries + 1), so a type never tried yet has 10%
+RATE_PRIOR_TRIES = 1.0
+MIN_TRIES_TO_STOP = 20  # Searches in a type needed before its hit rate can stop the search of a package
+STOP_RATE = 0.05  # The search is stopped when hit rates of the types left add up to less than this
+HOST_TYPES = {
+    "maven.org": "maven", "maven.apache.org": "maven", "npmjs.org": "npm", "npmjs.com": "npm", "pypi.org": "pypi",
+    "pythonhosted.org": "pypi", "proxy.golang.org": "go", "pkg.go.dev": "go", "nuget.org": "nuget",
+    "rubygems.org": "ruby", "crates.io": "rust", "hex.pm": "hex", "packagist.org": "php", "cdnjs.cloudflare.com": "cdnjs",
+    "r-project.org": "cran", "alpinelinux.org": "alpine", "opam.ocaml.org": "ocaml", "cocoapods.org": "cocoapods"
+}
+CREATOR_TYPES = {
+    "maven": "maven", "gradle": "maven", "npm": "npm", "yarn": "npm", "pip": "pypi", "poetry": "pypi", "go": "go",
+    "gomod": "go", "nuget": "nuget", "dotnet": "nuget", "cargo": "rust", "bundler": "ruby", "composer": "php"
+}
+CPE_TYPES = {  # CPE vendor or target software
+    "python": "pypi", "golang": "go", "go": "go", "nodejs": "npm", "node.js": "npm", "npmjs": "npm", "ruby": "ruby",
+    "rubygems": "ruby", "rust": "rust", "rust-lang": "rust", "java": "maven", "maven": "maven", ".net": "nuget"
+}
+NAME_SHAPES = (
+    (re.compile(r"^@[\w.-]+/[\w.-]+$"), "npm"),  # @scope/name
+    (re.compile(r"^[\w.-]+:[\w.-]+$"), "maven"),  # group:artifact
+    (re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)+/[\w.~-]+(/[\w.~-]+)*$"), "go"),  # github.com/owner/module
+)
+
+
+def get_host(url: str) -> str:
+    try:
+        return (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+def get_host_type(url: str):
+    host = get_host(url)
+    return next((type_ for host_, type_ in HOST_TYPES.items() if host == host_ or host.endswith("." + host_)), None)
+
+
+def get_lang_signals(package: dict, pkg_name: str, creator: str) -> set:
+    """Language types suggested by creator tool, download host, name shape and CPE of the package"""
+    signals = set()
+    for token_ in re.split(r"[^a-z0-9.]+", creator.lower()):
+        if token_ in CREATOR_TYPES:
+            signals.add(CREATOR_TYPES[token_])
+    host_type = get_host_type(str(package.get("downloadLocation", "")))
+    if host_type:
+        signals.add(host_type)
+    for regex_, type_ in NAME_SHAPES:
+        if regex_.match(pkg_name):
+            signals.add(type_)
+            break
+    for ext_ref in package.get("externalRefs", []) if isinstance(package.get("externalRefs"), list) else []:
+        locator = str(ext_ref.get("referenceLocator", "")) if isinstance(ext_ref, dict) else ""
+        if locator.startswith("cpe:2.3:"):
+            parts = locator.split(":")
+            for part_ in (parts[3] if len(parts) > 3 else "", parts[10] if len(parts) > 10 else ""):
+                if part_.lower() in CPE_TYPES:
+                    signals.add(CPE_TYPES[part_.lower()])
+    return signals
+
+
+class LangRanker:  # Order of language types searched for a package, learned from library search results
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.hits = {}  # libType -> libraries found
+        self.tries = {}  # libType -> libraries searched
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stats = json.load(f)
+            scale = min(1.0, MAX_PRIOR_HITS / max(sum(stats["hits"].values()), 1))
+            self.hits = {k: v * scale for k, v in stats["hits"].items()}
+            self.tries = {k: v * scale for k, v in stats["tries"].items()}
+            logger.debug('Language type statistics of previous runs loaded: %s', self.path)
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logger.warning('Language type statistics of previous runs are ignored: %s', err)
+
+    def save(self):
+        if self.path:
+            with self._lock:
+                stats = {"hits": dict(self.hits), "tries": dict(self.tries)}
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+
+    def get_rate(self, lib_type: str) -> float:  # Smoothed share of searches in the type which found the library
+        return (self.hits.get(lib_type, 0) + RATE_PRIOR_HITS) / (self.tries.get(lib_type, 0) + RATE_PRIOR_TRIES)
+
+    def rank(self, lang_types: list, signals=frozenset()) -> list:
+        """Candidates suggested by signals go first, then the types with the best hit rate. Static order breaks the
+        ties, so it is kept until something is searched"""
+        with self._lock:
+            return sorted(lang_types, key=lambda l_type: (not signals.intersection(l_type[1]),
+                                                          -max(self.get_rate(k) for k in l_type[1]), l_type[0]))
+
+    def should_stop(self, lang_types: list, tried: set, signals=frozenset()) -> bool:
+        """True if the candidates left are unlikely to be found: searches in their types almost never found anything"""
+        types = {k for l_type in lang_types for k in l_type[1]}
+        left = types - tried
+        if not left or signals.intersection(left):
+            return not left
+        with self._lock:
+            if any(self.tries.get(k, 0) < MIN_TRIES_TO_STOP for k in left):
+                return False
+            return sum(self.get_rate(k) for k in left) < STOP_RATE
+
+    def add_result(self, lib_type: str, found: bool):
+        with self._lock:
+            self.tries[lib_type] = self.tries.get(lib_type, 0) + 1
+            self.hits[lib_type] = self.hits.get(lib_type, 0) + (1 if found else 0)
+
+
+def open_ranker(cache_dir: str = "") -> LangRanker:
+    return LangRanker(os.path.join(cache_dir, RANKING_FILE) if cache_dir else "")
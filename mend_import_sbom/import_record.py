@@ -0,0 +1,97 @@
+import sys
+from collections.abc import Mapping
+
+WIRE_KEYS = ("artifactId", "version", "sha1", "systemPath", "optional", "filename", "checksums", "dependencyFile")
+SLOTS_BY_KEY = {"artifactId": "artifact_id", "version": "version", "sha1": "sha1", "filename": "file_name",
+                "children": "children"}
+
+
+def intern_str(value):  # Repeated values, like versions and library types, share one string object
+    return sys.intern(value) if type(value) is str else value
+
+
+class DependencyRecord(Mapping):
+    """Dependency of update request. Read like its Mend wire format dict, which is created only when it is encoded.
+    Constant fields are not kept, SHA1 is kept once and file name just if it is not the same as artifactId"""
+    __slots__ = ("artifact_id", "version", "sha1", "file_name", "children")
+
+    def __init__(self, artifact_id: str, version: str, sha1: str, file_name: str = None, children: list = None):
+        self.artifact_id = artifact_id
+        self.version = intern_str(version)
+        self.sha1 = sha1
+        self.file_name = None if file_name == artifact_id else file_name
+        self.children = children  # None if the wire format has no "children" key
+
+    @classmethod
+    def from_wire(cls, dep_: dict) -> "DependencyRecord":
+        children = dep_.get("children")
+        return cls(dep_.get("artifactId", ""), dep_.get("version", ""), dep_.get("sha1", ""), dep_.get("filename", ""),
+                   None if children is None else [cls.from_wire(child) for child in children])
+
+    def to_wire(self) -> dict:  # Children are kept as records
+        wire = {
+            "artifactId": self.artifact_id,
+            "version": self.version,
+            "sha1": self.sha1,
+            "systemPath": "",
+            "optional": False,
+            "filename": self.artifact_id if self.file_name is None else self.file_name,
+            "checksums": {
+                "SHA1": self.sha1
+            },
+            "dependencyFile": ""
+        }
+        if self.children is not None:
+            wire["children"] = self.children
+        return wire
+
+    def __getitem__(self, key):
+        if key == "artifactId":
+            return self.artifact_id
+        if key == "sha1":
+            return self.sha1
+        if key == "version":
+            return self.version
+        if key == "children" and self.children is not None:
+            return self.children
+        if key in WIRE_KEYS:
+            return self.to_wire()[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from WIRE_KEYS
+        if self.children is not None:
+            yield "children"
+
+    def __len__(self):
+        return len(WIRE_KEYS) + (self.children is not None)
+
+    def __setitem__(self, key, value):  # Constant fields and checksums (the same as sha1) are not set
+        if key not in SLOTS_BY_KEY:
+            raise KeyError(key)
+        setattr(self, SLOTS_BY_KEY[key], intern_str(value) if key == "version" else value)
+
+    def setdefault(self, key, default=None):
+        if key == "children" and self.children is None:
+            self.children = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key == "children" and self.children is not None:
+            children, self.children = self.children, None
+            return children
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def copy(self) -> "DependencyRecord":  # Shallow, as dict.copy()
+        return DependencyRecord(self.artifact_id, self.version, self.sha1, self.file_name, self.children)
+
+    def __repr__(self):
+        return f"DependencyRecord({self.to_wire()!r})"
+
+
+def encode_record(obj):  # json "default": dependency records are encoded in Mend wire format
+    if isinstance(obj, DependencyRecord):
+        return obj.to_wire()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -1,24 +1,65 @@
 import argparse
+import contextvars
 import csv
 import datetime
-import inspect
+import functools
+import glob
+import gzip
 import json
 import logging
 import os
 import sys
-import re
 import hashlib
+import threading
+import time
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from mend_import_sbom._version import __version__, __tool_name__, __description__
-from mend_import_sbom.import_const import SHA1CalcType, aliases, varenvs, Templates
+from mend_import_sbom.import_const import SHA1CalcType, aliases, varenvs, Templates, CSV_COLUMNS, SHA1_TYPES_BY_NAME, \
+    SHA1_TYPES_BY_PURL, SHA1_TYPES_BY_EXT, SHA1_TYPES_BY_LIB, PURL_TYPE_RE, SHA1_POLICIES, \
+    LOCAL_SHA1_LIB_TYPES
+from mend_import_sbom.import_graph import SbomGraph
+from mend_import_sbom.import_stream import load_spdx_stream
+from mend_import_sbom.import_async import AsyncMendClient, DFLT_CONCURRENCY
+from mend_import_sbom.import_manifest import load_manifest, save_manifest, get_package_hash, is_unchanged, get_delta, \
+    get_miss, is_reusable
+from mend_import_sbom.import_output import OUTPUT_FORMATS, get_output_file, write_update_request, read_update_request
+from mend_import_sbom.import_metrics import RunMetrics, METRICS_FILE, PROMETHEUS_FILE, get_request_type
+from mend_import_sbom.import_rank import LangRanker, get_lang_signals, open_ranker
+from mend_import_sbom.import_lookup import get_lookup, normalize_lookup
+from mend_import_sbom.import_cache import LookupCache, MemoryCache, DFLT_CACHE_DIR, DFLT_CACHE_TTL
+from mend_import_sbom.import_index import LibraryIndex
+from mend_import_sbom.import_service import ImportService, run_service
+from mend_import_sbom.import_record import DependencyRecord, intern_str, encode_record
 from importlib import metadata
 
 logger = logging.getLogger(__tool_name__)
 logger.setLevel(logging.DEBUG)
 is_debug = logging.DEBUG if os.environ.get("DEBUG") in ['True', 'true', 'TRUE', "1"] else logging.INFO
 
-formatter = logging.Formatter('[%(asctime)s] %(levelname)5s %(message)s', "%Y-%m-%d %H:%M:%S")
+
+class JsonLogFormatter(logging.Formatter):  # One JSON object per line, for log collectors
+    def format(self, record):
+        log_rec = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "function": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            log_rec["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_rec)
+
+
+# Caller info is taken by logging itself, just for emitted records
+formatter = logging.Formatter('[%(asctime)s] %(levelname)5s [%(funcName)s:%(lineno)d] %(message)s', "%Y-%m-%d %H:%M:%S")
 s_handler = logging.StreamHandler()
 s_handler.setFormatter(formatter)
 s_handler.setLevel(is_debug)
@@ -32,8 +73,27 @@ except:
     APP_VERSION = __version__
 API_VERSION = "1.4"
 DFLT_PRD_NAME = "Mend-Imports"
-UPDATE_REQUEST_FILE = "update-request.txt"
+BATCH_SUMMARY_FILE = "batch-summary.json"
+UPLOAD_STATE_FILE = "upload-state.json"
+BATCH_EXTS = (".json", ".csv")
 PROJ_URL = '/Wss/WSS.html#!project;id='  # f'{WS_WSS_URL}/Wss/WSS.html#!project;id={PROJECT_ID}'
+DFLT_RETRIES = 3
+DFLT_CONNECT_TIMEOUT = 10
+DFLT_READ_TIMEOUT = 120
+DFLT_POOL_SIZE = 10
+RETRY_BACKOFF = 1  # Retry after 1, 2, 4... seconds unless Retry-After header says otherwise
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+UPLOAD_RETRY_STATUSES = (429, 503)  # Update request was not processed, so it is sent again just after these
+lib_cache = None
+lib_index = None
+lib_results = MemoryCache()
+http_session = None
+upload_session = None  # Update requests are not idempotent, they are retried just if they were not received
+async_client = None
+session_lock = threading.Lock()
+lang_ranker = None
+scope_tokens = {}  # (Mend URL, organization, project) -> project token, kept between imports of the process
+run_metrics = RunMetrics()
 AGENT_INFO = {"agent": f"{__tool_name__.replace('_', '-') if 'ps' in __tool_name__ else 'ps-'+__tool_name__.replace('_', '-')}", "agentVersion": __version__}
 
 
@@ -44,14 +104,10 @@ def try_or_error(supplier, msg):
         return msg
 
 
-def fn():
-    fn_stack = inspect.stack()[1]
-    return f'{fn_stack.function}:{fn_stack.lineno}'
-
-
-def pn():
-    pn_stack = inspect.stack()[2]
-    return f'{pn_stack.function}:{pn_stack.lineno}'
+def raise_if_error(res):
+    if isinstance(res, BaseException):
+        raise res
+    return res
 
 
 def ex():
@@ -69,7 +125,7 @@ def log_obj_props(obj, obj_title=""):
             prop_list.append(f'{k}={v}')
         logger.debug("\n\t".join(prop_list))
     except Exception as err:
-        logger.error(f'[{ex()}] Failed: {err}')
+        logger.error('[%s] Failed: %s', ex(), err)
 
 
 def parse_args():
@@ -85,8 +141,19 @@ def parse_args():
         parser.add_argument(*aliases.get_aliases_str("projectkey"), help="Mend product/project scope",
                             dest='scope_token',
                             default=varenvs.get_env("wsscope"))
+        is_batch = os.environ.get("WS_BATCH") or any(arg_.startswith("--batch") for arg_ in got_args[1])
+        is_upload = os.environ.get("WS_UPLOAD_FILE") or \
+            any(arg_.lower().startswith(("--uploadfile", "--upload-file")) for arg_ in got_args[1])
+        is_service = os.environ.get("WS_SERVICE") or any(arg_.startswith("--service") for arg_ in got_args[1])
         parser.add_argument(*aliases.get_aliases_str("sbom"), help="SBOM Report for upload (*.json|*.csv)", dest='sbom',
-                            required=True, default=os.environ.get("SBOM", ''))
+                            required=not (is_batch or is_upload or is_service), default=os.environ.get("SBOM", ''))
+        parser.add_argument('--batch', help="Directory, glob pattern or manifest (*.json|*.csv) of SBOM reports",
+                            dest='batch', default=os.environ.get("WS_BATCH", ''))
+        parser.add_argument('--batchWorkers', help="Number of SBOM reports imported at the same time in batch and "
+                            "service mode",
+                            dest='batch_workers', type=int, default=int(os.environ.get("WS_BATCH_WORKERS", 4)))
+        parser.add_argument('--service', help="Run as service accepting import jobs on address (host:port|unix:path)",
+                            dest='service', default=os.environ.get("WS_SERVICE", ''))
         parser.add_argument('--updateType', help="Update type", dest='update_type',
                             default=os.environ.get("WS_UPDATETYPE", 'OVERRIDE'))
         parser.add_argument(*aliases.get_aliases_str("output"), help="Output directory", dest='out_dir',
@@ -95,9 +162,76 @@ def parse_args():
                             default=varenvs.get_env("wsurl"), required=not varenvs.get_env("wsurl"))
         parser.add_argument('--offline', help="Create update request file without uploading", dest='offline',
                             default=os.environ.get("WS_OFFLINE", 'false'))
+        parser.add_argument(*aliases.get_aliases_str("outputformat"), help="Update request file format (json|compact|gzip|ndjson)",
+                            dest='output_format', choices=OUTPUT_FORMATS, default=os.environ.get("WS_OUTPUT_FORMAT", 'json'))
+        parser.add_argument(*aliases.get_aliases_str("uploadfile"), help="Upload update request file created before in offline mode",
+                            dest='upload_file', default=os.environ.get("WS_UPLOAD_FILE", ''))
         parser.add_argument('--multilang', help="Search library in all possible programming languages",
                             dest='multilang',
                             default=os.environ.get("WS_MULTILANG", 'true'))
+        parser.add_argument('--stream', help="Parse SPDX JSON incrementally, skipping the \"files\" block",
+                            dest='stream', default=os.environ.get("WS_STREAM", 'false'))
+        parser.add_argument('--incremental', help="Resolve just new or changed packages and upload just changes "
+                                                  "since previous run (false|true|delta)", dest='incremental',
+                            choices=['false', 'true', 'delta'], default=os.environ.get("WS_INCREMENTAL", 'false'))
+        parser.add_argument('--splitProjects', help="Import every component the SBOM describes as a separate project",
+                            dest='split_projects', default=os.environ.get("WS_SPLIT_PROJECTS", 'false'))
+        parser.add_argument('--projectMapping', help="JSON file of project names and SPDXIDs of their components",
+                            dest='project_mapping', default=os.environ.get("WS_PROJECT_MAPPING", ''))
+        parser.add_argument('--treeMode', help="Dependency trees as packages are ordered in SBOM or sorted and "
+                            "deduplicated (legacy|stable)", dest='tree_mode', choices=['legacy', 'stable'],
+                            default=os.environ.get("WS_TREE_MODE", 'legacy'))
+        parser.add_argument('--maxTreeDepth', help="Maximum depth of dependency trees in stable tree mode, 0 is no limit",
+                            dest='max_tree_depth', type=int, default=int(os.environ.get("WS_MAX_TREE_DEPTH", 0)))
+        parser.add_argument('--maxTreeNodes', help="Maximum dependencies in trees of a project in stable tree mode, "
+                            "0 is no limit", dest='max_tree_nodes', type=int,
+                            default=int(os.environ.get("WS_MAX_TREE_NODES", 0)))
+        parser.add_argument('--sha1Policy', help="Libraries without SHA1 by SHA1 of name, version and language "
+                            f"calculated locally or by Mend search ({'|'.join(SHA1_POLICIES)})", dest='sha1_policy',
+                            choices=SHA1_POLICIES, default=os.environ.get("WS_SHA1_POLICY", 'remote'))
+        parser.add_argument('--localSha1Types', help="Comma separated library types with locally calculated SHA1 "
+                            f"(default: {','.join(sorted(LOCAL_SHA1_LIB_TYPES))})", dest='local_sha1_types',
+                            default=os.environ.get("WS_LOCAL_SHA1_TYPES", ''))
+        parser.add_argument('--langRanking', help="Search library types without purl in the order learned from results",
+                            dest='lang_ranking', default=os.environ.get("WS_LANG_RANKING", 'false'))
+        parser.add_argument('--normalize', help="Search copies of a library with names of other case or versions with "
+                            "range operators (^ ~ =) once", dest='normalize', default=os.environ.get("WS_NORMALIZE", 'false'))
+        parser.add_argument('--threads', help="Number of threads for searching libraries without SHA1",
+                            dest='threads', type=int, default=int(os.environ.get("WS_THREADS", 1)))
+        parser.add_argument(*aliases.get_aliases_str("cachedir"), help="Library search cache directory (default: <out>/.mend-cache)",
+                            dest='cache_dir', default=os.environ.get("WS_CACHE_DIR", ''))
+        parser.add_argument(*aliases.get_aliases_str("nocache"), help="Do not use library search cache", dest='no_cache',
+                            action='store_true', default=os.environ.get("WS_NO_CACHE") in ['True', 'true', 'TRUE', "1"])
+        parser.add_argument('--cacheTtl', help="Library search cache TTL in hours", dest='cache_ttl', type=float,
+                            default=float(os.environ.get("WS_CACHE_TTL", DFLT_CACHE_TTL)))
+        parser.add_argument(*aliases.get_aliases_str("libindex"), help="Library index file: libraries found are kept there "
+                            "and searched before Mend", dest='lib_index', default=os.environ.get("WS_LIB_INDEX", ''))
+        parser.add_argument(*aliases.get_aliases_str("libindeximport"), help="Import CSV or NDJSON dump, other library "
+                            "index or library search cache into library index", dest='lib_index_import',
+                            default=os.environ.get("WS_LIB_INDEX_IMPORT", ''))
+        parser.add_argument('--offlineResolution', help="Resolve libraries just by library index, nothing is sent to Mend",
+                            dest='offline_resolution', default=os.environ.get("WS_OFFLINE_RESOLUTION", 'false'))
+        parser.add_argument('--engine', help="Mend API client engine (sync|async)", dest='engine',
+                            choices=['sync', 'async'], default=os.environ.get("WS_ENGINE", 'sync'))
+        parser.add_argument('--concurrency', help="Maximum number of requests in flight for async engine",
+                            dest='concurrency', type=int, default=int(os.environ.get("WS_CONCURRENCY", DFLT_CONCURRENCY)))
+        parser.add_argument('--rateLimit', help="Maximum number of requests per second for async engine (0 - no limit)",
+                            dest='rate_limit', type=float, default=float(os.environ.get("WS_RATE_LIMIT", 0)))
+        parser.add_argument('--uploadChunkSize', help="Maximum size of uploaded dependencies per request in KB (0 - no limit)",
+                            dest='upload_chunk_size', type=float, default=float(os.environ.get("WS_UPLOAD_CHUNK_SIZE", 0)))
+        parser.add_argument('--uploadCompression', help="Compression of upload request body (none|gzip)",
+                            dest='upload_compression', choices=['none', 'gzip'],
+                            default=os.environ.get("WS_UPLOAD_COMPRESSION", 'none'))
+        parser.add_argument('--retries', help="Number of retries for failed Mend API requests", dest='retries', type=int,
+                            default=int(os.environ.get("WS_RETRIES", DFLT_RETRIES)))
+        parser.add_argument('--connectTimeout', help="Mend API connection timeout in seconds", dest='connect_timeout',
+                            type=float, default=float(os.environ.get("WS_CONNECT_TIMEOUT", DFLT_CONNECT_TIMEOUT)))
+        parser.add_argument('--readTimeout', help="Mend API read timeout in seconds", dest='read_timeout',
+                            type=float, default=float(os.environ.get("WS_READ_TIMEOUT", DFLT_READ_TIMEOUT)))
+        parser.add_argument('--prometheusMetrics', help="Write run metrics in Prometheus text format too",
+                            dest='prometheus_metrics', default=os.environ.get("WS_PROMETHEUS_METRICS", 'false'))
+        parser.add_argument('--logFormat', help="Log format (text|json)", dest='log_format', choices=['text', 'json'],
+                            default=os.environ.get("WS_LOG_FORMAT", 'text'))
         parser.add_argument('--proxy', help="Proxy URL", dest='proxy',
                             default=os.environ.get("HTTP_PROXY", ''))
         parser.add_argument('--proxyUsername', help="Proxy Username", dest='proxyuser',
@@ -108,223 +242,382 @@ def parse_args():
     return parser.parse_known_args()[0]
 
 
-def check_el_inlist(name: str) -> bool:  # Don't need to do this check now, might be needed in the future
-    res = False
-    for rel in relations:
-        for key, value in rel.items():
-            if 'SPDXRef-PACKAGE-' + name == value:
-                res = True
-                break
-    return res
+def check_el_inlist(name: str, graph: SbomGraph) -> bool:  # Don't need to do this check now, might be needed in the future
+    return graph.is_required(name)
 
 
-def get_element_by_spdxid(spdx: str) -> dict:
-    out_el = {}
-    for el_ in pkgs:
-        if el_["SPDXID"] == spdx:
-            sha1 = try_or_error(lambda: f"{el_['checksums'][0]['checksumValue']}", '')
-            chld = try_or_error(lambda: el_['children'], [])
+def get_element_by_spdxid(spdx: str, graph: SbomGraph):  # DependencyRecord of package with SHA1 or {}
+    el_ = graph.packages.get(spdx)
+    try:
+        sha1 = f"{el_['checksums'][0]['checksumValue']}"
+    except Exception:
+        return {}
+    if not sha1 or "packageFileName" not in el_:
+        return {}
+    file_name = f"{el_['packageFileName']}"
+    return DependencyRecord(file_name, f"{el_.get('versionInfo', '')}", sha1, file_name, el_.get('children', []))
+
+
+def add_child(element: dict, graph: SbomGraph) -> dict:  # Adding children, depth first without recursion
+    stack = [(element, iter(graph.get_children(element['artifactId'])))]
+    while stack:
+        parent_el, children = stack[-1]
+        spdx = next(children, None)
+        if spdx is None:
+            stack.pop()
+            continue
+        chld_el = get_element_by_spdxid(spdx, graph)
+        if chld_el:
             try:
-                if sha1:
-                    out_el = {
-                        "artifactId": f"{el_['packageFileName']}",
-                        "version": f"{try_or_error(lambda: el_['versionInfo'], '')}",
-                        "sha1": sha1,
-                        "systemPath": "",
-                        "optional": False,
-                        "filename": f"{el_['packageFileName']}",
-                        "checksums": {
-                            "SHA1": sha1
-                        },
-                        "dependencyFile": "",
-                        "children": chld
-                    }
+                parent_el['children'].append(chld_el)
             except:
-                pass
-            break
-    return out_el
-
-
-def add_child(element: dict) -> dict:  # recursion for adding children
-    new_el = element
-    name = element['artifactId']
-    for rel in relations:
-        for key, value in rel.items():
-            if key == 'SPDXRef-PACKAGE-' + name:
-                chld_el = get_element_by_spdxid(value)
-                if chld_el:
-                    try:
-                        new_el['children'].append(chld_el)
-                    except:
-                        new_el['children'] = [chld_el]
-                    if not chld_el['artifactId'] in added_el:
-                        added_el.append(chld_el['artifactId'])
-                        add_child(chld_el)
-    return new_el
+                parent_el['children'] = [chld_el]
+            if not chld_el['artifactId'] in graph.visited:
+                graph.visited.add(chld_el['artifactId'])
+                stack.append((chld_el, iter(graph.get_children(chld_el['artifactId']))))
+    return element
+
+
+def get_csv_columns(csv_file) -> list:  # Header of CSV inventory, checked against the import template
+    with open(csv_file, encoding='utf-8', newline='') as csvf:
+        header = next(csv.reader(csvf), [])
+    missing = [col for col in CSV_COLUMNS if col not in header]
+    if missing:
+        raise ValueError(f"CSV file {csv_file} misses columns of templates/import_template.csv: {', '.join(missing)}")
+    return header
+
+
+def read_csv_packages(csv_file):
+    """Yield SPDX-like packages from CSV rows one at a time. Malformed rows are reported with line numbers and skipped"""
+    skipped = 0
+    logger.debug('Reading CSV file: %s', csv_file)
+    with open(csv_file, encoding='utf-8', newline='') as csvf:
+        csv_reader = csv.DictReader(csvf)
+        while True:
+            try:
+                row = next(csv_reader)
+            except StopIteration:
+                break
+            except csv.Error as err:
+                logger.warning('Skipping malformed CSV row at line %s: %s', csv_reader.line_num, err)
+                skipped += 1
+                continue
+            except UnicodeDecodeError as err:
+                logger.error('Unable to parse input file after line %s: %s', csv_reader.line_num, err)
+                exit(-1)
+            if None in row or None in row.values():  # DictReader marks extra and missing fields with None
+                fields = len(csv_reader.fieldnames) + len(row.get(None, [])) - list(row.values()).count(None)
+                logger.warning('Skipping malformed CSV row at line %s: expected %s fields, got %s',
+                               csv_reader.line_num, len(csv_reader.fieldnames), fields)
+                skipped += 1
+                continue
+            yield {
+                "name": row["name"],
+                "licenseConcluded": row["licenseConcluded"],
+                "licenseInfoFromFiles": row["licenseInfoFromFiles"],
+                "licenseDeclared": row["licenseDeclared"],
+                "copyrightText": row["copyrightText"],
+                "versionInfo": row["versionInfo"],
+                "packageFileName": row["packageFileName"],
+                "supplier": row["supplier"],
+                "originator": row["originator"],
+                "homepage": row["homepage"],
+                "filesAnalyzed": False,
+                "checksums": [{"algorithm": "SHA1", "checksumValue": row["sha1"]}]
+            }
+    if skipped:
+        logger.warning('%s rows of CSV file %s were skipped', skipped, csv_file)
 
 
 def csv_to_json(csv_file):
-    data = {}
     dep = []
-    count = 0
     try:
-        logger.debug(f'[{fn()}] Reading CSV file: {csv_file}')
-        with open(csv_file, encoding='utf-8') as csvf:
-            csv_reader = csv.DictReader(csvf)
-            for rows in csv_reader:
-                key = count
-                data[key] = rows
-                count += 1
-
-        json_ = json.loads(json.dumps(data, indent=4))
-        for el_ in json_:
-            pck = {
-                "name": json_[el_]["name"],
-                "licenseConcluded": json_[el_]["licenseConcluded"],
-                "licenseInfoFromFiles": json_[el_]["licenseInfoFromFiles"],
-                "licenseDeclared": json_[el_]["licenseDeclared"],
-                "copyrightText": json_[el_]["copyrightText"],
-                "versionInfo": json_[el_]["versionInfo"],
-                "packageFileName": json_[el_]["packageFileName"],
-                "supplier": json_[el_]["supplier"],
-                "originator": json_[el_]["originator"],
-                "homepage": json_[el_]["homepage"],
-                "filesAnalyzed": False,
-                "checksums": [{"algorithm": "SHA1", "checksumValue": json_[el_]["sha1"]}]
-            }
-            dep.append(pck)
+        get_csv_columns(csv_file)
+        dep = list(read_csv_packages(csv_file))
     except Exception as err:
-        logger.error(f'[{ex()}] Failed to convert CSV to JSON: {err}')
+        logger.error('[%s] Failed to convert CSV to JSON: %s', ex(), err)
 
     return dep
 
 
+def generic_thread_pool_search(lookups: list, worker, threads: int):  # Run library searches in parallel
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="lib_search")
+    futures = {}
+    for lookup in lookups:
+        if lookup not in futures:  # The same library could be requested by several packages
+            # Run in a copy of the caller's context, so the searches are counted in its run metrics
+            futures[lookup] = executor.submit(contextvars.copy_context().run, worker, *lookup)
+    return executor, futures
+
+
+def create_session(retry: Retry, pool_size: int) -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=DFLT_POOL_SIZE, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_proxies() -> dict:  # Passed with every request, as proxy environment variables override session proxies
+    proxy = analyze_proxy(args.proxy) if try_or_error(lambda: args.proxy, "") else ""
+    return {"https": f"http://{proxy}", "http": f"http://{proxy}"} if proxy else {}
+
+
+def get_session(agent=False) -> requests.Session:  # Shared HTTP session with connection pool and retries
+    global http_session, upload_session
+    with session_lock:
+        retries = try_or_error(lambda: args.retries, DFLT_RETRIES)
+        if agent:
+            if upload_session is None:  # Neither read errors nor statuses after which the upload could be applied
+                retry = Retry(total=retries, connect=retries, read=0, other=0, status=retries,
+                              backoff_factor=RETRY_BACKOFF, status_forcelist=UPLOAD_RETRY_STATUSES,
+                              allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+                upload_session = create_session(retry, DFLT_POOL_SIZE)
+                logger.debug('Upload HTTP session created: retries=%s', retries)
+            return upload_session
+        if http_session is None:
+            retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                          backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUSES,
+                          allowed_methods=None,  # Mend API uses POST for every request
+                          respect_retry_after_header=True, raise_on_status=False)
+            pool_size = max(try_or_error(lambda: int(args.threads), 1), DFLT_POOL_SIZE)
+            http_session = create_session(retry, pool_size)
+            logger.debug('HTTP session created: pool size=%s, retries=%s', pool_size, retries)
+        return http_session
+
+
+@functools.lru_cache(maxsize=2)
+def get_agent_info(agent_info_login=False) -> str:
+    agent_info = dict(AGENT_INFO)
+    if agent_info_login:
+        agent_info["agent"] = agent_info["agent"].replace("ps-", "ps-login-")
+    else:
+        agent_info["agent"] = agent_info["agent"].replace("ps-login-", "ps-")
+    return json.dumps(agent_info)
+
+
+def add_agent_info(data: str, agent_info_login=False) -> str:  # Appended to the JSON text, which is not parsed again
+    body = data.rstrip()
+    if not body.endswith("}") or '"agentInfo"' in body:
+        data = json.loads(data)
+        data["agentInfo"] = json.loads(get_agent_info(agent_info_login))
+        return json.dumps(data)
+    body = body[:-1].rstrip()
+    return f'{body}{", " if body != "{" else ""}"agentInfo": {get_agent_info(agent_info_login)}}}'
+
+
+def get_api_url(agent=False) -> str:
+    return f"{extract_url(args.ws_url)}/agent" if agent else f"{extract_url(args.ws_url)}/api/v{API_VERSION}"
+
+
+def get_data_size(data) -> int:
+    return len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+
+
 def call_api(header, data, agent=False, method="POST", agent_info_login=False):
     res = ""
     if not agent:
-        data = json.loads(data)
-        data["agentInfo"] = AGENT_INFO
-        if agent_info_login:
-            data["agentInfo"]["agent"] = data["agentInfo"]["agent"].replace("ps-", "ps-login-")
-        else:
-            data["agentInfo"]["agent"] = data["agentInfo"]["agent"].replace("ps-login-", "ps-")
-
-        data = json.dumps(data)
+        data = add_agent_info(data, agent_info_login)
+    started = time.perf_counter()
+    if async_client:
+        res = async_client.run(async_client.request(url=get_api_url(agent), data=data, headers=header, method=method,
+                                                    idempotent=not agent))
+        run_metrics.add_api_call(get_request_type(data, agent), time.perf_counter() - started, get_data_size(data),
+                                 get_data_size(res), ok=bool(res))
+        return res
+    ok = False
+    received = 0
     try:
-        proxy = analyze_proxy(args.proxy) if args.proxy else ""
-        proxies = {"https": f"http://{proxy}", "http": f"http://{proxy}"} if proxy else {}
-        res = requests.request(
+        resp = get_session(agent).request(
             method=method,
-            url=f"{extract_url(args.ws_url)}/agent" if agent else f"{extract_url(args.ws_url)}/api/v{API_VERSION}",
+            url=get_api_url(agent),
             data=data,
             headers=header,
-            proxies=proxies).text
+            proxies=get_proxies(),
+            timeout=(try_or_error(lambda: args.connect_timeout, DFLT_CONNECT_TIMEOUT),
+                     try_or_error(lambda: args.read_timeout, DFLT_READ_TIMEOUT)))
+        if not resp.ok:
+            logger.error('Mend API request failed: HTTP %s %s', resp.status_code, resp.reason)
+        ok = resp.ok
+        received = len(resp.content)
+        res = resp.text
     except Exception as err:
-        logger.debug(f'[{ex()}] {err}')
+        logger.error('[%s] Mend API request failed: %s', ex(), err)
+    run_metrics.add_api_call(get_request_type(data, agent), time.perf_counter() - started, get_data_size(data),
+                             received, ok=ok)
     return res
 
 
-def create_body(args):
-    def create_add_sha1(langtype: str, lib_name: str,
-                        lib_ver: str):  # maybe we will need to calculate additional sha1 later
-        logger.debug(f'[{fn()}] langtype={langtype}')
-        pkg_str = ""
-        try:
-            for ext_ref in package['externalRefs']:
-                if ext_ref['referenceCategory'] == "PACKAGE_MANAGER":
-                    pkgname = re.search(r"pkg:(.*?)/", ext_ref['referenceLocator'], flags=re.DOTALL).group(1).strip()
-                    lang_type = SHA1CalcType.get_package_type(f_t=pkgname)
-                    pkg_str = f"{lib_name.lower()}_{lib_ver.lower()}_{lang_type.language}" if lang_type.lower_case == "y" else f"{lib_name}_{lib_ver}_{lang_type.language} "
-                    break
-        except Exception as err:
-            pkg_str = f"{lib_name.lower()}_{lib_ver.lower()}_{langtype}" if SHA1CalcType.get_package_data(
-                lng=langtype) == "y" else f"{lib_name}_{lib_ver}_{langtype}"
-        return hashlib.sha1(pkg_str.encode("utf-8")).hexdigest() if langtype else ""
-
-    def get_pkg_parent(pkg_child: str):  # Will be needed for uploading source files
-        logger.debug(f'[{fn()}] pkg_child={pkg_child}')
-        res = ""
+def get_known_lib(cache_key: tuple):
+    cached = lib_results.get(cache_key)  # Shared by every SBOM imported in this process
+    result = "memoryHits"
+    if not cached and lib_index:
+        indexed = lib_index.get(cache_key[3], cache_key[1], cache_key[2])
+        cached = (*indexed, 0, "") if indexed else None
+        result = "indexHits"
+    if not cached and lib_cache:
+        cached = lib_cache.get(cache_key)
+        result = "diskHits"
+    run_metrics.add_cache_lookup(result if cached else "misses")
+    if cached:
+        logger.debug('Cached result: sha1=%s, libname=%s, error_code=%s, error_msg=%s', *cached)
+    return cached
+
+
+def add_known_lib(cache_key: tuple, res: tuple):
+    lib_results.put(cache_key, res)
+    if lib_cache:
+        lib_cache.put(cache_key, res)
+    if lib_index and res[0]:
+        lib_index.put(cache_key[3], cache_key[1], cache_key[2], res[0], res[1])
+
+
+def is_offline_resolution(args_) -> bool:  # Nothing is sent to Mend, libraries are searched just in library index
+    return try_or_error(lambda: args_.offline_resolution.lower(), "false") == "true"
+
+
+def get_lib_search_data(lib_name, lib_ver, lib_type, args_) -> str:
+    return json.dumps(
+        {"requestType": "getBasicLibraryInfo",
+         "userKey": args_.ws_user_key,
+         "orgToken": args_.ws_token,
+         "libraryName": lib_name,
+         "libraryVersion": lib_ver,
+         "libraryType": lib_type})
+
+
+def parse_lib_search(response: str):
+    sha1 = lname = ""
+    error_code = 0
+    error_msg = ""
+    try:
+        lib_lst = json.loads(response)
         try:
-            rels = sbom["relationships"]
-            for rel_ in rels:
-                if rel_["relationshipType"] == "DYNAMIC_LINK" and rel_["relatedSpdxElement"] == pkg_child:
-                    res = rel_["spdxElementId"]
-                    break
+            for lib_ in lib_lst["librariesInformation"]:
+                sha1 = try_or_error(lambda: lib_["sha1"], '')
+                lname = try_or_error(lambda: lib_["artifactId"], '')
+                break
         except:
-            pass
-        return res
+            if lib_lst["errorCode"] == 5001:  # User has no permissions. Don't need to continue execution
+                logger.error('Error Code: %s. Message: %s', lib_lst["errorCode"], lib_lst["errorMessage"])
+                exit(-1)
+            else:
+                logger.info('%s', lib_lst["errorMessage"])
+                error_code = lib_lst["errorCode"]
+                error_msg = lib_lst["errorMessage"]
+    except Exception as err:
+        logger.error('[%s] %s', ex(), str(err))
+        exit(-1)  # In this case don't need to continue execution
+    logger.debug('Result: sha1=%s, libname=%s, error_code=%s, error_msg=%s', sha1, lname, error_code, error_msg)
+    return sha1, lname, error_code, error_msg
+
+
+def search_lib_by_name(lib_name, lib_ver, lib_type, args_=None):
+    args_ = args_ if args_ else args
+    logger.debug('Searching library: lib_name=%s, lib_ver=%s, lib_type=%s', lib_name, lib_ver, lib_type)
+    cache_key = (extract_url(args_.ws_url), lib_name, lib_ver, lib_type)
+    res = get_known_lib(cache_key)
+    if not res and is_offline_resolution(args_):
+        return "", "", 0, "Library not found in library index"
+    if not res:
+        res = parse_lib_search(call_api(header={"Content-Type": "application/json"},
+                                        data=get_lib_search_data(lib_name, lib_ver, lib_type, args_)))
+        add_known_lib(cache_key, res)
+    return res
 
-    def execute_pack_exe_list(package_list : list, exts : list): # Execute whole list of missed packages
-        res = []
-        for pck_ in package_list:
-            for pck_name, pck_ver in pck_.items():
-                logger.info(f'[{fn()}] Mend library search: {f"{pck_name}-{pck_ver}" if pck_ver else pck_name}')
-                res_err_msg = ""
-                br = False
-                for ext_ in exts:
-                    for key, value in ext_.items():
-                        if pkg_ver:
-                            sha1_, lname_, err_, err_msg_ = search_lib_by_name(lib_name=pck_name, lib_ver=pck_ver, lib_type=key)
-                            res_err_msg = err_msg_ if err_ == 3028 else res_err_msg  # Too many libraries were found
-                        else:
-                            sha1_ = ""
-                            lname_ = ""
-                            err_msg_ = ""
-                        # The start parallel running. Keep it for future
-                        #sha1_, lname_, err_, err_msg_, value = generic_thread_pool_search(lib_name=pkg_name,lib_ver=pkg_ver,l_types=lang_types,worker=search_lib_by_name)
-                        if sha1_:
-                            res.append( {
-                                "artifactId": f"{lname_}",
-                                "version": pkg_ver,
-                                "sha1": sha1_,
-                                "systemPath": "",
-                                "optional": False,
-                                "filename": f"{lname_}-{pkg_ver}.{value}",
-                                "checksums": {
-                                    "SHA1": sha1_
-                                },
-                                "dependencyFile": ""
-                            })
-                            br = True
-                    if br:
-                        break
-                if "NOASSERTION" not in pck_name and not sha1_:
-                    logger.info(f"Library not found: {f'{pck_name}-{pck_ver}' if pck_ver else pck_name}. {res_err_msg if res_err_msg else err_msg_}")
+
+async def search_lib_async(lib_name, lib_ver, lib_type, args_):  # Coroutine version for the async engine
+    try:
+        logger.debug('Searching library: lib_name=%s, lib_ver=%s, lib_type=%s', lib_name, lib_ver, lib_type)
+        cache_key = (extract_url(args_.ws_url), lib_name, lib_ver, lib_type)
+        res = get_known_lib(cache_key)
+        if not res and is_offline_resolution(args_):
+            return "", "", 0, "Library not found in library index"
+        if not res:
+            data = add_agent_info(get_lib_search_data(lib_name, lib_ver, lib_type, args_))
+            started = time.perf_counter()
+            text = await async_client.request(url=get_api_url(), data=data, headers={"Content-Type": "application/json"})
+            run_metrics.add_api_call("getBasicLibraryInfo", time.perf_counter() - started, get_data_size(data),
+                                     get_data_size(text), ok=bool(text))
+            res = parse_lib_search(text)
+            add_known_lib(cache_key, res)
         return res
+    except SystemExit as err:  # Must not stop the event loop, raised again by the caller
+        return err
+
+
+def start_lib_searches(lookups: list, args_):
+    """Starts library searches of lookups with the async engine or --threads threads. Returns the executor to shut
+    down (None if there is none) and the function returning the result of a search, started or not"""
+    threads = try_or_error(lambda: int(args_.threads), 1)
+    executor = None
+    futures = {}
+    if async_client and lookups:
+        logger.debug('Resolving %s library searches with async engine', len(lookups))
+        for lookup in lookups:
+            if lookup not in futures:
+                futures[lookup] = async_client.submit(search_lib_async(*lookup, args_=args_))
+    elif threads > 1 and lookups:
+        logger.debug('Resolving %s library searches with %s threads', len(lookups), threads)
+        executor, futures = generic_thread_pool_search(lookups=lookups, threads=threads,
+                                                       worker=functools.partial(search_lib_by_name, args_=args_))
+
+    def get_lib(lib_name, lib_ver, lib_type):  # SystemExit of an async search is returned, raised here
+        future = futures.get((lib_name, lib_ver, lib_type))
+        if future is None:
+            return search_lib_by_name(lib_name, lib_ver, lib_type, args_=args_)
+        return raise_if_error(future.result())
+
+    return executor, get_lib
+
+
+@functools.lru_cache(maxsize=None)
+def get_guessed_types(creator_type, name_type: str, ext_name: str, multilang: bool) -> tuple:
+    """Language types of a package without purl, by file extension, creator tool or type in library name. The same
+    for every package with this key, so classification of a large SBOM is done once per key. Types are read only"""
+    if not creator_type and name_type:  # If nothing from creator but got package type from library name
+        creator_type = SHA1_TYPES_BY_NAME.get(name_type)
+    type_lst = SHA1_TYPES_BY_EXT.get(ext_name, ()) if ext_name else ()
+    if type_lst:
+        return tuple((0, {type_.libtype: type_.ext}) for type_ in type_lst)
+    if multilang or not creator_type:  # Could not identify library extension (could be part of the package name)
+        return tuple((type_.order, {type_.libtype: type_.ext}) for type_ in SHA1CalcType)
+    return (creator_type.order, {creator_type.libtype: creator_type.ext}),
+
+
+def get_local_sha1(calc_type: SHA1CalcType, lib_name: str, lib_ver: str) -> str:
+    """Mend key of a library identified by name and version: SHA1 of name_version_LANGUAGE"""
+    pkg_str = f"{lib_name.lower()}_{lib_ver.lower()}_{calc_type.language}" if calc_type.lower_case == "y" \
+        else f"{lib_name}_{lib_ver}_{calc_type.language}"
+    return hashlib.sha1(pkg_str.encode("utf-8")).hexdigest()
+
+
+def add_local_sha1(pkg_entries: list, lib_types=LOCAL_SHA1_LIB_TYPES, lookup_key=get_lookup) -> int:
+    """Set "local" dependency of packages with a single type of lib_types, returns their number. Name and version are
+    taken as lookup_key searches them"""
+    added = 0
+    for entry in pkg_entries:
+        if entry["sha1"] or "resolved" in entry or not entry["pkg_ver"] or len(entry["lang_types"]) != 1 or \
+                len(entry["lang_types"][0][1]) != 1:
+            continue
+        (lib_type, ext_), = entry["lang_types"][0][1].items()
+        calc_type = SHA1_TYPES_BY_LIB.get((lib_type, ext_))
+        if calc_type and lib_type in lib_types:
+            lib_name, lib_ver, _ = lookup_key(entry["pkg_name"], entry["pkg_ver"], lib_type)
+            sha1_ = get_local_sha1(calc_type, lib_name, lib_ver)
+            entry["local"] = {
+                "pck": DependencyRecord(entry["pkg_name"], entry["pkg_ver"], sha1_,
+                                        f"{entry['pkg_name']}-{entry['pkg_ver']}.{ext_}"),
+                "libType": intern_str(lib_type)
+            }
+            added += 1
+    return added
 
-    def search_lib_by_name(lib_name, lib_ver, lib_type):
-        logger.debug(f'[{fn()}] Searching library: lib_name={lib_name}, lib_ver={lib_ver}, lib_type={lib_type}')
-        sha1 = lname = ""
-        error_code = 0
-        error_msg = ""
-        try:
-            header = {"Content-Type": "application/json"}
-            data = json.dumps(
-                {"requestType": "getBasicLibraryInfo",
-                 "userKey": args.ws_user_key,
-                 "orgToken": args.ws_token,
-                 "libraryName": lib_name,
-                 "libraryVersion": lib_ver,
-                 "libraryType": lib_type})
-            lib_lst = json.loads(call_api(header=header, data=data))
-            try:
-                for lib_ in lib_lst["librariesInformation"]:
-                    sha1 = try_or_error(lambda: lib_["sha1"], '')
-                    lname = try_or_error(lambda: lib_["artifactId"], '')
-                    break
-            except:
-                if lib_lst["errorCode"] == 5001:  # User has no permissions. Don't need to continue execution
-                    logger.error(f'[{fn()}] Error Code: {lib_lst["errorCode"]}. Message: {lib_lst["errorMessage"]}')
-                    exit(-1)
-                else:
-                    logger.info(f'[{fn()}] {lib_lst["errorMessage"]}')
-                    error_code = lib_lst["errorCode"]
-                    error_msg = lib_lst["errorMessage"]
-        except Exception as err:
-            logger.error(f'[{ex()}] {str(err)}')
-            exit(-1)  # In this case don't need to continue execution
-        logger.debug(f'[{fn()}] Result: sha1={sha1}, libname={lname}, error_code={error_code}, error_msg={error_msg}')
-        return sha1, lname, error_code, error_msg
+
+def create_body(args, manifest: dict = None):  # manifest: resolved packages of previous run, updated in place
+    def get_pkg_parent(pkg_child: str):  # Will be needed for uploading source files
+        logger.debug('pkg_child=%s', pkg_child)
+        return graph.dynamic_link_parent.get(pkg_child, "")
 
     def update_template_data(creator: str, lib_name: str, lib_ver: str):
         lname_ = ""
@@ -345,53 +638,7 @@ def create_body(args):
                 return pkg_type_
         return None
 
-    ts = round(datetime.datetime.now().timestamp())
-    global relations
-    global pkgs
-    global added_el
-    global sbom
-    relations = []
-    added_el = []
-    dep = []
-    pkg_top = ""
-    prj_id = args.ws_project if (not args.scope_token) else args.scope_token
-    logger.debug(f'[{fn()}] ts={ts}, prj_id={prj_id}')
-
-    try:
-        if os.path.splitext(args.sbom)[1] == ".csv":
-            logger.debug(f'[{fn()}] Parsing CSV file: {args.sbom}')
-            sbom = csv_to_json(args.sbom)
-        else:
-            logger.debug(f'[{fn()}] Parsing JSON file: {args.sbom}')
-            with open(args.sbom, "r", encoding="utf-8") as f:
-                sbom = json.load(f)
-            prj_id = try_or_error(lambda: sbom["name"], '') if (not prj_id) else prj_id
-            logger.debug(f'[{fn()}] prj_id: {prj_id}')
-    except Exception as err:
-        logger.error(f'[{ex()}] Unable to parse input file: {err}')
-        exit(-1)
-
-    if not prj_id:
-        logger.error(f'[{fn()}] Scope must include either project name or project token')
-        exit(-1)
-
-    try:
-        logger.debug(f'[{fn()}] Resolving dependency relationships')
-        for rel_ in sbom["relationships"]:
-            if rel_['relationshipType'] == "DEPENDS_ON":
-                relations.append({rel_['spdxElementId']: rel_['relatedSpdxElement']})
-    except Exception as err:
-        logger.debug(f'[{ex()}] "relationships" block not found, skipping')
-
-    pkgs = try_or_error(lambda: sbom["packages"], sbom)  # from JSON or from CSV
-    logger.debug(f'[{fn()}] Adding dependencies')
-    creator = ""
-    for create_ in try_or_error(lambda: sbom["creationInfo"]["creators"], []):
-        if "Tool:" in create_:
-            creator = create_
-    for package in pkgs:
-        pck = {}
-        pkg_type_creator = get_lang_data(creator)  # Get info about possible package type from creator info
+    def get_package_entry(package: dict) -> dict:  # Collect everything needed to resolve the package
         algorithm = try_or_error(lambda: f"{package['checksums'][0]['algorithm']}", '')
         sha1 = try_or_error(lambda: f"{package['checksums'][0]['checksumValue']}",
                             '') if algorithm == "SHA1" or algorithm == "SHA-1" else ""
@@ -403,103 +650,260 @@ def create_body(args):
         pkg_id = f'{pkg_name}-{pkg_ver}' if pkg_ver else pkg_name
         download_loc = try_or_error(lambda: package["downloadLocation"], '')
         if algorithm and not sha1:
-            logger.debug(f'[{fn()}] No SHA1 ({algorithm}) algorithm was found for library {pkg_name}')
+            logger.debug('No SHA1 (%s) algorithm was found for library %s', algorithm, pkg_name)
 
-        if sha1:
-            pck = {
-                "artifactId": f"{pkg_name}",
-                "version": pkg_ver,
-                "sha1": sha1,
-                "systemPath": "",
-                "optional": False,
-                "filename": f"{pkg_name}",
-                "checksums": {
-                    "SHA1": sha1
-                },
-                "dependencyFile": ""
-            }
-            if pkg_name not in added_el:
-                added_el.append(pkg_name)  # we add element to list if was not added before
-                dep.append(add_child(pck))
-                logger.debug(f'[{fn()}] Dependency added: {pkg_id}, sha1: {sha1}')
-        else:  # SHA1 not found
-            lang_types = []
-            logger.debug(f'[{fn()}] Attempting to resolve library by language type')
+        def add_guessed_types():  # No purl, types are guessed by file extension or creator
+            try:
+                if pkg_name != "NOASSERTION":
+                    ext_name = os.path.splitext(pkg_name)[1][1:]
+                    ext_name = ext_name if ext_name else os.path.splitext(download_loc)[1][1:]
+                    # Trying to get ext from download link if not found before
+                    lang_types.extend(get_guessed_types(pkg_type_creator, pkg_type, ext_name,
+                                                        args.multilang.lower() == "true"))
+            except:
+                pass
+
+        lang_types = []  # (order, {libtype: ext}). Order 0 means the type is taken as is
+        if not sha1:
+            logger.debug('Attempting to resolve library by language type')
             try:
                 pck_ext = package["externalRefs"]  # execute SPDX structure file
                 # like cpe:2.3:a:python:botocore:1.22.12:*:*:*:*:*:*:*
                 for ext_ref in pck_ext:
                     if ext_ref["referenceCategory"] == "PACKAGE_MANAGER" or \
                             ext_ref['referenceCategory'] == "PACKAGE-MANAGER":
-                        pkgname = re.search(r"pkg:(.*?)/", ext_ref['referenceLocator'],
-                                            flags=re.DOTALL).group(1).strip()
-                        pkg_data = SHA1CalcType.get_package_type(f_t=pkgname)
+                        pkgname = PURL_TYPE_RE.search(ext_ref['referenceLocator']).group(1).strip()
+                        pkg_data = SHA1_TYPES_BY_PURL.get(pkgname)
                         if pkg_data:
                             lang_types.append((0, {pkg_data.libtype: pkg_data.ext}))
                             break
             except:
-                try:
+                add_guessed_types()
+            else:
+                if ranker and not lang_types:  # Only CPE or other references, which give no type as is
+                    add_guessed_types()
+
+        return {
+            "spdx_id": try_or_error(lambda: package["SPDXID"], ""),
+            "pkg_name": pkg_name,
+            "pkg_ver": pkg_ver,
+            "pkg_id": pkg_id,
+            "sha1": sha1,
+            "lang_types": lang_types,
+            "signals": get_lang_signals(package, pkg_name, creator) if ranker and len(lang_types) > 1 else frozenset()
+        }
+
+    ranker = get_lang_ranker(args)
+    ts = round(datetime.datetime.now().timestamp())
+    dep = []
+    pkg_entries = []
+    pkg_top = ""
+    prj_id = args.ws_project if (not args.scope_token) else args.scope_token
+    logger.debug('ts=%s, prj_id=%s', ts, prj_id)
+
+    is_csv = os.path.splitext(args.sbom)[1].lower() == ".csv"
+    try:
+        if is_csv:
+            logger.debug('Parsing CSV file: %s', args.sbom)
+            get_csv_columns(args.sbom)
+            sbom = {"packages": read_csv_packages(args.sbom)}  # Rows are read while packages are classified
+        else:
+            if try_or_error(lambda: args.stream.lower(), "false") == "true":
+                logger.debug('Parsing JSON file in streaming mode: %s', args.sbom)
+                with run_metrics.phase("parse"):
+                    sbom = load_spdx_stream(args.sbom)
+            else:
+                logger.debug('Parsing JSON file: %s', args.sbom)
+                with run_metrics.phase("parse"), open(args.sbom, "r", encoding="utf-8") as f:
+                    sbom = json.load(f)
+            prj_id = try_or_error(lambda: sbom["name"], '') if (not prj_id) else prj_id
+            logger.debug('prj_id: %s', prj_id)
+    except Exception as err:
+        logger.error('[%s] Unable to parse input file: %s', ex(), err)
+        exit(-1)
+
+    if not prj_id:
+        logger.error('Scope must include either project name or project token')
+        exit(-1)
+
+    logger.debug('Resolving dependency relationships')
+    if "relationships" not in sbom:
+        logger.debug('"relationships" block not found, skipping')
+    with run_metrics.phase("graph"):  # CSV packages have neither SPDXID nor relationships
+        graph = SbomGraph() if is_csv else SbomGraph.from_sbom(sbom)
+    split = get_project_split(args, graph)
+    stable_tree = try_or_error(lambda: args.tree_mode, "legacy") == "stable"
+    collect = split is not None or stable_tree  # Trees are built after resolution
+    found = []  # (entry, pck) of resolved packages
+
+    pkgs = try_or_error(lambda: sbom["packages"], sbom)  # from JSON or from CSV
+    logger.debug('Adding dependencies')
+    creator = ""
+    for create_ in try_or_error(lambda: sbom["creationInfo"]["creators"], []):
+        if "Tool:" in create_:
+            creator = create_
+    pkg_type_creator = get_lang_data(creator)  # Get info about possible package type from creator info
+    prev_resolved = manifest["packages"] if manifest is not None else {}
+    sha1_policy = try_or_error(lambda: args.sha1_policy, "remote")
+    hash_context = (creator, args.multilang) if sha1_policy == "remote" else (creator, args.multilang, sha1_policy)
+    # Copies of a library written in different ways are searched once, the result goes to every one of them
+    lookup_key = normalize_lookup if try_or_error(lambda: args.normalize.lower(), "false") == "true" else get_lookup
+    if lookup_key is normalize_lookup:
+        hash_context += ("normalize",)
+    resolved = {}
+    miss_ttl = try_or_error(lambda: float(args.cache_ttl), DFLT_CACHE_TTL) * 3600  # Libraries could be added to Mend
+    with run_metrics.phase("classify"):  # CSV rows are parsed here too
+        for package in pkgs:
+            entry = get_package_entry(package)
+            if manifest is not None and not entry["sha1"]:
+                entry["hash"] = get_package_hash(package, *hash_context)
+                if is_reusable(prev_resolved.get(entry["hash"]), miss_ttl):  # Not changed since previous run
+                    entry["resolved"] = prev_resolved[entry["hash"]]
+            pkg_entries.append(entry)
+    if manifest is not None:
+        logger.info('Incremental import: %s packages resolved by previous run',
+                    len([e for e in pkg_entries if "resolved" in e]))
+    if sha1_policy != "remote":
+        local_types = try_or_error(lambda: {t.strip() for t in args.local_sha1_types.split(",") if t.strip()}, None)
+        with run_metrics.phase("local"):
+            added = add_local_sha1(pkg_entries, local_types or LOCAL_SHA1_LIB_TYPES, lookup_key)
+            logger.info('SHA1 of %s packages calculated locally', added)
+
+    lookups = [(entry["pkg_name"], entry["pkg_ver"], key) for entry in pkg_entries
+               if entry["pkg_ver"] and "resolved" not in entry and "local" not in entry and sha1_policy != "local"
+               # Just the first candidate is searched in advance, the others only if it was not found
+               for l_type in (ranker.rank(entry["lang_types"], entry["signals"]) if ranker
+                              else sorted(entry["lang_types"], key=lambda m: m[0]))[:1]
+               for key in l_type[1]]
+    with run_metrics.phase("normalize"):
+        requested = len(lookups)
+        duplicates = requested - len(set(lookups))
+        lookups = list(dict.fromkeys(lookup_key(*lookup) for lookup in lookups))
+    run_metrics.add_lookups(requested, len(lookups))
+    if requested:
+        logger.info('%s library searches of packages without SHA1 collapsed into %s lookups: %s saved, %s of them '
+                    'by normalization', requested, len(lookups), requested - len(lookups),
+                    requested - duplicates - len(lookups))
+    executor, get_lib = start_lib_searches(lookups, args)
+
+    try:
+        with run_metrics.phase("resolve"):  # Includes "tree", waiting for library searches
+            for entry in pkg_entries:
+                pck = {}
+                pkg_name = entry["pkg_name"]
+                pkg_ver = entry["pkg_ver"]
+                pkg_id = entry["pkg_id"]
+                sha1 = entry["sha1"]
+                if sha1:
+                    pck = DependencyRecord(f"{pkg_name}", pkg_ver, sha1, f"{pkg_name}")
+                    if not collect and pkg_name not in graph.visited:
+                        graph.visited.add(pkg_name)  # we add element to list if was not added before
+                        with run_metrics.phase("tree"):
+                            dep.append(add_child(pck, graph))
+                        logger.debug('Dependency added: %s, sha1: %s', pkg_id, sha1)
+                elif "resolved" in entry:
+                    if "pck" in entry["resolved"]:
+                        pck = DependencyRecord.from_wire(entry["resolved"]["pck"])
+                        pkg_top = entry["resolved"]["libType"]
+                    elif pkg_name != "NOASSERTION":
+                        logger.info('Library not found: %s. Not found by previous run', pkg_id)
+                    resolved[entry["hash"]] = entry["resolved"]
+                elif "local" in entry:
+                    pck = entry["local"]["pck"].copy()
+                    if manifest is not None:
+                        resolved[entry["hash"]] = {"pck": pck.to_wire(), "libType": entry["local"]["libType"]}
+                elif sha1_policy == "local":
                     if pkg_name != "NOASSERTION":
-                        if not pkg_type_creator and pkg_type:  # If nothing from creator but got package type from library name
-                            pkg_type_creator = try_or_error(lambda: SHA1CalcType.get_el_by_name(name=pkg_type), None)
-                        ext_name = os.path.splitext(pkg_name)[1][1:]
-                        ext_name = ext_name if ext_name else os.path.splitext(download_loc)[1][1:]
-                        # Trying to get ext from download link if not found before
-                        type_lst = SHA1CalcType.get_package_type_list_by_ext(ext=ext_name) if ext_name else None
-                        if type_lst:
-                            for type_lst_ in type_lst:
-                                lang_types.append((0, {type_lst_.libtype: type_lst_.ext}))
-                        else:
-                            if args.multilang.lower() == "true" or not pkg_type_creator:
-                                for calctype_ in SHA1CalcType:  # Could not identify library extension
-                                    # (could be part of the package name)
-                                    lang_types.append((0 if calctype_.libtype == pkg_top else calctype_.order,
-                                                       {calctype_.libtype: calctype_.ext}))
-                            else:
-                                lang_types.append((0 if pkg_type_creator.libtype == pkg_top else pkg_type_creator.order,
-                                                   {pkg_type_creator.libtype: pkg_type_creator.ext}))
-                except:
-                    pass
-
-            sha1_ = ""
-            res_err_msg = ""
-            logger.info(f'[{fn()}] Mend library search: {pkg_id}')
-            lang_types.sort(key=lambda m: m[0])
-            for l_type in lang_types:
-                for key, value in l_type[1].items():
-                    if pkg_ver:
-                        sha1_, lname_, err_, err_msg_ = search_lib_by_name(lib_name=pkg_name, lib_ver=pkg_ver,
-                                                                           lib_type=key)
-                        res_err_msg = err_msg_ if err_ == 3028 else res_err_msg  # Too many libraries were found
+                        logger.info('Library not found: %s. Type is not known, SHA1 was not calculated', pkg_id)
+                    if manifest is not None:
+                        resolved[entry["hash"]] = get_miss()
+                else:  # SHA1 not found
+                    sha1_ = ""
+                    res_err_msg = ""
+                    err_msg_ = ""
+                    logger.info('Mend library search: %s', pkg_id)
+                    if ranker:
+                        lang_types = ranker.rank(entry["lang_types"], entry["signals"])
                     else:
-                        sha1_ = ""
-                        lname_ = ""
-                        err_msg_ = ""
-                if sha1_:
-                    pck = {
-                        "artifactId": f"{lname_}",
-                        "version": pkg_ver,
-                        "sha1": sha1_,
-                        "systemPath": "",
-                        "optional": False,
-                        "filename": f"{lname_}-{pkg_ver}.{value}" if pkg_ver not in lname_ else lname_,
-                        "checksums": {
-                            "SHA1": sha1_
-                        },
-                        "dependencyFile": ""
-                    }
-                    pkg_top = key
-                    break
-            if sha1_ == "" and pkg_name != "NOASSERTION":
-                logger.info(f"Library not found: {pkg_id}. {res_err_msg if res_err_msg else try_or_error(lambda: err_msg_,'')}")
-
-        if pck != {}:
-            if pkg_name not in added_el:
-                added_el.append(f"{pkg_name}")  # we add element to list if was not added before
-                dep.append(add_child(pck))
-                logger.debug(f'[{fn()}] Dependency added: {pkg_id}, sha1: {sha1}')
-
-    logger.debug(f'[{fn()}] Constructing update request')
+                        lang_types = sorted(entry["lang_types"],
+                                            key=lambda m: 0 if pkg_top in m[1] else m[0])  # Last found type goes first
+                    tried = 0
+                    tried_types = set()
+                    for l_type in lang_types:
+                        for key, value in l_type[1].items():
+                            if pkg_ver:
+                                tried += 1
+                                sha1_, lname_, err_, err_msg_ = get_lib(*lookup_key(pkg_name, pkg_ver, key))
+                                if ranker:
+                                    ranker.add_result(key, bool(sha1_))
+                                    tried_types.add(key)
+                                res_err_msg = err_msg_ if err_ == 3028 else res_err_msg  # Too many libraries were found
+                            else:
+                                sha1_ = ""
+                                lname_ = ""
+                                err_msg_ = ""
+                        if sha1_:
+                            pck = DependencyRecord(f"{lname_}", pkg_ver, sha1_,
+                                                   f"{lname_}-{pkg_ver}.{value}" if pkg_ver not in lname_ else lname_)
+                            pkg_top = intern_str(key)
+                            break
+                        if ranker and pkg_ver and ranker.should_stop(lang_types, tried_types, entry["signals"]):
+                            logger.debug('Search of %s stopped after %s language types', pkg_id, tried)
+                            break
+                    run_metrics.add_lang_types_tried(tried)
+                    if sha1_ == "" and pkg_name != "NOASSERTION":
+                        logger.info('Library not found: %s. %s', pkg_id, res_err_msg if res_err_msg else err_msg_)
+                    if manifest is not None:
+                        resolved[entry["hash"]] = {"pck": pck.to_wire(), "libType": pkg_top} if sha1_ else get_miss()
+
+                if pck:
+                    if collect:
+                        found.append((entry, pck))
+                    elif pkg_name not in graph.visited:
+                        graph.visited.add(pkg_name)  # we add element to list if was not added before
+                        with run_metrics.phase("tree"):
+                            dep.append(add_child(pck, graph))
+                        logger.debug('Dependency added: %s, sha1: %s', pkg_id, sha1)
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)  # Lookups already running must not outlive the call
+    if manifest is not None:
+        manifest["packages"] = resolved
+
+    def get_project_deps(is_member) -> list:  # Every package tree is built once per project
+        graph.visited = set()
+        deps = []
+        with run_metrics.phase("tree"):
+            if stable_tree:
+                resolved_ = {}
+                for i, (entry_, pck_) in enumerate(found):
+                    if is_member(entry_["spdx_id"]):
+                        resolved_.setdefault(entry_["spdx_id"] or f"#{i}", pck_)  # CSV packages have no SPDXID
+                return graph.build_trees(resolved_, max_depth=try_or_error(lambda: int(args.max_tree_depth), 0),
+                                         max_nodes=try_or_error(lambda: int(args.max_tree_nodes), 0))
+            for entry_, pck_ in found:
+                if is_member(entry_["spdx_id"]) and entry_["pkg_name"] not in graph.visited:
+                    graph.visited.add(entry_["pkg_name"])
+                    deps.append(add_child(pck_.copy(), graph))  # Copy, as shared packages get children in every project
+        return deps
+
+    logger.debug('Constructing update request')
+    components = []
+    if split is not None:
+        for prj_name, members in split:
+            components.append({
+                "coordinates": {
+                    "artifactId": f"{prj_name}"
+                },
+                "dependencies": get_project_deps(members.__contains__)
+            })
+        assigned = set().union(*(members for _, members in split))
+        dep = get_project_deps(lambda spdx_id: spdx_id not in assigned)  # Packages of no component
+        logger.info('SBOM split into %s projects, %s dependencies are not in any of them', len(components), len(dep))
+        if not dep:
+            return get_update_request_body(args, components, ts)
+    elif stable_tree:
+        dep = get_project_deps(lambda spdx_id: True)
     if args.scope_token:
         prj = [
             {
@@ -517,22 +921,48 @@ def create_body(args):
             }
         ]
 
+    return get_update_request_body(args, components + prj, ts)
+
+
+def get_update_request_body(args_, projects: list, ts: int) -> dict:
+
     return {
-        "updateType": f"{args.update_type}",
+        "updateType": f"{args_.update_type}",
         "type": "UPDATE",
         "agent": AGENT_INFO["agent"],
         "agentVersion": AGENT_INFO["agentVersion"],
         "pluginVersion": "",
-        "orgToken": f"{args.ws_token}",
-        "userKey": f"{args.ws_user_key}",
-        "product": f"{args.ws_product}",
+        "orgToken": f"{args_.ws_token}",
+        "userKey": f"{args_.ws_user_key}",
+        "product": f"{args_.ws_product}",
         "productVersion": "",
         "timeStamp": ts,
-        "projects": prj
+        "projects": projects
     }
 
 
-def get_files_from_pck(pck, sbom_f): # Keep for future. Extracting files from Package
+def get_project_split(args_, graph: SbomGraph):
+    """[(project name, SPDXIDs of its packages)] by --projectMapping or by components the SBOM describes. None means
+    a single project"""
+    mapping_file = try_or_error(lambda: args_.project_mapping, "")
+    roots = {}  # Project name -> SPDXIDs of the top level components
+    if mapping_file:
+        try:
+            with open(mapping_file, encoding="utf-8") as f:
+                for prj_name, spdx_ids in json.load(f).items():
+                    roots[prj_name] = spdx_ids if isinstance(spdx_ids, list) else [spdx_ids]
+        except Exception as err:
+            logger.error('[%s] Unable to read project mapping: %s', ex(), err)
+            exit(-1)
+    elif try_or_error(lambda: args_.split_projects.lower(), "false") == "true":
+        for spdx_id in graph.describes:
+            roots.setdefault(try_or_error(lambda: graph.packages[spdx_id]["name"], spdx_id), []).append(spdx_id)
+        if not roots:
+            logger.warning('SBOM describes no components, it is imported as a single project')
+    return [(prj_name, graph.get_members(spdx_ids)) for prj_name, spdx_ids in roots.items()] if roots else None
+
+
+def get_files_from_pck(pck, graph: SbomGraph): # Keep for future. Extracting files from Package
     file_lst = []
     try:
         f = pck['hasFiles']
@@ -540,17 +970,13 @@ def get_files_from_pck(pck, sbom_f): # Keep for future. Extracting files from Pa
     except:
         files = []
     for file_ in files:
-        file_lst.append(get_file_by_spdx(file_, sbom_f))
+        file_lst.append(get_file_by_spdx(file_, graph))
     return file_lst
 
 
-def get_file_by_spdx(spdx, sbom_f):
+def get_file_by_spdx(spdx, graph: SbomGraph):
     file_data = {}
-    sbom_f_ = None
-    for d in sbom_f:
-        if d['SPDXID'] == spdx:
-            sbom_f_ = d
-            break
+    sbom_f_ = graph.files.get(spdx)
 
     if sbom_f_:
         sha1 = try_or_error(lambda: f"{sbom_f_['checksums'][0]['checksumValue']}", "")
@@ -580,39 +1006,128 @@ def analyze_proxy(proxy: str):
     return proxy_
 
 
-def upload_to_mend(upload):
+def split_upload(projects: list, chunk_size: int) -> list:  # [(project index, [project])] with bounded size
+    chunks = []
+    for i, proj in enumerate(projects):
+        proj_meta = {k: v for k, v in proj.items() if k != "dependencies"}
+        deps = proj.get("dependencies") or []  # Project without dependencies is sent as one empty chunk
+        group = []
+        group_size = 0
+        for dep_ in deps:
+            dep_size = len(json.dumps(dep_, default=encode_record))
+            if group and chunk_size and group_size + dep_size > chunk_size:
+                chunks.append((i, [{**proj_meta, "dependencies": group}]))
+                group = []
+                group_size = 0
+            group.append(dep_)
+            group_size += dep_size
+        if group or not deps:
+            chunks.append((i, [{**proj_meta, "dependencies": group}]))
+    return chunks
+
+
+def send_update_request(json_prj: str, update_type: str, args_, request: dict = None) -> dict:
+    """Upload projects of update request. Keys and product are taken from the request, which could be read from file
+    created before, or from args_"""
+    request = request if request else {}
     ts = round(datetime.datetime.now().timestamp())
+    '''
+    data = f"type=UPDATE&updateType={args.update_type}&agent={AGENT_INFO['agent']}&" \
+           f"agentVersion={AGENT_INFO['agentVersion']}&token={args.ws_token}&userKey={args.ws_user_key}&" \
+           f"product={args.ws_product}&timeStamp={ts}&diff={json_prj}"
+
+           The different Agent names and versions are not acceptable for current API 1.4 method
+    '''
+    data = urlencode({"type": "UPDATE", "updateType": update_type, "agent": "fs-agent", "agentVersion": "''",
+                      "token": request.get("orgToken") or args_.ws_token,
+                      "userKey": request.get("userKey") or args_.ws_user_key,
+                      "product": request.get("product", try_or_error(lambda: args_.ws_product, "")),
+                      "timeStamp": ts, "diff": json_prj})
+    header = {'Content-Type': 'application/x-www-form-urlencoded'}
+    if try_or_error(lambda: args_.upload_compression, "none") == "gzip":
+        data = gzip.compress(data.encode("utf-8"))
+        header['Content-Encoding'] = 'gzip'
+    return json.loads(call_api(header=header, data=data, agent=True))
+
+
+def merge_upload_results(res: dict, data_json: dict) -> dict:  # Combine responses of uploaded chunks
+    if not res:
+        return data_json
+    for key_ in ("createdProjects", "updatedProjects"):
+        res[key_] += [p for p in data_json[key_] if p not in res[key_]]
+    res["updatedProjects"] = [p for p in res["updatedProjects"] if p not in res["createdProjects"]]
+    res["projectNamesToIds"].update(data_json["projectNamesToIds"])
+    res["requestToken"] = data_json["requestToken"]
+    return res
+
+
+def log_partial_upload(sent: int, chunks: int, args_):  # Chunks sent stay in Mend until the upload is finished
+    upload_file = try_or_error(lambda: args_.upload_file, "") or get_update_request_path(args_)
+    logger.warning('Upload stopped after %s of %s chunks, projects in Mend have just part of their dependencies. '
+                   'Run again to finish it, the chunks sent are skipped: %s --url %s --uploadFile %s '
+                   '--uploadChunkSize %s --dir %s', sent, chunks, __tool_name__, args_.ws_url, upload_file,
+                   args_.upload_chunk_size, args_.out_dir)
+
+
+def upload_to_mend(upload, args_=None):
+    args_ = args_ if args_ else args
     ret = None
+    chunks = []
+    state = {"sent": []}
     try:
-        json_prj = json.dumps(upload['projects'])  # API understands just JSON Array type, not simple List
         upload_projects = [try_or_error(lambda: proj["coordinates"]["artifactId"], try_or_error(lambda: proj["projectToken"], "")) for proj in upload["projects"]]
         if len(upload_projects) > 1:
             proj_txt = "\n  ".join(upload_projects)
-            logger.debug(f'[{fn()}] Uploading projects:\n  {proj_txt}')
+            logger.debug('Uploading projects:\n  %s', proj_txt)
         else:
-            logger.debug(f'[{fn()}] Uploading project:  {upload_projects[0]}')
-        '''
-        data = f"type=UPDATE&updateType={args.update_type}&agent={AGENT_INFO['agent']}&" \
-               f"agentVersion={AGENT_INFO['agentVersion']}&token={args.ws_token}&userKey={args.ws_user_key}&" \
-               f"product={args.ws_product}&timeStamp={ts}&diff={json_prj}"
-               
-               The different Agent names and versions are not acceptable for current API 1.4 method
-        '''
-        data = f"type=UPDATE&updateType={args.update_type}&agent=fs-agent&" \
-               f"agentVersion=''&token={args.ws_token}&userKey={args.ws_user_key}&" \
-               f"product={args.ws_product}&timeStamp={ts}&diff={json_prj}"
-        header = {'Content-Type': 'application/x-www-form-urlencoded'}
-        data = json.loads(call_api(header=header, data=data, agent=True))
-
-        data_json = json.loads(data["data"])
-        data_json["product"] = upload.get("product")
-        logger.debug(f'[{fn()}] Response:\n{json.dumps(data_json, indent=2)}')
-        if data['status'] == 1:
-            ret = data_json
-        else:
-            logger.error(f"Mend update request failed: {data['message']} ({data['data']})")
+            logger.debug('Uploading project:  %s', upload_projects[0])
+
+        chunk_size = try_or_error(lambda: int(args_.upload_chunk_size * 1024), 0)
+        chunks = split_upload(upload["projects"], chunk_size) if chunk_size else [(None, upload["projects"])]
+        state_path = os.path.join(args_.out_dir, UPLOAD_STATE_FILE)
+        payload_hash = hashlib.sha256(f"{upload.get('updateType', args_.update_type)}{chunk_size}".encode("utf-8") +
+                                      json.dumps(upload["projects"], default=encode_record).encode("utf-8")).hexdigest()
+        state = {"payload": payload_hash, "sent": [], "results": None}
+        if len(chunks) > 1 and os.path.isfile(state_path):
+            with open(state_path) as f:
+                prev_state = json.load(f)
+            if prev_state.get("payload") == payload_hash:
+                state = prev_state
+                logger.info('Resuming upload, %s of %s chunks were sent before', len(state["sent"]), len(chunks))
+
+        proj_started = set()
+        for i, (proj_idx, chunk_prj) in enumerate(chunks):
+            # Every chunk except the first one of a project is appended to what was sent before
+            update_type = upload.get("updateType", args_.update_type) if proj_idx not in proj_started else "APPEND"
+            proj_started.add(proj_idx)
+            if i in state["sent"]:
+                continue
+            json_prj = json.dumps(chunk_prj, default=encode_record)  # API understands just JSON Array type, not simple List
+            if len(chunks) > 1:
+                logger.info('Uploading chunk %s/%s (%s bytes, %s)', i + 1, len(chunks), len(json_prj), update_type)
+            data = send_update_request(json_prj, update_type, args_, upload)
+            data_json = json.loads(data["data"])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Response:\n%s', json.dumps(data_json, indent=2))
+            if data['status'] != 1:
+                logger.error('Mend update request failed: %s (%s)', data['message'], data['data'])
+                if state["sent"]:
+                    log_partial_upload(len(state["sent"]), len(chunks), args_)
+                return None
+            state["results"] = merge_upload_results(state["results"], data_json)
+            state["sent"].append(i)
+            if len(chunks) > 1:
+                with open(state_path, 'w') as f:
+                    json.dump(state, f)
+
+        if os.path.isfile(state_path):
+            os.remove(state_path)
+        ret = state["results"]
+        ret["product"] = upload.get("product")
     except Exception as err:
-        logger.error(f"[{ex()}] Upload failed: {err}")
+        logger.error('[%s] Upload failed: %s', ex(), err)
+        if state["sent"] and len(state["sent"]) < len(chunks):
+            log_partial_upload(len(state["sent"]), len(chunks), args_)
     return ret
 
 
@@ -623,9 +1138,10 @@ def extract_url(url: str) -> str:
     return url_[0:pos] if pos > -1 else url_
 
 
-def analyse_scope(scope: str):
+def analyse_scope(scope: str, args_=None):
+    args_ = args_ if args_ else args
     scope_layers = scope.split("//") if scope else [""]
-    logger.debug(f'[{fn()}] Scope layers: {scope_layers}')
+    logger.debug('Scope layers: %s', scope_layers)
     len_ = len(scope_layers)
     prd_name = DFLT_PRD_NAME
     if len_ == 3:  # Provided Organization//Product//Project
@@ -637,35 +1153,268 @@ def analyse_scope(scope: str):
     else:
         prj_name = scope_layers[0]
 
-    args.ws_product = prd_name
-    logger.debug(f'[{fn()}] Product name: {prd_name}')
-
-    if prj_name:
-        logger.debug(f'[{fn()}] Attempting to resolve project scope')
+    args_.ws_product = prd_name
+    logger.debug('Product name: %s', prd_name)
+
+    if prj_name and is_offline_resolution(args_):
+        args_.scope_token = ""
+    elif prj_name and (args_.ws_url, args_.ws_token, prj_name) in scope_tokens:
+        args_.scope_token = scope_tokens[(args_.ws_url, args_.ws_token, prj_name)]
+        args_.ws_product = ""
+        logger.debug('Project token resolved before: %s', args_.scope_token)
+    elif prj_name:
+        logger.debug('Attempting to resolve project scope')
         try:
             header = {"Content-Type": "application/json"}
             data = json.dumps(
                 {"requestType": "getProjectVitals",
-                 "userKey": args.ws_user_key,
-                 "orgToken": args.ws_token,
+                 "userKey": args_.ws_user_key,
+                 "orgToken": args_.ws_token,
                  "projectToken": prj_name
                  })
             rt = json.loads(call_api(header=header, data=data))
-            args.scope_token = rt['projectVitals'][0]['token']
-            args.ws_product = ""
-            logger.debug(f'[{fn()}] Project token: {args.scope_token}')
+            args_.scope_token = rt['projectVitals'][0]['token']
+            args_.ws_product = ""
+            scope_tokens[(args_.ws_url, args_.ws_token, prj_name)] = args_.scope_token
+            logger.debug('Project token: %s', args_.scope_token)
         except:
-            args.scope_token = ""
-    args.ws_project = prj_name
-    logger.debug(f'[{fn()}] Project name: {args.ws_project}')
+            args_.scope_token = ""
+    args_.ws_project = prj_name
+    logger.debug('Project name: %s', args_.ws_project)
+
+
+def get_lang_ranker(args_):  # Shared by every SBOM imported in this process
+    global lang_ranker
+    if try_or_error(lambda: args_.lang_ranking.lower(), "false") != "true":
+        return None
+    with session_lock:
+        if lang_ranker is None:
+            lang_ranker = LangRanker()
+        return lang_ranker
+
+
+def open_cache(args_):
+    global lib_cache, lang_ranker
+    lib_results.ttl = try_or_error(lambda: float(args_.cache_ttl), DFLT_CACHE_TTL) * 3600  # Kept in memory the same time
+    if try_or_error(lambda: args_.no_cache, True):
+        return None
+    cache_dir = args_.cache_dir if args_.cache_dir else os.path.join(args_.out_dir, DFLT_CACHE_DIR)
+    try:
+        lib_cache = LookupCache(cache_dir=cache_dir, ttl=args_.cache_ttl)
+        logger.debug('Library search cache: %s', lib_cache.path)
+        if try_or_error(lambda: args_.lang_ranking.lower(), "false") == "true":
+            lang_ranker = open_ranker(cache_dir)  # Language type statistics of previous runs
+    except Exception as err:
+        logger.warning('[%s] Library search cache is disabled: %s', ex(), err)
+        lib_cache = None
+    return lib_cache
+
+
+def open_lib_index(args_):
+    global lib_index
+    index_path = try_or_error(lambda: args_.lib_index, "")
+    if not index_path:
+        if is_offline_resolution(args_):
+            logger.warning('Offline resolution without library index, just packages with SHA1 will be resolved')
+        return None
+    lib_index = LibraryIndex(index_path)
+    if try_or_error(lambda: args_.lib_index_import, ""):
+        lib_index.import_dump(args_.lib_index_import)
+    logger.info('Library index: %s, %s libraries', lib_index.path, lib_index.count())
+    return lib_index
+
+
+def get_update_request_path(args_) -> str:
+    return os.path.join(args_.out_dir, get_output_file(try_or_error(lambda: args_.output_format, "json")))
+
+
+def generate_update_request(args_, manifest: dict = None) -> dict:
+    full_path = get_update_request_path(args_)
+
+    logger.debug('Resolving project scope')
+    with run_metrics.phase("scope"):
+        analyse_scope(args_.scope_token, args_)
+
+    logger.debug('Generating json body')
+    with run_metrics.phase("body"):
+        output_json = create_body(args_, manifest)
+
+    logger.debug('Creating update request file')
+    with run_metrics.phase("write"):
+        write_update_request(full_path, output_json, try_or_error(lambda: args_.output_format, "json"))
+    logger.info('Update request created successfully: %s', full_path)
+    return output_json
+
+
+def get_incremental_upload(output_json: dict, args_, manifest: dict = None):  # What should be uploaded, None to skip
+    if manifest is None:
+        return output_json
+    if is_unchanged(manifest, output_json["projects"]):
+        logger.info('Incremental import: no changes since previous upload, skipping')
+        return None
+    if args_.incremental == "delta":
+        delta = get_delta(manifest, output_json["projects"])
+        if delta:
+            logger.info('Incremental import: appending %s new dependencies',
+                        sum(len(p["dependencies"]) for p in delta))
+            return {**output_json, "updateType": "APPEND", "projects": delta}
+    return output_json
+
+
+def upload_update_request(output_json: dict, args_, manifest: dict = None):
+    upload = get_incremental_upload(output_json, args_, manifest)
+    with run_metrics.phase("upload"):
+        res_upload = upload_to_mend(upload, args_) if upload else None
+    if manifest is not None:
+        save_manifest(args_.out_dir, manifest, output_json["projects"], args_.update_type,
+                      uploaded=bool(res_upload) or upload is None)
+    return upload, res_upload
+
+
+def get_upload_summary(res_upload: dict, args_=None) -> str:
+    args_ = args_ if args_ else args
+    proj_ids = res_upload["projectNamesToIds"]
+    proj_updated = [f'{p} ({args_.ws_url}{PROJ_URL}{proj_ids[p]})' for p in res_upload["updatedProjects"]]
+    proj_created = [f'{p} ({args_.ws_url}{PROJ_URL}{proj_ids[p]})' for p in res_upload["createdProjects"]]
+    res_txt = f'Upload successful\n  Organization: {res_upload["organization"]}'
+    if res_upload["product"]:
+        res_txt = f'{res_txt}\n  Product: {res_upload["product"]}'
+    if len(proj_created) > 1:
+        res_txt = f'{res_txt}\n  Projects created:'
+        for pj in proj_created:
+            res_txt = f'{res_txt}\n    {pj}'
+    elif len(proj_created) > 0:
+        res_txt = f'{res_txt}\n  Project created: {proj_created[0]}'
+    if len(proj_updated) > 1:
+        res_txt = f'{res_txt}\n  Projects updated:'
+        for pj in proj_updated:
+            res_txt = f'{res_txt}\n    {pj}'
+    elif len(proj_updated) > 0:
+        res_txt = f'{res_txt}\n  Project updated: {proj_updated[0]}'
+    return res_txt
+
+
+def get_batch_list(batch: str, scope: str) -> list:  # [(SBOM path, scope)] from directory, glob or manifest
+    if os.path.isdir(batch):
+        files = sorted(os.path.join(batch, f_) for f_ in os.listdir(batch)
+                       if os.path.splitext(f_)[1].lower() in BATCH_EXTS)
+    elif os.path.isfile(batch):  # Manifest: JSON {"sbom": "scope"} or CSV with "sbom" and "scope" columns
+        base_dir = os.path.dirname(os.path.abspath(batch))
+        with open(batch, encoding="utf-8") as f:
+            if os.path.splitext(batch)[1].lower() == ".csv":
+                entries = [(row["sbom"], try_or_error(lambda: row["scope"], "")) for row in csv.DictReader(f)]
+            else:
+                entries = list(json.load(f).items())
+        return [(os.path.join(base_dir, sbom_), scope_ if scope_ else "") for sbom_, scope_ in entries]
+    else:
+        files = sorted(f_ for f_ in glob.glob(batch, recursive=True) if os.path.isfile(f_))
+    # Without manifest each SBOM goes to its own project named by file under the product from --scope
+    prd_name = scope.split("//")[-1] if scope else DFLT_PRD_NAME
+    return [(f_, f"{prd_name}//{os.path.splitext(os.path.basename(f_))[0]}") for f_ in files]
+
+
+def import_batch_item(args_) -> dict:
+    started = datetime.datetime.now()
+    res = {"sbom": args_.sbom, "scope": args_.scope_token, "updateRequest": "", "dependencies": 0, "status": "failed"}
+    with run_metrics.scope() as item_metrics:  # Written for this SBOM, counted in metrics of the run too
+        try:
+            os.makedirs(args_.out_dir, exist_ok=True)
+            manifest = load_manifest(args_.out_dir) if try_or_error(lambda: args_.incremental, "false") != "false" else None
+            output_json = generate_update_request(args_, manifest)
+            res["updateRequest"] = get_update_request_path(args_)
+            res["dependencies"] = sum(len(prj["dependencies"]) for prj in output_json["projects"])
+            res["status"] = "created"
+            if args_.offline.lower() == "false":
+                upload, res_upload = upload_update_request(output_json, args_, manifest)
+                if res_upload:
+                    res["status"] = "uploaded"
+                    res["createdProjects"] = res_upload["createdProjects"]
+                    res["updatedProjects"] = res_upload["updatedProjects"]
+                    logger.info('%s: %s', args_.sbom, get_upload_summary(res_upload, args_))
+                elif upload is None:
+                    res["status"] = "unchanged"
+                else:
+                    res["status"] = "failed"
+                    res["error"] = "Upload failed"
+            elif manifest is not None:
+                save_manifest(args_.out_dir, manifest, output_json["projects"], args_.update_type, uploaded=False)
+        except BaseException as err:  # create_body stops execution by exit() in case of unrecoverable error
+            logger.error('Failed to import %s: %s', args_.sbom, err)
+            res["error"] = str(err)
+    res["duration"] = round((datetime.datetime.now() - started).total_seconds(), 3)
+    write_run_metrics(args_, item_metrics)
+    return res
+
+
+def import_batch(args_) -> dict:
+    batch_list = get_batch_list(args_.batch, args_.scope_token)
+    logger.info('Batch import of %s SBOM files with %s workers', len(batch_list), args_.batch_workers)
+    jobs = []
+    out_dirs = set()
+    for sbom_, scope_ in batch_list:
+        out_dir = os.path.join(args_.out_dir, os.path.splitext(os.path.basename(sbom_))[0])
+        while out_dir in out_dirs:  # The same file names in different folders
+            out_dir = f"{out_dir}_{len(out_dirs)}"
+        out_dirs.add(out_dir)
+        jobs.append(argparse.Namespace(**{**vars(args_), "sbom": sbom_, "scope_token": scope_, "out_dir": out_dir}))
+
+    with ThreadPoolExecutor(max_workers=max(args_.batch_workers, 1), thread_name_prefix="batch") as executor:
+        results = list(executor.map(import_batch_item, jobs))
+
+    summary = {
+        "total": len(results),
+        "succeeded": len([r for r in results if r["status"] != "failed"]),
+        "failed": len([r for r in results if r["status"] == "failed"]),
+        "dependencies": sum(r["dependencies"] for r in results),
+        "files": results
+    }
+    full_path = os.path.join(args_.out_dir, BATCH_SUMMARY_FILE)
+    with open(full_path, 'w') as outfile:
+        json.dump(summary, outfile, indent=4)
+    logger.info('Batch import finished: %s succeeded, %s failed. Summary: %s',
+                summary["succeeded"], summary["failed"], full_path)
+    return summary
+
+
+def write_run_metrics(args_, metrics: RunMetrics = None):  # metrics: of the run by default
+    metrics = metrics if metrics else run_metrics
+    try:
+        prom_path = os.path.join(args_.out_dir, PROMETHEUS_FILE) \
+            if try_or_error(lambda: args_.prometheus_metrics.lower(), "false") == "true" else ""
+        metrics.write(os.path.join(args_.out_dir, METRICS_FILE), prom_path)
+        logger.debug('Run metrics saved: %s', os.path.join(args_.out_dir, METRICS_FILE))
+    except Exception as err:
+        logger.warning('[%s] Run metrics were not saved: %s', ex(), err)
+
+
+def open_async_client(args_):
+    global async_client
+    proxy = analyze_proxy(args_.proxy) if args_.proxy else ""
+    async_client = AsyncMendClient(concurrency=args_.concurrency, rate_limit=args_.rate_limit, retries=args_.retries,
+                                   backoff=RETRY_BACKOFF, retry_statuses=RETRY_STATUSES,
+                                   upload_retry_statuses=UPLOAD_RETRY_STATUSES,
+                                   connect_timeout=args_.connect_timeout, read_timeout=args_.read_timeout,
+                                   proxy=f"http://{proxy}" if proxy else "")
+    logger.debug('Async engine: concurrency=%s, rate limit=%s', args_.concurrency, args_.rate_limit)
+    return async_client
+
+
+def close_async_client():
+    global async_client
+    if async_client:
+        async_client.close()
+        async_client = None
 
 
 def main():
     global args
     output_json = {}
+    manifest = None
 
     try:
         args = parse_args()
+        if try_or_error(lambda: args.log_format, "text") == "json":
+            s_handler.setFormatter(JsonLogFormatter(datefmt="%Y-%m-%d %H:%M:%S"))
         if try_or_error(lambda: args.version, False):
             # Just show current version
             print(f'{AGENT_INFO["agent"]} {AGENT_INFO["agentVersion"]}')
@@ -675,73 +1424,84 @@ def main():
             hdr = f'\n{len(hdr_title) * "="}\n{hdr_title}\n{len(hdr_title) * "="}'
             logger.info(hdr)
             log_obj_props(args, "Configuration:")
-            data = json.dumps(
-                {
-                    "requestType": "getOrganizationDetails",
-                    "orgToken": args.ws_token ,
-                    "userKey": args.ws_user_key
-            }
-            )
-            call_api(header={"Content-Type": "application/json"}, data = data)
-
-            if not os.path.isfile(args.sbom):
-                logger.error(f'[{fn()}] Input file does not exist: {args.out_dir}')
+            if args.engine == "async":
+                open_async_client(args)
+            if is_offline_resolution(args) and not args.upload_file:
+                args.offline = "true"  # Nothing is sent to Mend
+            else:
+                data = json.dumps(
+                    {
+                        "requestType": "getOrganizationDetails",
+                        "orgToken": args.ws_token ,
+                        "userKey": args.ws_user_key
+                }
+                )
+                call_api(header={"Content-Type": "application/json"}, data = data)
+
+            input_file = args.upload_file if args.upload_file else args.sbom
+            if not (args.batch or args.service) and not os.path.isfile(input_file):
+                logger.error('Input file does not exist: %s', input_file)
                 exit(-1)
 
             if not os.path.isdir(args.out_dir):
-                logger.info(f'[{fn()}] Creating output directory: {args.out_dir}')
+                logger.info('Creating output directory: %s', args.out_dir)
                 try:
                     os.mkdir(args.out_dir)
                 except Exception as err:
-                    logger.error(f'[{ex()}] {err}')
+                    logger.error('[%s] %s', ex(), err)
                     exit(-1)
 
-            logger.info(f'[{fn()}] Generating update request')
-            full_path = os.path.join(args.out_dir, UPDATE_REQUEST_FILE)
-
-            logger.debug(f'[{fn()}] Resolving project scope')
-            analyse_scope(args.scope_token)
-
-            logger.debug(f'[{fn()}] Generating json body')
-            output_json = create_body(args)
-
-            logger.debug(f'[{fn()}] Creating update request file')
-            with open(full_path, 'w') as outfile:
-                json.dump(output_json, outfile, indent=4)
-            logger.info(f'[{fn()}] Update request created successfully: {full_path}')
+            open_cache(args)
+            open_lib_index(args)
+            if args.batch:
+                summary = import_batch(args)
+                close_async_client()
+                write_run_metrics(args)
+                exit(-1 if summary["failed"] else 0)
+            if args.service:  # Caches, connections and project tokens are kept between jobs
+                run_service(args.service, ImportService(args, import_batch_item, args.batch_workers,
+                                                        run_metrics.to_prometheus))
+                close_async_client()
+                write_run_metrics(args)
+                exit(0)
+
+            if args.upload_file:
+                logger.info('Reading update request: %s', args.upload_file)
+                args.offline = "false"
+                output_json = read_update_request(args.upload_file)
+            else:
+                logger.info('Generating update request')
+                manifest = load_manifest(args.out_dir) if try_or_error(lambda: args.incremental, "false") != "false" else None
+                output_json = generate_update_request(args, manifest)
     except Exception as err:
-        logger.error(f'[{ex()}] Failed to create update request file: {err}')
+        logger.error('[%s] Failed to create update request file: %s', ex(), err)
         exit(-1)
+    finally:
+        if lib_cache:
+            lib_cache.close()
+        if lib_index:
+            lib_index.close()
+        if lang_ranker:
+            lang_ranker.save()
 
     try:
         if args.offline.lower() == "false":
-            logger.info(f'[{fn()}] Uploading data to Mend')
-            res_upload = upload_to_mend(output_json)
+            logger.info('Uploading data to Mend')
+            upload, res_upload = upload_update_request(output_json, args, manifest)
             if res_upload:
-                proj_ids = res_upload["projectNamesToIds"]
-                proj_updated = [f'{p} ({args.ws_url}{PROJ_URL}{proj_ids[p]})' for p in res_upload["updatedProjects"]]
-                proj_created = [f'{p} ({args.ws_url}{PROJ_URL}{proj_ids[p]})' for p in res_upload["createdProjects"]]
-                res_txt = f'Upload successful\n  Organization: {res_upload["organization"]}'
-                if res_upload["product"]:
-                    res_txt = f'{res_txt}\n  Product: {res_upload["product"]}'
-                if len(proj_created) > 1:
-                    res_txt = f'{res_txt}\n  Projects created:'
-                    for pj in proj_created:
-                        res_txt = f'{res_txt}\n    {pj}'
-                elif len(proj_created) > 0:
-                    res_txt = f'{res_txt}\n  Project created: {proj_created[0]}'
-                if len(proj_updated) > 1:
-                    res_txt = f'{res_txt}\n  Projects updated:'
-                    for pj in proj_updated:
-                        res_txt = f'{res_txt}\n    {pj}'
-                elif len(proj_updated) > 0:
-                    res_txt = f'{res_txt}\n  Project updated: {proj_updated[0]}'
-                logger.info(f'[{fn()}] {res_txt}')
-                logger.debug(f'[{fn()}] Request token: {res_upload["requestToken"]}')
+                logger.info('%s', get_upload_summary(res_upload))
+                logger.debug('Request token: %s', res_upload["requestToken"])
+            elif upload is not None:  # Failure is logged by upload_to_mend
+                exit(-1)
+        elif manifest is not None:
+            save_manifest(args.out_dir, manifest, output_json["projects"], args.update_type, uploaded=False)
 
     except Exception as err:
-        logger.error(f"[{ex()}] Upload failed: {err}")
+        logger.error('[%s] Upload failed: %s', ex(), err)
         exit(-1)
+    finally:
+        close_async_client()
+        write_run_metrics(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import shutil
+import signal
+import socketserver
+import stat
+import threading
+import time
+import uuid
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from mend_import_sbom._version import __tool_name__
+
+logger = logging.getLogger(__tool_name__)
+
+UNIX_PREFIX = "unix:"
+DFLT_SERVICE_PORT = 8765
+MAX_FINISHED_JOBS = 1000  # Status, result and directory of older finished jobs are dropped
+MAX_REQUEST_SIZE = 512 * 1024 * 1024  # Inline SBOM included
+CALLBACK_TIMEOUT = 30
+JOBS_DIR = "jobs"
+
+
+def parse_address(address: str):
+    """Unix socket path or (host, port) of "unix:/path", "host:port", "host" or ":port" """
+    if address.startswith(UNIX_PREFIX):
+        return address[len(UNIX_PREFIX):]
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host or "127.0.0.1", int(port) if port else DFLT_SERVICE_PORT
+
+
+class ImportService:  # Import jobs accepted over local API, run by workers sharing caches, connections and scopes
+    def __init__(self, base_args: Namespace, run_job, workers: int = 1, get_metrics=None):
+        self.base_args = base_args
+        self.run_job = run_job  # Namespace -> result dict with "status", the same as in batch mode
+        self.get_metrics = get_metrics  # -> Prometheus text of the process
+        self.started = time.time()
+        self.jobs = {}  # id -> job, in order of submission
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="job")
+
+    def submit(self, request: dict) -> dict:
+        """Queue import of request {"sbom": path} or {"sbomBody": SPDX JSON object or text, "sbomFormat": "json|csv"}
+        with optional "scope", "updateType", "offline" and "callbackUrl" """
+        sbom = request.get("sbom", "")
+        body = request.get("sbomBody")
+        if bool(sbom) == (body is not None):
+            raise ValueError('Either "sbom" or "sbomBody" is required')
+        if sbom and not os.path.isfile(sbom):
+            raise ValueError(f"SBOM file does not exist: {sbom}")
+        job_id = uuid.uuid4().hex
+        out_dir = os.path.join(self.base_args.out_dir, JOBS_DIR, job_id)
+        os.makedirs(out_dir, exist_ok=True)
+        if body is not None:  # Kept with the update request of the job
+            sbom = os.path.join(out_dir, "sbom.csv" if request.get("sbomFormat") == "csv" else "sbom.json")
+            with open(sbom, "w", encoding="utf-8") as f:
+                f.write(body if isinstance(body, str) else json.dumps(body))
+        job_args = Namespace(**{**vars(self.base_args), "sbom": sbom, "out_dir": out_dir,
+                                "scope_token": request.get("scope", self.base_args.scope_token) or "",
+                                "update_type": request.get("updateType", self.base_args.update_type),
+                                "offline": str(request.get("offline", self.base_args.offline)).lower()})
+        job = {"id": job_id, "status": "queued", "sbom": sbom, "scope": job_args.scope_token,
+               "updateType": job_args.update_type, "submitted": time.time()}
+        with self._lock:
+            self.jobs[job_id] = job
+            dropped = self._drop_finished()
+        for id_ in dropped:  # Update request and SBOM of the job are not needed once its status is gone
+            shutil.rmtree(os.path.join(self.base_args.out_dir, JOBS_DIR, id_), ignore_errors=True)
+        self._executor.submit(self._run, job, job_args, request.get("callbackUrl", ""))
+        logger.info('Job %s queued: %s', job_id, sbom)
+        return dict(job)
+
+    def _run(self, job: dict, job_args: Namespace, callback_url: str):
+        with self._lock:
+            job["status"] = "running"
+            job["started"] = time.time()
+        try:
+            result = self.run_job(job_args)
+        except BaseException as err:  # Not expected, the job function reports its failures in the result
+            result = {"status": "failed", "error": str(err)}
+        with self._lock:
+            job["result"] = result
+            job["status"] = "failed" if result.get("status") == "failed" else "done"
+            job["finished"] = time.time()
+            snapshot = dict(job)
+        logger.info('Job %s %s: %s', job["id"], snapshot["status"], result.get("status"))
+        if callback_url:
+            try:
+                requests.post(callback_url, json=snapshot, timeout=CALLBACK_TIMEOUT)
+            except Exception as err:
+                logger.warning('Job %s: callback failed: %s', job["id"], err)
+
+    def _drop_finished(self) -> list:  # Ids of the oldest finished jobs dropped
+        finished = [id_ for id_, job in self.jobs.items() if "finished" in job]
+        dropped = finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]
+        for id_ in dropped:
+            del self.jobs[id_]
+        return dropped
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def get_status(self) -> dict:
+        with self._lock:
+            states = [job["status"] for job in self.jobs.values()]
+        return {"status": "ok", "uptimeSec": round(time.time() - self.started, 3),
+                "jobs": {state: states.count(state) for state in ("queued", "running", "done", "failed")}}
+
+    def list_jobs(self) -> list:
+        with self._lock:
+            return [{k: job[k] for k in ("id", "status", "sbom", "scope", "submitted")} for job in self.jobs.values()]
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):  # POST /jobs, GET /jobs, /jobs/<id>, /health and /metrics
+    def send_json(self, status: int, obj):
+        self.send_text(status, json.dumps(obj), "application/json")
+
+    def send_text(self, status: int, text: str, content_type: str = "text/plain; version=0.0.4"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/health":
+            self.send_json(200, service.get_status())
+        elif path == "/metrics" and service.get_metrics:
+            self.send_text(200, service.get_metrics())
+        elif path == "/jobs":
+            self.send_json(200, service.list_jobs())
+        elif path.startswith("/jobs/"):
+            job = service.get(path[len("/jobs/"):])
+            if job:
+                self.send_json(200, job)
+            else:
+                self.send_json(404, {"error": "Job not found"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path.split("?")[0].rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        size = int(self.headers.get("Content-Length") or 0)
+        if size > MAX_REQUEST_SIZE:
+            self.send_json(413, {"error": "Request is too large"})
+            return
+        try:
+            request = json.loads(self.rfile.read(size) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("Job request should be a JSON object")
+            self.send_json(202, self.server.service.submit(request))
+        except ValueError as err:  # JSON decode errors are value errors too
+            self.send_json(400, {"error": str(err)})
+
+    def log_message(self, format, *args):
+        logger.debug('Service: %s', format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):  # Request handlers expect (host, port) of client
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def create_server(address: str, service: ImportService):
+    addr = parse_address(address)
+    if isinstance(addr, str):
+        if os.path.lexists(addr):
+            if not stat.S_ISSOCK(os.lstat(addr).st_mode):
+                raise ValueError(f"Service address is not a socket: {addr}")
+            os.remove(addr)  # Left by previous service
+        server = UnixHTTPServer(addr, ServiceHandler)
+    else:
+        server = ThreadingHTTPServer(addr, ServiceHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def run_service(address: str, service: ImportService):
+    """Serve until interrupted, running jobs are finished before return"""
+    server = create_server(address, service)
+    try:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # Stopped like by Ctrl+C
+    except ValueError:  # Not in main thread
+        pass
+    logger.info('Service is listening on %s', address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Service is stopping')
+    finally:
+        server.server_close()
+        service.close()
+        if isinstance(server, UnixHTTPServer) and os.path.exists(server.server_address):
+            os.remove(server.server_address)
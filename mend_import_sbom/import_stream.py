@@ -0,0 +1,97 @@
+import json
+
+CHUNK_SIZE = 1 << 16
+SPDX_STREAM_KEYS = ("name", "creationInfo", "documentDescribes", "packages", "relationships")
+WHITESPACE = " \t\n\r"
+
+
+class JsonStream:  # Incremental reader of a JSON document, decodes one value at a time
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))  # Grow for long values
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:  # Next non-whitespace char, "" at the end of file
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"Expected '{chars}' but got '{ch}' in JSON stream")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:  # A number could be cut at the end of the buffer
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def skip(self):  # Pass over a value, arrays and objects are never materialized as a whole
+        ch = self.peek()
+        if ch == "[":
+            for _ in self.items():
+                pass
+        elif ch == "{":
+            for _ in self.members(skip_values=True):
+                pass
+        else:
+            self.value()
+
+    def items(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def members(self, keys=None, skip_values: bool = False):  # (key, value) of an object, others are skipped
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if skip_values or (keys is not None and key not in keys):
+                self.skip()
+            elif self.peek() == "[":
+                yield key, list(self.items())  # Decoded element by element to keep the buffer small
+            else:
+                yield key, self.value()
+            if self.expect(",}") == "}":
+                return
+
+
+def load_spdx_stream(path: str, keys=SPDX_STREAM_KEYS, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Read just the required top level properties of SPDX document. Large blocks like "files" are skipped"""
+    with open(path, "r", encoding="utf-8") as f:
+        return dict(JsonStream(f, chunk_size=chunk_size).members(keys=keys))
@@ -14,13 +14,16 @@ def pytest_addoption(parser):
     parser.addoption("--mendUrl", action="store", default ='saas.whitesourcesoftware.com')
     parser.addoption("--offline", action="store", default =False)
     parser.addoption("--out", action="store", default ='./')
+    parser.addoption("--multilang", action="store", default ='true')
+    parser.addoption("--threads", action="store", default =1)
 
 
 def pytest_configure(config):
     global args
     args = Namespace(ws_project=config.getoption("projectName"), ws_user_key=config.getoption("userKey"),ws_token=config.getoption("apiKey"),
                      scope_token=config.getoption("projectToken"),sbom=config.getoption("sbom"), update_type=config.getoption("updateType"),
-                     ws_product=config.getoption("productToken"),ws_url=config.getoption("mendUrl"),load=config.getoption("offline"),out_dir=config.getoption("out"))
+                     ws_product=config.getoption("productToken"),ws_url=config.getoption("mendUrl"),load=config.getoption("offline"),out_dir=config.getoption("out"),
+                     multilang=config.getoption("multilang"),threads=config.getoption("threads"))
     return args
 
 
@@ -1,14 +1,44 @@
+import gzip
+import hashlib
 import pytest
 import conftest
+import json
+import logging
 import os
+import pickle
 import sys
+import threading
+import time
+import requests
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from requests.adapters import HTTPAdapter
 
 PROJECT_ROOT = os.path.abspath(os.path.join(
                   os.path.dirname(__file__),
                   os.pardir)
 )
 sys.path.append(PROJECT_ROOT)
-from mend_import_sbom import import_sbom
+from mend_import_sbom import import_sbom, import_bench, import_service
+from mend_import_sbom.import_bench import generate_csv, generate_relationships
+from mend_import_sbom.import_cache import LookupCache, MemoryCache
+from mend_import_sbom.import_const import SHA1CalcType
+from mend_import_sbom.import_manifest import load_manifest
+from mend_import_sbom.import_metrics import RunMetrics, METRICS_FILE, PROMETHEUS_FILE
+from mend_import_sbom.import_index import LibraryIndex, INDEX_FILE
+from mend_import_sbom.import_output import UPDATE_REQUEST_FILE, OUTPUT_FORMATS, write_update_request, read_update_request
+from mend_import_sbom.import_rank import LangRanker, get_lang_signals
+from mend_import_sbom.import_record import DependencyRecord, encode_record
+from mend_import_sbom.import_service import ImportService, create_server
+from mend_import_sbom.import_stream import load_spdx_stream
+
+
+@pytest.fixture(autouse=True)
+def clean_lib_results(monkeypatch):
+    monkeypatch.setattr(import_sbom, "lib_results", MemoryCache())
 
 
 def test_create_body(project):
@@ -16,5 +46,762 @@ def test_create_body(project):
     assert out['orgToken'] != "" and out['userKey'] != "" and out['userKey'] != "product"
 
 
+def write_sbom(path, packages, relationships=()):
+    sbom = {
+        "name": "Test SBOM",
+        "creationInfo": {"creators": ["Tool: Test Generator"]},
+        "packages": packages,
+        "relationships": list(relationships)
+    }
+    with open(path, "w") as f:
+        json.dump(sbom, f)
+    return str(path)
+
+
+def fake_lib_search(known: dict):  # known: {(name, libraryType): sha1}
+    def call_api(header, data, agent=False, method="POST", agent_info_login=False):
+        req = json.loads(data)
+        sha1 = known.get((req["libraryName"], req["libraryType"]))
+        if sha1:
+            return json.dumps({"librariesInformation": [{"sha1": sha1, "artifactId": req["libraryName"]}]})
+        return json.dumps({"errorCode": 3010, "errorMessage": "Library not found"})
+    return call_api
+
+
+def test_create_body_threads(tmp_path, monkeypatch):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0"} for i in range(20)]
+    packages.append({"SPDXID": "SPDXRef-PACKAGE-purl", "name": "purl", "versionInfo": "2.0",
+                     "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": "pkg:npm/purl@2.0"}]})
+    known = {(f"lib{i}", ["maven", "npm", "go", "pypi"][i % 4]): f"{i:040x}" for i in range(20)}
+    known[("lib3", "maven")] = "f" * 40  # Found in several types, precedence must be kept
+    known[("purl", "npm")] = "a" * 40
+    search = fake_lib_search(known)
+    calls = []
+    monkeypatch.setattr(import_sbom, "call_api", lambda *args_, **kwargs: calls.append(1) or search(*args_, **kwargs))
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+
+    serial = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "threads": 1}))
+    serial_calls = len(calls)
+    calls.clear()
+    import_sbom.lib_results.clear()
+    parallel = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "threads": 8}))
+    assert serial["projects"][0]["dependencies"] == parallel["projects"][0]["dependencies"]
+    assert len(serial["projects"][0]["dependencies"]) == 21
+    # Just the first type of a package is searched in advance, not every type it could have
+    assert serial_calls <= len(calls) <= serial_calls + len(packages)
+
+
+def test_lib_cache(tmp_path, monkeypatch):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0",
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:npm/lib{i}@1.0"}]}
+                for i in range(4)]
+    api_calls = []
+    api = fake_lib_search({("lib0", "npm"): "a" * 40})
+    monkeypatch.setattr(import_sbom, "call_api", lambda **kwargs: api_calls.append(kwargs) or api(**kwargs))
+    monkeypatch.setattr(import_sbom, "lib_cache", LookupCache(cache_dir=str(tmp_path / "cache")))
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+
+    first = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom}))
+    assert len(api_calls) == 4
+    import_sbom.lib_results.clear()  # Results of this process are kept in memory too
+    second = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom}))
+    assert len(api_calls) == 4  # Hits and misses are both taken from the cache
+    assert first["projects"] == second["projects"]
+    assert import_sbom.lib_cache.hits == 4
+
+    results = MemoryCache(max_size=2, ttl=1)
+    for i in range(3):
+        results.put(("url", f"lib{i}", "1.0", "npm"), (f"{i:040x}", f"lib{i}", 0, ""))
+    assert len(results) == 2 and results.get(("url", "lib0", "1.0", "npm")) is None  # Least recently used is dropped
+    results.ttl = -1
+    assert results.get(("url", "lib2", "1.0", "npm")) is None  # Expired
+
+
+def test_create_body_deep_tree(tmp_path):
+    depth = 3 * sys.getrecursionlimit()
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}.jar", "name": f"lib{i}", "packageFileName": f"lib{i}.jar",
+                 "versionInfo": "1.0", "checksums": [{"algorithm": "SHA1", "checksumValue": f"{i:040x}"}]}
+                for i in range(depth)]
+    relationships = [{"spdxElementId": f"SPDXRef-PACKAGE-lib{i}.jar", "relatedSpdxElement": f"SPDXRef-PACKAGE-lib{i + 1}.jar",
+                      "relationshipType": "DEPENDS_ON"} for i in range(depth - 1)]
+    sbom = write_sbom(tmp_path / "sbom.json", packages, relationships)
+
+    deps = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom}))["projects"][0]["dependencies"]
+    assert len(deps) == 1
+    node, levels = deps[0], 1
+    while node.get("children"):
+        node, levels = node["children"][0], levels + 1
+    assert levels == depth
+
+
+def test_load_spdx_stream(tmp_path):
+    with open(conftest.args.sbom) as f:
+        sbom = json.load(f)
+    sbom["files"] = [{"SPDXID": f"SPDXRef-FILE-{i}", "fileName": f"./src/f{i}.c", "checksums": []} for i in range(100)]
+    path = write_sbom(tmp_path / "sbom.json", [])
+    with open(path, "w") as f:
+        json.dump(sbom, f, indent=2)
+
+    for chunk_size in (1, 7, 1024):
+        streamed = load_spdx_stream(path, chunk_size=chunk_size)
+        assert "files" not in streamed
+        assert streamed == {key: sbom[key] for key in ("name", "creationInfo", "documentDescribes", "packages",
+                                                       "relationships")}
+
+
+class StubMendHandler(BaseHTTPRequestHandler):  # Answers with queued (status, body) responses or by api function
+    responses = []
+    requests = []
+    api = None
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        self.requests.append(data)
+        if self.responses:
+            status, body = self.responses.pop(0)
+        else:
+            status, body = 200, self.api(header={}, data=data) if self.api else "{}"
+        self.send_response(status)
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMendHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StubMendHandler.responses, StubMendHandler.requests, StubMendHandler.api = [], [], None
+    monkeypatch.setattr(import_sbom, "extract_url", lambda url: f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(import_sbom, "http_session", None)
+    monkeypatch.setattr(import_sbom, "upload_session", None)
+    monkeypatch.setattr(import_sbom, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(import_sbom, "args", Namespace(**{**vars(conftest.args), "proxy": "", "retries": 2,
+                                                          "connect_timeout": 5, "read_timeout": 5}), raising=False)
+    yield StubMendHandler
+    server.shutdown()
+
+
+def test_call_api_retries(stub_server):
+    stub_server.responses = [(503, "busy"), (429, "slow down"), (200, '{"orgName": "Test"}')]
+    res = import_sbom.call_api(header={"Content-Type": "application/json"},
+                               data=json.dumps({"requestType": "getOrganizationDetails"}))
+    assert json.loads(res) == {"orgName": "Test"}
+    assert len(stub_server.requests) == 3
+    assert import_sbom.get_session() is import_sbom.get_session()
+
+    # Upload could be applied by the server before 500, 502 or 504, so it is retried just after 429 and 503
+    stub_server.requests.clear()
+    stub_server.responses = [(503, "busy"), (502, "bad gateway"), (200, "{}")]
+    import_sbom.call_api(header={}, data="type=UPDATE", agent=True)
+    assert len(stub_server.requests) == 2
+    assert import_sbom.get_session(agent=True) is not import_sbom.get_session()
+
+
+def test_import_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(import_sbom, "call_api", fake_lib_search({}))
+    batch_dir = tmp_path / "sboms"
+    batch_dir.mkdir()
+    for name in ("first", "second"):  # Packages of each SBOM are searched by --threads
+        write_sbom(batch_dir / f"{name}.json", [
+            {"SPDXID": f"SPDXRef-PACKAGE-{name}{i}", "name": f"{name}{i}", "versionInfo": "1.0",
+             "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:npm/{name}{i}@1.0"}]}
+            for i in range(3)])
+    (batch_dir / "notes.txt").write_text("Not an SBOM")
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    misses = import_sbom.run_metrics.to_dict()["cache"]["misses"]
+    summary = import_sbom.import_batch(Namespace(**{**vars(conftest.args), "batch": str(batch_dir), "batch_workers": 2,
+                                                    "scope_token": "Batch Product", "offline": "true", "threads": 4,
+                                                    "out_dir": str(out_dir)}))
+    assert summary["total"] == 2 and summary["failed"] == 0
+    assert [f["scope"] for f in summary["files"]] == ["Batch Product//first", "Batch Product//second"]
+    for name in ("first", "second"):
+        with open(out_dir / name / UPDATE_REQUEST_FILE) as f:
+            assert json.load(f)["projects"][0]["coordinates"]["artifactId"] == name
+    assert (out_dir / import_sbom.BATCH_SUMMARY_FILE).is_file()
+
+    # Every SBOM has its own run metrics, searches by --threads included, and the run counts them all
+    item_metrics = []
+    for name in ("first", "second"):
+        with open(out_dir / name / METRICS_FILE) as f:
+            item_metrics.append(json.load(f))
+    assert all(metrics["phases"]["body"]["calls"] == 1 for metrics in item_metrics)
+    assert [metrics["cache"]["misses"] for metrics in item_metrics] == [3, 3]
+    assert import_sbom.run_metrics.to_dict()["cache"]["misses"] - misses == 6
+
+
+def test_create_body_async_engine(stub_server, tmp_path, monkeypatch):
+    pytest.importorskip("aiohttp")
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0"} for i in range(10)]
+    stub_server.api = staticmethod(fake_lib_search({(f"lib{i}", ["maven", "npm", "go"][i % 3]): f"{i:040x}"
+                                                   for i in range(9)}))
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+    body_args = Namespace(**{**vars(import_sbom.args), "sbom": sbom, "concurrency": 4, "rate_limit": 0})
+
+    sync_body = import_sbom.create_body(body_args)
+    sync_requests = len(stub_server.requests)
+    import_sbom.lib_results.clear()
+    monkeypatch.setattr(import_sbom, "async_client", None)
+    import_sbom.open_async_client(body_args)
+    try:
+        async_body = import_sbom.create_body(body_args)
+        data = import_sbom.get_lib_search_data("lib0", "1.0", "maven", body_args)
+        assert import_sbom.parse_lib_search(import_sbom.call_api(header={}, data=data))[0] == f"{0:040x}"
+    finally:
+        import_sbom.close_async_client()
+    assert sync_body["projects"] == async_body["projects"]
+    assert len(sync_body["projects"][0]["dependencies"]) == 9
+    async_requests = len(stub_server.requests) - sync_requests - 1
+    assert sync_requests <= async_requests <= sync_requests + len(packages)  # Other types are searched on a miss
+
+
+def test_upload_to_mend_chunks(tmp_path, monkeypatch, caplog):
+    sent = []
+
+    def agent_api(header, data, agent=False, **kwargs):
+        form = parse_qs(gzip.decompress(data).decode())
+        diff = json.loads(form["diff"][0])
+        sent.append((form["updateType"][0], diff))
+        if len(sent) == 3 and not hasattr(agent_api, "failed"):  # Break the upload once
+            agent_api.failed = True
+            return json.dumps({"status": 2, "message": "Timeout", "data": "{}"})
+        name = diff[0]["coordinates"]["artifactId"]
+        return json.dumps({"status": 1, "data": json.dumps({
+            "organization": "Org", "createdProjects": [name] if len(sent) == 1 else [], "updatedProjects": [name],
+            "projectNamesToIds": {name: 1}, "requestToken": f"token{len(sent)}"})})
+
+    monkeypatch.setattr(import_sbom, "call_api", agent_api)
+    deps = [{"artifactId": f"lib{i}.jar", "sha1": f"{i:040x}", "children": []} for i in range(10)]
+    upload = {"product": "Product", "projects": [{"coordinates": {"artifactId": "Project"}, "dependencies": deps}]}
+    upload_args = Namespace(**{**vars(conftest.args), "out_dir": str(tmp_path), "upload_chunk_size": 0.2,
+                               "upload_compression": "gzip"})
+    caplog.set_level(logging.DEBUG, logger=import_sbom.logger.name)
+
+    assert import_sbom.upload_to_mend(upload, upload_args) is None
+    assert (tmp_path / import_sbom.UPLOAD_STATE_FILE).is_file()
+    assert f"--uploadFile {tmp_path / UPDATE_REQUEST_FILE} --uploadChunkSize 0.2 --dir {tmp_path}" in caplog.text
+    res = import_sbom.upload_to_mend(upload, upload_args)
+    assert not (tmp_path / import_sbom.UPLOAD_STATE_FILE).is_file()
+    assert res["createdProjects"] == ["Project"] and res["updatedProjects"] == []
+    assert sent[0][0] == "OVERRIDE" and all(update_type == "APPEND" for update_type, _ in sent[1:])
+    uploaded = [dep_ for i, (_, diff) in enumerate(sent) if i != 2 for dep_ in diff[0]["dependencies"]]
+    assert uploaded == deps  # Every dependency is sent just once, the failed chunk is sent again
+
+    sent.clear()
+    for deps_ in ([], None):  # Project without dependencies is overridden by one empty chunk
+        upload["projects"][0]["dependencies"] = deps_
+        assert import_sbom.upload_to_mend(upload, upload_args)["updatedProjects"] == ["Project"]
+    assert sent == [("OVERRIDE", [{"coordinates": {"artifactId": "Project"}, "dependencies": []}])] * 2
+
+
+def test_incremental_import(tmp_path, monkeypatch):
+    uploads = []
+    searched = []
+    known = {(f"lib{i}", "npm"): f"{i:040x}" for i in range(5)}
+    lib_api = fake_lib_search(known)
+
+    def api(header, data, agent=False, **kwargs):
+        if not agent:
+            searched.append(json.loads(data)["libraryName"])
+            return lib_api(header=header, data=data)
+        uploads.append({k: v[0] for k, v in parse_qs(data).items()})
+        return json.dumps({"status": 1, "data": json.dumps({
+            "organization": "Org", "createdProjects": [], "updatedProjects": ["Test SBOM"],
+            "projectNamesToIds": {"Test SBOM": 1}, "requestToken": "token"})})
+
+    monkeypatch.setattr(import_sbom, "call_api", api)
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0",
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:npm/lib{i}@1.0"}]}
+                for i in range(5)]
+    inc_args = Namespace(**{**vars(conftest.args), "sbom": write_sbom(tmp_path / "sbom.json", packages[:4]),
+                            "out_dir": str(tmp_path), "incremental": "delta", "scope_token": "", "ws_project": ""})
+
+    def run_import():
+        import_sbom.lib_results.clear()
+        manifest = load_manifest(str(tmp_path))
+        body = import_sbom.create_body(inc_args, manifest)
+        return body, import_sbom.upload_update_request(body, inc_args, manifest)[0]
+
+    body, upload = run_import()
+    assert upload is body and len(uploads) == 1
+    body, upload = run_import()  # Nothing is searched or uploaded again
+    assert upload is None and len(uploads) == 1
+    write_sbom(tmp_path / "sbom.json", packages)
+    body, upload = run_import()
+    assert len(body["projects"][0]["dependencies"]) == 5
+    assert uploads[-1]["updateType"] == "APPEND"
+    assert [dep_["artifactId"] for dep_ in json.loads(uploads[-1]["diff"])[0]["dependencies"]] == ["lib4"]
+
+    packages.append({**packages[0], "SPDXID": "SPDXRef-PACKAGE-lib5", "name": "lib5"})
+    write_sbom(tmp_path / "sbom.json", packages)
+    run_import()
+    known[("lib5", "npm")] = "5" * 40  # Added to Mend after the miss
+    searched.clear()
+    body, _ = run_import()
+    assert not searched and len(body["projects"][0]["dependencies"]) == 5
+    inc_args.cache_ttl = 0  # Miss has expired
+    body, _ = run_import()
+    assert searched == ["lib5"] and body["projects"][0]["dependencies"][-1]["sha1"] == "5" * 40
+
+
+def test_json_log_formatter():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = import_sbom.logger.makeRecord(import_sbom.logger.name, logging.ERROR, __file__, 42, "Failed: %s",
+                                               ("lib0",), sys.exc_info(), func="test_func")
+    line = json.loads(import_sbom.JsonLogFormatter().format(record))
+    assert (line["level"], line["function"], line["line"], line["message"]) == ("ERROR", "test_func", 42, "Failed: lib0")
+    assert "ValueError: boom" in line["exception"]
+
+
+def test_create_body_csv(tmp_path, caplog):
+    header = "name,downloadLocation,licenseConcluded,licenseInfoFromFiles,licenseDeclared,copyrightText,versionInfo," \
+             "packageFileName,supplier,originator,sha1,homepage"
+    row = "lib{0},,MIT,,MIT,,1.0,lib{0}.jar,,,{1},"
+    csv_file = tmp_path / "inventory.csv"
+    csv_file.write_text("\n".join([header, row.format(0, "a" * 40), "lib1,,MIT", row.format(2, "b" * 40) + ",extra",
+                                   row.format(3, "c" * 40)]) + "\n")
+
+    deps = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": str(csv_file)}))["projects"][0]["dependencies"]
+    assert [dep_["sha1"] for dep_ in deps] == ["a" * 40, "c" * 40]
+    assert "malformed CSV row at line 3" in caplog.text and "malformed CSV row at line 4" in caplog.text
+    assert import_sbom.csv_to_json(str(csv_file)) == list(import_sbom.read_csv_packages(str(csv_file)))
+
+    csv_file.write_text(header.replace(",sha1", "") + "\n")
+    with pytest.raises(SystemExit):
+        import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": str(csv_file)}))
+
+
+def test_update_request_formats(tmp_path):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}.jar", "name": f"lib{i}", "packageFileName": f"lib{i}.jar",
+                 "versionInfo": "1.0", "checksums": [{"algorithm": "SHA1", "checksumValue": f"{i:040x}"}]} for i in range(5)]
+    relationships = [{"spdxElementId": "SPDXRef-PACKAGE-lib0.jar", "relatedSpdxElement": "SPDXRef-PACKAGE-lib1.jar",
+                      "relationshipType": "DEPENDS_ON"}]
+    sbom = write_sbom(tmp_path / "sbom.json", packages, relationships)
+    output_json = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom}))
+    output_json["projects"].append({"projectToken": "token", "dependencies": []})
+    output_json["projects"][0]["dependencies"][0]["filename"] = "libé.jar"
+
+    for output_format in OUTPUT_FORMATS:
+        path = str(tmp_path / output_format)
+        write_update_request(path, output_json, output_format)
+        assert read_update_request(path) == output_json
+    with open(tmp_path / "json") as f:
+        assert f.read() == json.dumps(output_json, indent=4, default=encode_record)
+    with open(tmp_path / "compact") as f:
+        assert f.read() == json.dumps(output_json, separators=(",", ":"), default=encode_record)
+
+
+def test_benchmark(tmp_path):
+    rels = generate_relationships(40, depth=3, fanout=3)
+    assert len(rels) == 40 - 4  # Three full trees of 1 + 3 + 9 packages and the root of the fourth one
+    assert len(list(import_sbom.read_csv_packages(generate_csv(str(tmp_path / "sbom.csv"), 40)))) == 40
+
+    out = tmp_path / "bench.json"
+    assert import_bench.main(["--packages", "40", "--repeat", "1", "--latency", "0", "--errorRate", "0.1",
+                              "--threads", "4", "--out", str(out)]) == 0
+    with open(out) as f:
+        results = {res["scenario"]: res for res in json.load(f)["results"]}
+    assert list(results) == ["parse-json", "parse-stream", "parse-csv", "graph", "resolve", "upload"]
+    assert results["resolve"]["requests"] > 0 and results["upload"]["requests"] == 1
+
+
+def test_run_metrics(stub_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(import_sbom, "run_metrics", RunMetrics())
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0",
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:npm/lib{i}@1.0"}]}
+                for i in range(3)]
+    packages.append({**packages[0], "SPDXID": "SPDXRef-PACKAGE-copy"})  # The same library is searched once
+    stub_server.api = staticmethod(fake_lib_search({("lib0", "npm"): "a" * 40}))
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+    import_sbom.create_body(Namespace(**{**vars(import_sbom.args), "sbom": sbom}))
+    import_sbom.run_metrics.write(str(tmp_path / METRICS_FILE), str(tmp_path / PROMETHEUS_FILE))
+
+    with open(tmp_path / METRICS_FILE) as f:
+        metrics = json.load(f)
+    assert {"parse", "graph", "classify", "resolve", "tree"} <= set(metrics["phases"])
+    api = metrics["api"]["getBasicLibraryInfo"]
+    assert api["count"] == 3 and api["bytesSent"] > 0 and api["bytesReceived"] > 0
+    assert sum(api["latencyHistogram"].values()) == 3
+    assert metrics["cache"] == {"memoryHits": 1, "indexHits": 0, "diskHits": 0, "misses": 3, "hitRatio": 0.25}
+    assert metrics["langTypesTried"] == {"1": 4}
+    with open(tmp_path / PROMETHEUS_FILE) as f:
+        prom = f.read()
+    assert 'mend_import_sbom_api_requests_total{request_type="getBasicLibraryInfo"} 3' in prom
+    assert 'mend_import_sbom_api_latency_seconds_bucket{request_type="getBasicLibraryInfo",le="+Inf"} 3' in prom
+
+
+def test_lang_ranking(tmp_path, monkeypatch):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0"} for i in range(40)]
+    packages.append({"SPDXID": "SPDXRef-PACKAGE-pylib", "name": "pylib", "versionInfo": "1.0",
+                     "downloadLocation": "https://files.pythonhosted.org/packages/pylib-1.0.tar.gz"})
+    known = {(f"lib{i}", "go"): f"{i:040x}" for i in range(30)}  # The rest is not known in any type
+    known[("pylib", "pypi")] = "a" * 40
+    api_calls = []
+    api = fake_lib_search(known)
+    monkeypatch.setattr(import_sbom, "call_api", lambda **kwargs: api_calls.append(kwargs) or api(**kwargs))
+    monkeypatch.setattr(import_sbom, "lang_ranker", None)
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+    assert get_lang_signals(packages[-1], "pylib", "Tool: Test Generator") == {"pypi"}
+
+    static = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "lang_ranking": "false"}))
+    static_calls = len(api_calls)
+    import_sbom.lib_results.clear()
+    api_calls.clear()
+    ranked = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "lang_ranking": "true"}))
+    assert static["projects"][0]["dependencies"] == ranked["projects"][0]["dependencies"]
+    assert len(ranked["projects"][0]["dependencies"]) == 31
+    assert len(api_calls) < static_calls
+    assert import_sbom.lang_ranker.rank([(1, {"npm": "tgz"}), (2, {"go": "zip"})])[0][1] == {"go": "zip"}
+
+
+def test_lang_ranker_rates():
+    ranker = LangRanker()
+    for i in range(30):  # npm found more libraries, go found almost every library it was searched for
+        ranker.add_result("npm", i % 3 == 0)
+    for i in range(6):
+        ranker.add_result("go", i > 0)
+    candidates = [(1, {"npm": "js"}), (2, {"go": "go"}), (3, {"rust": "rs"})]
+    assert [next(iter(l_type[1])) for l_type in ranker.rank(candidates)] == ["go", "npm", "rust"]
+    assert not ranker.should_stop(candidates, {"go"})  # rust was never tried
+    for _ in range(20):
+        ranker.add_result("rust", False)
+    assert not ranker.should_stop(candidates, {"go"})  # npm still finds a third of libraries
+    assert ranker.should_stop(candidates, {"go", "npm"})
+
+
+def test_offline_resolution(tmp_path, monkeypatch):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0",
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:npm/lib{i}@1.0"}]}
+                for i in range(6)]
+    monkeypatch.setattr(import_sbom, "call_api", fake_lib_search({(f"lib{i}", "npm"): f"{i:040x}" for i in range(4)}))
+    monkeypatch.setattr(import_sbom, "lib_index", LibraryIndex(str(tmp_path / "index" / INDEX_FILE)))
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+    online = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom}))
+    assert import_sbom.lib_index.count() == 4  # Just libraries found are indexed
+
+    with open(tmp_path / "dump.csv", "w", newline="") as f:
+        f.write("libType,name,version,sha1,artifactId\nnpm,lib5,1.0," + "5" * 40 + ",lib5\n")
+    assert import_sbom.lib_index.import_dump(str(tmp_path / "dump.csv")) == 1
+    import_sbom.lib_results.clear()
+    monkeypatch.setattr(import_sbom, "call_api", lambda **kwargs: pytest.fail("Mend API must not be called"))
+    offline_args = Namespace(**{**vars(conftest.args), "sbom": sbom, "offline_resolution": "true"})
+    import_sbom.analyse_scope("Product//Project", offline_args)
+    offline = import_sbom.create_body(offline_args)
+    deps = offline["projects"][0]["dependencies"]
+    assert deps[:4] == online["projects"][0]["dependencies"]
+    assert [d["sha1"] for d in deps[4:]] == ["5" * 40]
+    assert offline_args.scope_token == "" and offline_args.ws_product == "Product"
+
+    other = LibraryIndex(str(tmp_path / "other.db"))
+    assert other.import_dump(import_sbom.lib_index.path) == 5
+    assert other.get("npm", "lib5", "1.0") == ("5" * 40, "lib5")
+    other.close()
+    import_sbom.lib_index.close()
+
+
+def test_sha1_type_indexes(tmp_path, monkeypatch):
+    for el_ in SHA1CalcType:
+        assert SHA1CalcType.get_el_by_name(el_.name) is el_ and SHA1CalcType.get_package_type(el_.name) is el_
+        assert SHA1CalcType.get_package_type_list_by_ext(el_.ext) == [t for t in SHA1CalcType if t.ext == el_.ext]
+        assert SHA1CalcType.get_package_data(el_.language) == next(t for t in SHA1CalcType
+                                                                    if t.language == el_.language).lower_case
+    assert SHA1CalcType.get_package_type("golang") == [] and SHA1CalcType.get_package_data("COBOL") == ""
+
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}.jar", "versionInfo": "1.0"} for i in range(30)]
+    monkeypatch.setattr(import_sbom, "call_api", fake_lib_search({}))
+    import_sbom.get_guessed_types.cache_clear()
+    import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": write_sbom(tmp_path / "sbom.json", packages)}))
+    cache_info = import_sbom.get_guessed_types.cache_info()
+    assert cache_info.misses == 1 and cache_info.hits == 29  # Classified once for the same creator and extension
+
+
+def test_split_projects(tmp_path, monkeypatch):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-{name}", "name": name} for name in ("compA", "compB")]
+    packages += [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0",
+                  "checksums": [{"algorithm": "SHA1", "checksumValue": f"{i:040x}"}]} for i in (1, 3, 4)]
+    packages.append({"SPDXID": "SPDXRef-PACKAGE-lib2", "name": "lib2", "versionInfo": "1.0",
+                     "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": "pkg:npm/lib2@1.0"}]})
+    relationships = [{"spdxElementId": "SPDXRef-DOCUMENT", "relatedSpdxElement": f"SPDXRef-PACKAGE-{name}",
+                      "relationshipType": "DESCRIBES"} for name in ("compA", "compB")]
+    relationships += [{"spdxElementId": f"SPDXRef-PACKAGE-{parent}", "relatedSpdxElement": f"SPDXRef-PACKAGE-{child}",
+                       "relationshipType": rel_type} for parent, child, rel_type in
+                      [("compA", "lib1", "CONTAINS"), ("compA", "lib2", "DEPENDS_ON"), ("compB", "lib2", "CONTAINS"),
+                       ("compB", "lib3", "CONTAINS"), ("lib3", "lib1", "DEPENDS_ON")]]
+    api_calls = []
+    api = fake_lib_search({("lib2", "npm"): "2" * 40})
+    monkeypatch.setattr(import_sbom, "call_api", lambda **kwargs: api_calls.append(kwargs) or api(**kwargs))
+    sbom = write_sbom(tmp_path / "sbom.json", packages, relationships)
+
+    def get_deps(project):
+        return {dep_["artifactId"]: [child["artifactId"] for child in dep_.get("children", [])]
+                for dep_ in project["dependencies"]}
+
+    out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "split_projects": "true"}))
+    assert [prj["coordinates"]["artifactId"] for prj in out["projects"][:2]] == ["compA", "compB"]
+    assert out["projects"][2]["projectToken"] == conftest.args.scope_token  # Packages of no component
+    assert [get_deps(prj) for prj in out["projects"]] == [{"lib1": [], "lib2": []}, {"lib1": [], "lib2": [], "lib3": []},
+                                                          {"lib4": []}]
+    assert len(api_calls) == 1  # Shared package is resolved once
+
+    with open(tmp_path / "mapping.json", "w") as f:
+        json.dump({"Component B": ["SPDXRef-PACKAGE-compB"]}, f)
+    out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom,
+                                               "project_mapping": str(tmp_path / "mapping.json")}))
+    assert [get_deps(prj) for prj in out["projects"]] == [{"lib1": [], "lib2": [], "lib3": []}, {"lib4": []}]
+    assert out["projects"][0]["coordinates"]["artifactId"] == "Component B"
+
+
+def test_stable_tree(tmp_path, monkeypatch):
+    names = ["libA", "libB", "libC", "libD", "libE"]
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-{name}", "name": name, "versionInfo": "1.0",
+                 "checksums": [{"algorithm": "SHA1", "checksumValue": f"{i:040x}"}]} for i, name in enumerate(names[:4])]
+    packages.append({"SPDXID": "SPDXRef-PACKAGE-libE", "name": "libE", "versionInfo": "1.0",  # Found by search
+                     "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": "pkg:npm/libE@1.0"}]})
+    relationships = [{"spdxElementId": f"SPDXRef-PACKAGE-{parent}", "relatedSpdxElement": f"SPDXRef-PACKAGE-{child}",
+                      "relationshipType": "DEPENDS_ON"} for parent, child in
+                     [("libA", "libC"), ("libA", "libB"), ("libB", "libD"), ("libC", "libD"), ("libD", "libA"),
+                      ("libD", "libE")]]  # Diamond with a cycle back to the top
+    monkeypatch.setattr(import_sbom, "call_api", fake_lib_search({("libE", "npm"): "e" * 40}))
+
+    def get_tree(node):
+        return {node["artifactId"]: [get_tree(child) for child in node.get("children", [])]}
+
+    outputs = []
+    for order in (packages, packages[::-1]):
+        sbom = write_sbom(tmp_path / "sbom.json", order, relationships)
+        out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "tree_mode": "stable"}))
+        outputs.append(json.dumps(out["projects"], default=encode_record))
+    assert outputs[0] == outputs[1]  # Byte for byte the same whatever the order of packages is
+    deps = json.loads(outputs[0])[0]["dependencies"]
+    assert [get_tree(dep_) for dep_ in deps] == [
+        {"libA": [{"libB": [{"libD": [{"libE": []}]}]}, {"libC": [{"libD": []}]}]}]
+
+    out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "tree_mode": "stable",
+                                               "max_tree_nodes": 3}))
+    assert [get_tree(dep_) for dep_ in out["projects"][0]["dependencies"]] == [
+        {"libA": [{"libB": [{"libD": []}]}]}, {"libC": []}, {"libE": []}]
+    out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "tree_mode": "stable",
+                                               "max_tree_depth": 1}))
+    assert [get_tree(dep_) for dep_ in out["projects"][0]["dependencies"]] == [
+        {"libA": [{"libB": []}, {"libC": []}]}, {"libD": [{"libA": []}, {"libE": []}]}]
+
+
+def test_sha1_policy(tmp_path, monkeypatch):
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-{name}", "name": name, "versionInfo": "1.0-RC",
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:{purl_type}/{name}"}]}
+                for name, purl_type in (("Guava", "maven"), ("Left-Pad", "npm"), ("Rails", "ocaml"), ("Cobra", "go"))]
+    packages.append({"SPDXID": "SPDXRef-PACKAGE-nopurl", "name": "nopurl", "versionInfo": "2.0"})
+    api_calls = []
+    api = fake_lib_search({("nopurl", "pypi"): "f" * 40, ("Guava", "maven"): "e" * 40})
+    monkeypatch.setattr(import_sbom, "call_api", lambda **kwargs: api_calls.append(kwargs) or api(**kwargs))
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+
+    def run(**kwargs):
+        api_calls.clear()
+        import_sbom.lib_results.clear()
+        out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, **kwargs}))
+        return {dep_["artifactId"]: dep_["sha1"] for dep_ in out["projects"][0]["dependencies"]}
+
+    local = {"Rails": hashlib.sha1(b"Rails_1.0-RC_Opam").hexdigest(),
+             "Cobra": hashlib.sha1(b"Cobra_1.0-RC_GO").hexdigest()}
+    # Maven and npm libraries are keyed by SHA1 of the artifact, which is not made up by default
+    assert run(sha1_policy="local") == local and not api_calls
+    assert run(sha1_policy="local-then-remote") == {**local, "Guava": "e" * 40, "nopurl": "f" * 40}
+    assert {json.loads(call["data"])["libraryName"] for call in api_calls} == {"Guava", "Left-Pad", "nopurl"}
+    assert run(sha1_policy="local-then-remote", local_sha1_types="npm") == {
+        "Left-Pad": hashlib.sha1(b"left-pad_1.0-rc_NPM").hexdigest(), "Guava": "e" * 40, "nopurl": "f" * 40}
+    assert run() == {"Guava": "e" * 40, "nopurl": "f" * 40}
+
+
+def test_service(tmp_path, monkeypatch):
+    search = fake_lib_search({("lib0", "npm"): "a" * 40})
+    vitals = []
+
+    def call_api(header, data, agent=False, method="POST", agent_info_login=False):
+        req = json.loads(data)
+        if req["requestType"] == "getProjectVitals":
+            vitals.append(req["projectToken"])
+            return json.dumps({"projectVitals": [{"token": "prj-token"}]})
+        return search(header, data, agent, method, agent_info_login)
+
+    monkeypatch.setattr(import_sbom, "call_api", call_api)
+    monkeypatch.setattr(import_sbom, "scope_tokens", {})
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-lib{i}", "name": f"lib{i}", "versionInfo": "1.0",
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:npm/lib{i}@1.0"}]}
+                for i in range(3)]
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+    with open(sbom) as f:
+        sbom_body = json.load(f)
+    service = ImportService(Namespace(**{**vars(conftest.args), "offline": "true", "out_dir": str(tmp_path / "out")}),
+                            import_sbom.import_batch_item, workers=1)
+    server = create_server("127.0.0.1:0", service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def call(path, body=None):
+        req = Request(url + path, data=json.dumps(body).encode() if body is not None else None,
+                      method="GET" if body is None else "POST")
+        try:
+            with urlopen(req, timeout=10) as res:
+                return res.status, json.loads(res.read())
+        except HTTPError as err:
+            return err.code, json.loads(err.read())
+
+    try:
+        status, first = call("/jobs", {"sbom": sbom, "scope": "Product//Project"})
+        assert status == 202 and first["status"] in ("queued", "running")
+        status, second = call("/jobs", {"sbomBody": sbom_body, "scope": "Product//Project", "updateType": "APPEND"})
+        assert status == 202
+        assert call("/jobs", {"scope": "Product//Project"})[0] == 400
+        assert call("/jobs/unknown")[0] == 404
+        jobs = {}
+        deadline = time.monotonic() + 30
+        while len(jobs) < 2 and time.monotonic() < deadline:
+            for job_id in (first["id"], second["id"]):
+                job = call(f"/jobs/{job_id}")[1]
+                if job["status"] in ("done", "failed"):
+                    jobs[job_id] = job
+            time.sleep(0.05)
+        for job in jobs.values():
+            assert job["status"] == "done" and job["result"]["status"] == "created"
+            assert read_update_request(job["result"]["updateRequest"])["projects"][0]["projectToken"] == "prj-token"
+        assert jobs[second["id"]]["updateType"] == "APPEND" and len(jobs) == 2
+        assert call("/health")[1]["jobs"] == {"queued": 0, "running": 0, "done": 2, "failed": 0}
+        assert vitals == ["Project"]  # Project token is resolved by the first job and kept for the second one
+
+        first_dir = tmp_path / "out" / "jobs" / first["id"]
+        assert first_dir.is_dir()
+        monkeypatch.setattr(import_service, "MAX_FINISHED_JOBS", 1)
+        assert call("/jobs", {"sbom": sbom, "scope": "Product//Project"})[0] == 202
+        assert call(f"/jobs/{first['id']}")[0] == 404 and not first_dir.exists()  # Oldest finished job is dropped
+        assert (tmp_path / "out" / "jobs" / second["id"]).is_dir()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+    not_socket = tmp_path / "service.txt"
+    not_socket.write_text("Not a socket")
+    with pytest.raises(ValueError):
+        create_server(f"unix:{not_socket}", service)
+    assert not_socket.read_text() == "Not a socket"
+    for _ in range(2):  # Socket left by previous service is replaced
+        create_server(f"unix:{tmp_path / 'service.sock'}", service).server_close()
+
+
+def test_dependency_record():
+    wire = {"artifactId": "lib1", "version": "1.0", "sha1": "a" * 40, "systemPath": "", "optional": False,
+            "filename": "lib1-1.0.jar", "checksums": {"SHA1": "a" * 40}, "dependencyFile": ""}
+    rec = DependencyRecord("lib1", "1.0", "a" * 40, "lib1-1.0.jar")
+    assert rec == wire and dict(rec) == wire and "children" not in rec
+    assert DependencyRecord("lib2", "1.0", "b" * 40, "lib2").file_name is None  # Kept once if it is artifactId
+    assert rec.version is DependencyRecord("lib3", "".join(["1.", "0"]), "c" * 40).version  # Interned
+
+    child = DependencyRecord("lib2", "1.0", "b" * 40, "lib2", children=[])
+    rec.setdefault("children", []).append(child)
+    wire["children"] = [{**dict(child), "children": []}]
+    assert json.dumps(rec, default=encode_record) == json.dumps(wire)
+    assert DependencyRecord.from_wire(wire) == rec and pickle.loads(pickle.dumps(rec)) == rec
+    node = rec.copy()
+    assert node.pop("children") == [child] and "children" not in node and "children" in rec
+
+
+def test_normalize_lookups(tmp_path, monkeypatch):
+    search = fake_lib_search({("foo", "npm"): "f" * 40, ("Bar", "pypi"): "b" * 40, ("bar", "pypi"): "c" * 40})
+    searches = []
+
+    def call_api(header, data, agent=False, method="POST", agent_info_login=False):
+        req = json.loads(data)
+        searches.append((req["libraryName"], req["libraryVersion"], req["libraryType"]))
+        return search(header, data, agent, method, agent_info_login)
+
+    monkeypatch.setattr(import_sbom, "call_api", call_api)
+    libs = [("Foo", "^1.0", "npm"), ("foo", "1.0", "npm"), ("foo ", "~1.0", "npm"), ("foo", "1.0", "npm"),
+            ("Bar", "==2.0", "pypi"), ("bar", "2.0", "pypi")]  # Python names are not case insensitive for Mend
+    packages = [{"SPDXID": f"SPDXRef-PACKAGE-{i}", "name": name, "versionInfo": ver,
+                 "externalRefs": [{"referenceCategory": "PACKAGE_MANAGER", "referenceLocator": f"pkg:{type_}/x@1"}]}
+                for i, (name, ver, type_) in enumerate(libs)]
+    sbom = write_sbom(tmp_path / "sbom.json", packages)
+
+    for normalize, expected in (("false", 5), ("true", 3)):
+        searches.clear()
+        monkeypatch.setattr(import_sbom, "lib_results", MemoryCache())
+        monkeypatch.setattr(import_sbom, "run_metrics", RunMetrics())
+        out = import_sbom.create_body(Namespace(**{**vars(conftest.args), "sbom": sbom, "tree_mode": "stable",
+                                                   "normalize": normalize, "threads": 2}))
+        assert len(searches) == expected
+        assert import_sbom.run_metrics.to_dict()["lookups"] == {"requested": 6, "unique": expected,
+                                                                "saved": 6 - expected}
+    assert sorted(searches) == [("Bar", "2.0", "pypi"), ("bar", "2.0", "pypi"), ("foo", "1.0", "npm")]
+    deps = out["projects"][0]["dependencies"]
+    assert len(deps) == 6 and sorted(dep_["sha1"] for dep_ in deps) == ["b" * 40, "c" * 40] + ["f" * 40] * 4
+
+
+def test_upload_file(stub_server, tmp_path, monkeypatch):
+    uploads = []
+
+    def api(header, data):
+        if data.startswith("{"):  # getOrganizationDetails
+            return "{}"
+        uploads.append({k: v[0] for k, v in parse_qs(data).items()})
+        return json.dumps({"status": 1, "data": json.dumps({
+            "organization": "Org", "createdProjects": ["Saved"], "updatedProjects": [],
+            "projectNamesToIds": {"Saved": 1}, "requestToken": "token"})})
+
+    stub_server.api = staticmethod(api)
+    request = import_sbom.get_update_request_body(
+        Namespace(update_type="APPEND", ws_token="saved-org", ws_user_key="saved-user", ws_product="Saved Product"),
+        [{"coordinates": {"artifactId": "Saved"}, "dependencies": [DependencyRecord("lib0", "1.0", "a" * 40)]}], 0)
+    argv = ["import_sbom", "--userKey", "user", "--apiKey", "org", "--url", "mend.local", "--dir", str(tmp_path),
+            "--noCache"]
+    for output_format in OUTPUT_FORMATS:  # Scope is not resolved, everything is read from the request file
+        path = str(tmp_path / f"request-{output_format}")
+        write_update_request(path, request, output_format)
+        monkeypatch.setattr(sys, "argv", [*argv, "--uploadFile", path])
+        uploads.clear()
+        import_sbom.main()
+        assert [(u["product"], u["token"], u["userKey"], u["updateType"]) for u in uploads] == \
+            [("Saved Product", "saved-org", "saved-user", "APPEND")]
+        assert json.loads(uploads[0]["diff"])[0]["dependencies"][0]["sha1"] == "a" * 40
+
+    stub_server.api = staticmethod(lambda header, data: "{}" if data.startswith("{") else json.dumps(
+        {"status": 0, "message": "Failed", "data": "{}"}))
+    with pytest.raises(SystemExit) as exit_:
+        import_sbom.main()
+    assert exit_.value.code != 0
+
+
+def test_call_api_proxy(stub_server, monkeypatch):
+    sent = []
+
+    def send(adapter, request, **kwargs):
+        sent.append(kwargs["proxies"])
+        resp = requests.Response()
+        resp.status_code, resp._content = 200, b"{}"
+        return resp
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    monkeypatch.setenv("HTTP_PROXY", "http://env-proxy:3128")
+    monkeypatch.setenv("HTTPS_PROXY", "http://env-proxy:3128")
+    monkeypatch.setattr(import_sbom, "args", Namespace(**{**vars(import_sbom.args), "proxy": "https://configured-proxy:8080",
+                                                          "proxyuser": "", "proxypsw": ""}))
+    import_sbom.call_api(header={}, data=json.dumps({"requestType": "getOrganizationDetails"}))
+    import_sbom.call_api(header={}, data="type=UPDATE", agent=True)
+    assert [proxies["http"] for proxies in sent] == ["http://configured-proxy:8080"] * 2  # Not the environment one
+
+    sent.clear()
+    monkeypatch.setattr(import_sbom.args, "proxy", "")
+    import_sbom.call_api(header={}, data=json.dumps({"requestType": "getOrganizationDetails"}))
+    assert sent[0]["http"] == "http://env-proxy:3128"
+
+
 if __name__ == '__main__':
     pytest.main()
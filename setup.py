@@ -19,6 +19,7 @@ setuptools.setup(
     long_description=open("README.md").read(),
     long_description_content_type="text/markdown",
     install_requires=[line.strip() for line in open("requirements.txt").readlines()],
+    extras_require={"async": ["aiohttp~=3.9"]},
     python_requires='>=3.9',
     classifiers=[
         "Programming Language :: Python :: 3.9",